@@ -6,6 +6,7 @@ from .routers import OptionalSlashRouter
 
 router = OptionalSlashRouter()
 router.register(r'documents', document_views.DocumentViewSet)
+router.register(r'upload_sessions', document_views.UploadSessionViewSet)
 
 urlpatterns = [
     path('docs/', include_docs_urls(title='Documents Service')),
@@ -4,4 +4,8 @@ echo $(date -u) " - Migrating"
 python manage.py migrate
 
 echo $(date -u) "- Running the server"
-gunicorn -b 0.0.0.0:8080 documents-service.wsgi
+# Metrics of the gunicorn workers, see documents/metrics.py
+export prometheus_multiproc_dir=${prometheus_multiproc_dir:-/tmp/prometheus}
+rm -rf "$prometheus_multiproc_dir"
+mkdir -p "$prometheus_multiproc_dir"
+gunicorn -c documents-service/gunicorn.conf.py documents-service.wsgi
@@ -0,0 +1,12 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+app = Celery('documents-service')
+
+# All Celery settings are read from the Django settings with a CELERY_ prefix
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
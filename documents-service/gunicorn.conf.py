@@ -0,0 +1,34 @@
+"""
+Gunicorn configuration, used by docker-entrypoint.sh.
+
+The sync workers hold their process until a response is sent completely,
+so every slow download takes a whole worker. With
+GUNICORN_WORKER_CLASS=gevent a worker serves up to
+GUNICORN_WORKER_CONNECTIONS requests at once, one greenlet each, and the
+streamed downloads and thumbnails wait for the storage and the client
+without blocking the other requests.
+
+The metrics of all workers are collected from prometheus_multiproc_dir,
+which docker-entrypoint.sh empties before the start.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8080')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # Database queries wait without blocking the other greenlets
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def child_exit(server, worker):
+    if os.getenv('prometheus_multiproc_dir'):
+        # Keeps the counters of the worker, drops its live values
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
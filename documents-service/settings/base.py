@@ -53,6 +53,8 @@ INSTALLED_APPS = INSTALLED_APPS_DJANGO + INSTALLED_APPS_THIRD_PARTIES + \
                  INSTALLED_APPS_LOCAL
 
 MIDDLEWARE = [
+    # First, so it measures the whole request
+    'documents.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -155,7 +157,8 @@ REST_FRAMEWORK = {
 
 # MEDIA CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#media-root
-MEDIA_ROOT = os.path.normpath(os.path.join(BASE_DIR, 'media'))
+MEDIA_ROOT = os.getenv('MEDIA_ROOT',
+                       os.path.normpath(os.path.join(BASE_DIR, 'media')))
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = '/media/'
@@ -163,13 +166,107 @@ MEDIA_URL = '/media/'
 
 # AWS Configuration
 
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Files are stored on S3, set DEFAULT_FILE_STORAGE to
+# django.core.files.storage.FileSystemStorage to store them in MEDIA_ROOT
+DEFAULT_FILE_STORAGE = os.getenv('DEFAULT_FILE_STORAGE',
+                                 'storages.backends.s3boto3.S3Boto3Storage')
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_SECRET')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_SECURE_URLS = True
 AWS_DEFAULT_ACL = None
 
+# documents.storage.CachedS3Storage keeps the files it reads from S3 in
+# DOCUMENT_STORAGE_CACHE_DIR, at most DOCUMENT_STORAGE_CACHE_SIZE bytes of
+# the most recently read ones. Larger files than
+# DOCUMENT_STORAGE_CACHE_MAX_FILE_SIZE (0 for no limit) are not cached.
+DOCUMENT_STORAGE_CACHE_DIR = os.getenv('DOCUMENT_STORAGE_CACHE_DIR',
+                                       '/tmp/documents-storage-cache')
+DOCUMENT_STORAGE_CACHE_SIZE = int(os.getenv('DOCUMENT_STORAGE_CACHE_SIZE',
+                                            1024 * 1024 * 1024))
+DOCUMENT_STORAGE_CACHE_MAX_FILE_SIZE = int(os.getenv(
+    'DOCUMENT_STORAGE_CACHE_MAX_FILE_SIZE', 100 * 1024 * 1024))
+
+# Downloads are streamed through the service ('proxy') or redirected to a
+# presigned S3 URL valid for DOCUMENT_PRESIGNED_URL_EXPIRE seconds
+# ('redirect'). Storages without presigned URLs always use 'proxy'.
+DOCUMENT_DOWNLOAD_MODE = os.getenv('DOCUMENT_DOWNLOAD_MODE', 'proxy')
+DOCUMENT_PRESIGNED_URL_EXPIRE = int(os.getenv(
+    'DOCUMENT_PRESIGNED_URL_EXPIRE', 60))
+
+# Celery Configuration
+# Without a broker the tasks (e.g. thumbnail generation) run eagerly in the
+# request process. Set CELERY_TASK_ALWAYS_EAGER=False when running workers.
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+CELERY_TASK_ALWAYS_EAGER = False if \
+    os.getenv('CELERY_TASK_ALWAYS_EAGER') == 'False' else True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Maximum size of an uploaded file in bytes, 0 disables the limit
+DOCUMENT_MAX_UPLOAD_SIZE = int(os.getenv('DOCUMENT_MAX_UPLOAD_SIZE',
+                                         500 * 1024 * 1024))
+
+# Base64 encoded files larger than this are decoded to a temporary file
+DOCUMENT_BASE64_MAX_MEMORY_SIZE = int(os.getenv(
+    'DOCUMENT_BASE64_MAX_MEMORY_SIZE', 2621440))
+
+# Default chunk size of the resumable uploads, at least 5 MiB for S3
+DOCUMENT_UPLOAD_CHUNK_SIZE = int(os.getenv('DOCUMENT_UPLOAD_CHUNK_SIZE',
+                                           8 * 1024 * 1024))
+
+# Thumbnails and renditions are not generated for images which need more
+# pixels to be decoded. JPEGs count at the reduced size they are decoded at.
+DOCUMENT_IMAGE_MAX_PIXELS = int(os.getenv('DOCUMENT_IMAGE_MAX_PIXELS',
+                                          50 * 1000 * 1000))
+
+# Maximum number of documents created by one bulk request
+DOCUMENT_BULK_MAX_ITEMS = int(os.getenv('DOCUMENT_BULK_MAX_ITEMS', 100))
+
+# /metrics answers requests from the METRICS_ALLOWED_NETWORKS (comma
+# separated addresses or networks, compared with REMOTE_ADDR) and requests
+# with the bearer token METRICS_TOKEN, if it is set
+METRICS_ALLOWED_NETWORKS = [
+    network for network in os.getenv('METRICS_ALLOWED_NETWORKS',
+                                      '127.0.0.1,::1').split(',')
+    if network]
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Sizes (WIDTHxHEIGHT) which can be requested as image renditions
+DOCUMENT_RENDITION_SIZES = [
+    tuple(int(value) for value in size.split('x'))
+    for size in os.getenv('DOCUMENT_RENDITION_SIZES',
+                          '100x100,200x200,400x400,800x800,1600x1600'
+                          ).split(',')]
+
+# Text of txt, pdf, docx, xlsx and pptx files is extracted in a child
+# process, killed after DOCUMENT_TEXT_EXTRACTION_TIMEOUT seconds and limited
+# to DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY bytes of address space. At most
+# DOCUMENT_TEXT_MAX_LENGTH characters are indexed per document.
+DOCUMENT_TEXT_EXTRACTION_TIMEOUT = int(os.getenv(
+    'DOCUMENT_TEXT_EXTRACTION_TIMEOUT', 60))
+DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY = int(os.getenv(
+    'DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY', 512 * 1024 * 1024))
+DOCUMENT_TEXT_MAX_LENGTH = int(os.getenv('DOCUMENT_TEXT_MAX_LENGTH', 200000))
+
+# Cache, local memory by default. Use a shared backend (e.g. memcached or
+# redis) when running several processes.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Document list responses are cached in this cache for
+# DOCUMENT_LIST_CACHE_TIMEOUT seconds, 0 (the default) disables the cache.
+# The invalidation of a local memory cache only reaches the process which
+# changed the documents, use a shared backend with several processes.
+DOCUMENT_LIST_CACHE_ALIAS = os.getenv('DOCUMENT_LIST_CACHE_ALIAS', 'default')
+DOCUMENT_LIST_CACHE_TIMEOUT = int(os.getenv('DOCUMENT_LIST_CACHE_TIMEOUT', 0))
+
 # file storage options ['local','S3','gdrive','office365']
 # TODO: add integration for gdrive and office365
 FILE_STORAGE = "local"
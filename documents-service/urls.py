@@ -15,7 +15,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path, re_path
-from documents.views import document_download_view, document_thumbnail_view
+from documents.metrics import metrics_view
+from documents.views import (document_download_view,
+                             document_rendition_view,
+                             document_thumbnail_view)
 from rest_framework import permissions
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.conf.urls.static import static
@@ -44,8 +47,10 @@ urlpatterns = [
          name='schema-swagger-ui'),
     path('', include('api.urls')),
     path('health_check/', include('health_check.urls')),
+    path('metrics', metrics_view),
     re_path(r'^file/(?P<id>\w+)/$', document_download_view),
     re_path(r'^thumbnail/(?P<id>\w+)/$', document_thumbnail_view),
+    re_path(r'^rendition/(?P<id>\w+)/$', document_rendition_view),
 ]
 
 urlpatterns += staticfiles_urlpatterns() \
@@ -0,0 +1,21 @@
+import logging
+
+from django.apps import AppConfig
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentsConfig(AppConfig):
+    name = 'documents'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .caching import get_cache
+
+        if settings.DOCUMENT_LIST_CACHE_TIMEOUT and \
+                isinstance(get_cache(), LocMemCache):
+            logger.warning('The document list cache is kept in local '
+                           'memory: changes only invalidate the pages '
+                           'cached by the process which made them.')
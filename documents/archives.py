@@ -0,0 +1,99 @@
+import logging
+import posixpath
+import zipfile
+
+from django.utils import timezone
+
+from .images import IMAGE_FORMATS
+from .storage import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+# Earliest date a ZIP file entry can have
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class _ZipStream(object):
+    """
+    Write-only, unseekable file object which keeps the data written by
+    `ZipFile` until it is collected with `read`.
+    """
+    def __init__(self):
+        self.data = []
+        self.position = 0
+
+    def write(self, data):
+        self.data.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def read(self):
+        data = b''.join(self.data)
+        self.data = []
+        return data
+
+
+def _get_entry_name(file_name, used_names):
+    name = file_name.replace('/', '_').replace('\\', '_') or 'document'
+    root, extension = posixpath.splitext(name)
+    number = 1
+    while name.lower() in used_names:
+        number += 1
+        name = '{} ({}){}'.format(root, number, extension)
+    used_names.add(name.lower())
+    return name
+
+
+def stream_archive(documents):
+    """
+    Yields a ZIP archive with the files of `documents`, built while it is
+    sent. Only one chunk of a file is held in memory at a time. Images are
+    stored as they are, since their formats are compressed already, other
+    files are deflated.
+    """
+    stream = _ZipStream()
+    used_names = set()
+
+    with zipfile.ZipFile(stream, 'w', allowZip64=True) as archive:
+        for document in documents:
+            if not document.file:
+                continue
+
+            chunks = iter_chunks(document.file.storage, document.file.name)
+            try:
+                first_chunk = next(chunks, b'')
+            except Exception:
+                # A missing file must not break the whole archive
+                logger.exception('Reading the file of document %s failed',
+                                 document.pk)
+                continue
+
+            date = timezone.localtime(document.upload_date or timezone.now())
+            entry = zipfile.ZipInfo(
+                _get_entry_name(document.file_name, used_names),
+                date_time=max(date.timetuple()[:6], ZIP_MIN_DATE_TIME))
+            if document.file_type in IMAGE_FORMATS:
+                entry.compress_type = zipfile.ZIP_STORED
+            else:
+                entry.compress_type = zipfile.ZIP_DEFLATED
+
+            size = document.file_size
+            if size is not None:
+                entry.file_size = size
+
+            with archive.open(entry, 'w',
+                              force_zip64=size is None) as entry_file:
+                entry_file.write(first_chunk)
+                yield stream.read()
+                for chunk in chunks:
+                    entry_file.write(chunk)
+                    yield stream.read()
+            yield stream.read()
+
+    yield stream.read()
@@ -0,0 +1,102 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Scope of the lists which are not limited to a workflowlevel
+GLOBAL_SCOPE = 'all'
+WORKFLOWLEVEL_FIELDS = ('workflowlevel1_uuids', 'workflowlevel2_uuids')
+
+
+def get_cache():
+    return caches[settings.DOCUMENT_LIST_CACHE_ALIAS]
+
+
+def get_workflowlevel_scope(field, value):
+    return '{}:{}'.format(field, value)
+
+
+def get_request_scopes(query_params):
+    """
+    Returns the scopes of a list request: the workflowlevels it is filtered
+    by, or the global scope if it is not filtered by any.
+    """
+    scopes = []
+    for field in WORKFLOWLEVEL_FIELDS:
+        value = query_params.get(field[:-1])
+        if value is not None:
+            scopes.append(get_workflowlevel_scope(field, value))
+    return scopes or [GLOBAL_SCOPE]
+
+
+def get_document_scopes(*documents):
+    """
+    Returns the scopes of the lists which may contain `documents`, dicts or
+    objects with the workflowlevel fields.
+    """
+    scopes = {GLOBAL_SCOPE}
+    for document in documents:
+        for field in WORKFLOWLEVEL_FIELDS:
+            if isinstance(document, dict):
+                values = document.get(field)
+            else:
+                values = getattr(document, field, None)
+            scopes.update(get_workflowlevel_scope(field, value)
+                          for value in values or ())
+    return scopes
+
+
+def _get_version_key(scope):
+    return 'documents:list:version:{}'.format(scope)
+
+
+def get_versions(scopes):
+    """
+    Returns the current version counters of `scopes`. Missing counters
+    start at the current time, so a counter which was evicted never
+    repeats an older version.
+    """
+    cache = get_cache()
+    keys = [_get_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    """
+    Increments the version counters of `scopes`, which makes the cached
+    list pages of these scopes stale.
+    """
+    def bump():
+        cache = get_cache()
+        for scope in scopes:
+            try:
+                cache.incr(_get_version_key(scope))
+            except ValueError:
+                # Counters which do not exist are started when read
+                pass
+
+    scopes = list(scopes)
+    bump()
+    # A request may have cached the old rows under the new version before
+    # the changes were committed
+    transaction.on_commit(bump)
+
+
+def get_list_cache_key(request):
+    """
+    Returns the cache key of the list response to `request`, which changes
+    with the URL (filters, ordering, cursor and page size) and the versions
+    of the scopes of the request.
+    """
+    scopes = get_request_scopes(request.query_params)
+    versions = get_versions(scopes)
+    url = request.build_absolute_uri()
+    return 'documents:list:{}'.format(hashlib.sha1('{} {}'.format(
+        url, versions).encode()).hexdigest())
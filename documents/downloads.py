@@ -0,0 +1,226 @@
+import calendar
+import hashlib
+import mimetypes
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connections
+from django.http import (HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .storage import iter_chunks
+
+DOWNLOAD_MODE_PROXY = 'proxy'
+DOWNLOAD_MODE_REDIRECT = 'redirect'
+
+# Requests with more ranges are answered with the whole file
+MAX_RANGES = 16
+RANGE_BLOCK_SIZE = 64 * 1024
+RANGE_HEADER_RE = re.compile(r'^\s*bytes\s*=\s*(.+)$', re.IGNORECASE)
+
+
+def can_presign(storage):
+    """
+    Returns True if the storage creates signed, expiring URLs.
+    """
+    return isinstance(storage, S3Boto3Storage) and \
+        storage.querystring_auth and not storage.custom_domain
+
+
+def get_etag(field_file):
+    """
+    Returns a strong ETag for the stored file. Stored files are never
+    overwritten, every upload gets a new name, so the name identifies the
+    content.
+    """
+    return '"%s"' % hashlib.sha1(field_file.name.encode('utf-8')).hexdigest()
+
+
+def get_last_modified(field_file):
+    """
+    Returns the modification time of the stored file as timestamp or None
+    if the storage does not provide it.
+    """
+    try:
+        modified_time = field_file.storage.get_modified_time(field_file.name)
+    except (NotImplementedError, IOError):
+        return None
+    return calendar.timegm(modified_time.utctimetuple())
+
+
+def parse_range_header(header, size):
+    """
+    Parses the value of a Range header into a list of inclusive
+    (start, end) byte positions. Returns None if the header is invalid and
+    has to be ignored, and an empty list if no range is satisfiable.
+    """
+    match = RANGE_HEADER_RE.match(header)
+    if not match:
+        return None
+
+    ranges = []
+    for spec in match.group(1).split(','):
+        start, separator, end = spec.strip().partition('-')
+        start, end = start.strip(), end.strip()
+        if not separator:
+            return None
+
+        if not start:
+            # Suffix range with the last `end` bytes
+            if not end.isdigit():
+                return None
+            if int(end) > 0 and size > 0:
+                ranges.append((max(size - int(end), 0), size - 1))
+            continue
+
+        if not start.isdigit() or (end and not end.isdigit()):
+            return None
+        start = int(start)
+        if end and int(end) < start:
+            return None
+        if start < size:
+            end = int(end) if end else size - 1
+            ranges.append((start, min(end, size - 1)))
+
+    return ranges
+
+
+def _release_connections(chunks):
+    """
+    Closes the database connections before the first chunk is sent. The
+    view is done with the database, a slow client must not keep a
+    connection for the whole download.
+    """
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+    for chunk in chunks:
+        yield chunk
+
+
+def _streaming_response(chunks, **kwargs):
+    return StreamingHttpResponse(_release_connections(chunks), **kwargs)
+
+
+def _stream_ranges(field_file, ranges, parts):
+    for (start, end), (header, footer) in zip(ranges, parts):
+        if header:
+            yield header
+        for data in iter_chunks(field_file.storage, field_file.name,
+                                RANGE_BLOCK_SIZE, start, end):
+            yield data
+        if footer:
+            yield footer
+
+
+def _range_response(field_file, ranges, size, content_type):
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = _streaming_response(
+            _stream_ranges(field_file, ranges, [(None, None)]),
+            status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        header = ('--%s\r\nContent-Type: %s\r\n'
+                  'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                      boundary, content_type, start, end, size))
+        parts.append((header.encode('ascii'), b'\r\n'))
+    closing = ('--%s--\r\n' % boundary).encode('ascii')
+    # The closing boundary is sent as footer of the last part
+    parts[-1] = (parts[-1][0], parts[-1][1] + closing)
+
+    response = _streaming_response(
+        _stream_ranges(field_file, ranges, parts), status=206,
+        content_type='multipart/byteranges; boundary=%s' % boundary)
+    response['Content-Length'] = sum(
+        len(header) + end - start + 1 + len(footer)
+        for (start, end), (header, footer) in zip(ranges, parts))
+    return response
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date == last_modified
+
+
+def serve_file(request, field_file, file_name, size=None,
+               modified_date=None, content_type=None):
+    """
+    Returns a response for downloading `field_file` as `file_name`.
+
+    Conditional requests are answered without opening the stored file. In
+    the redirect mode the client is sent to a short-lived presigned URL
+    of the storage, otherwise the file, or the requested byte ranges of
+    it, is streamed through the service. The `size` and `modified_date`
+    are requested from the storage and the `content_type` is guessed from
+    the file name if they are not given.
+    """
+    etag = get_etag(field_file)
+    last_modified = None
+    if modified_date is not None:
+        last_modified = calendar.timegm(modified_date.utctimetuple())
+    elif request.META.get('HTTP_IF_MODIFIED_SINCE') and \
+            not request.META.get('HTTP_IF_NONE_MATCH'):
+        last_modified = get_last_modified(field_file)
+
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is not None:
+        return response
+
+    content_disposition = 'attachment; filename=%s' % file_name
+
+    if settings.DOCUMENT_DOWNLOAD_MODE == DOWNLOAD_MODE_REDIRECT and \
+            can_presign(field_file.storage):
+        url = field_file.storage.url(
+            field_file.name,
+            parameters={'ResponseContentDisposition': content_disposition},
+            expire=settings.DOCUMENT_PRESIGNED_URL_EXPIRE)
+        return HttpResponseRedirect(url)
+
+    if last_modified is None:
+        last_modified = get_last_modified(field_file)
+    if size is None:
+        size = field_file.size
+    content_type = content_type or mimetypes.guess_type(file_name)[0] or \
+        'application/octet-stream'
+
+    range_header = request.META.get('HTTP_RANGE')
+    ranges = None
+    if range_header and _if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(range_header, size)
+        if ranges is not None and len(ranges) > MAX_RANGES:
+            ranges = None
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+    elif ranges:
+        response = _range_response(field_file, ranges, size, content_type)
+    else:
+        response = _streaming_response(
+            iter_chunks(field_file.storage, field_file.name,
+                        RANGE_BLOCK_SIZE), content_type=content_type)
+        response['Content-Length'] = size
+
+    response['Content-Disposition'] = content_disposition
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+    return response
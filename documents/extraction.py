@@ -0,0 +1,45 @@
+import subprocess
+import sys
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+
+from . import extractors
+from .storage import iter_chunks
+
+
+class ExtractionFailed(Exception):
+    pass
+
+
+def extract_text(field_file, file_type):
+    """
+    Returns the plain text of the stored file. The text is extracted in a
+    child process, which is killed after DOCUMENT_TEXT_EXTRACTION_TIMEOUT
+    seconds and cannot allocate more than
+    DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY bytes.
+    """
+    with NamedTemporaryFile(suffix='.' + file_type) as temp:
+        for chunk in iter_chunks(field_file.storage, field_file.name):
+            temp.write(chunk)
+        temp.flush()
+
+        try:
+            result = subprocess.run(
+                [sys.executable, extractors.__file__, file_type, temp.name,
+                 str(settings.DOCUMENT_TEXT_MAX_LENGTH),
+                 str(settings.DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY)],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=settings.DOCUMENT_TEXT_EXTRACTION_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise ExtractionFailed(
+                'Extraction took longer than {} seconds.'.format(
+                    settings.DOCUMENT_TEXT_EXTRACTION_TIMEOUT))
+
+    if result.returncode != 0:
+        errors = result.stderr.decode('utf-8', 'replace').strip()
+        # The last line of a traceback names the exception
+        raise ExtractionFailed('Extraction exited with {}: {}'.format(
+            result.returncode, errors.splitlines()[-1] if errors else ''))
+    return result.stdout.decode('utf-8')
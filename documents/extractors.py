@@ -0,0 +1,231 @@
+"""
+Plain text extraction from the stored files. Only the standard library is
+used, the module is run as a script in a child process by
+`documents.extraction`:
+
+    python extractors.py FILE_TYPE PATH MAX_LENGTH MAX_MEMORY
+"""
+import codecs
+import re
+import sys
+import zipfile
+import zlib
+from xml.etree.ElementTree import iterparse
+
+CHUNK_SIZE = 64 * 1024
+
+# Members of the OOXML archives with the text, the local names of the
+# elements with the text and of the elements which end a paragraph
+OOXML_PARTS = {
+    'docx': (re.compile(r'word/document\.xml$'), 't', 'p'),
+    'pptx': (re.compile(r'ppt/slides/slide(\d+)\.xml$'), 't', 'p'),
+    'xlsx': (re.compile(r'xl/sharedStrings\.xml$'), 't', 'si'),
+}
+
+PDF_STREAM = re.compile(rb'stream\r?\n')
+PDF_TEXT_BLOCK = re.compile(rb'BT(.*?)ET', re.S)
+# Strings shown by the Tj, TJ, ' and " operators
+PDF_SHOWN_TEXT = re.compile(rb'(\[(?:[^\]\\]|\\.)*\]|\((?:[^)\\]|\\.)*\))\s*'
+                            rb'(Tj|TJ|\'|")', re.S)
+PDF_STRING = re.compile(rb'\(((?:[^)\\]|\\.)*)\)', re.S)
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b',
+               b'f': b'\f', b'(': b'(', b')': b')', b'\\': b'\\'}
+PDF_ESCAPE = re.compile(rb'\\([0-7]{1,3}|.)', re.S)
+# Decompressed size of a PDF stream, larger streams are not text
+PDF_MAX_STREAM_SIZE = 16 * 1024 * 1024
+# Bytes kept in front of a stream keyword for its dictionary
+PDF_MAX_DICTIONARY_SIZE = 4096
+
+
+class _Text(object):
+    """
+    Collects the extracted text up to `max_length` characters.
+    """
+    def __init__(self, max_length):
+        self.parts = []
+        self.remaining = max_length
+
+    @property
+    def full(self):
+        return self.remaining <= 0
+
+    def add(self, text):
+        if text and not self.full:
+            text = text[:self.remaining]
+            self.parts.append(text)
+            self.remaining -= len(text)
+
+    def __str__(self):
+        # Postgres text cannot contain NUL characters
+        return ''.join(self.parts).replace('\x00', '')
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def extract_txt(path, text):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            text.add(decoder.decode(chunk))
+            if text.full:
+                return
+    text.add(decoder.decode(b'', final=True))
+
+
+def _extract_xml(stream, text, text_tag, paragraph_tag):
+    for _, element in iterparse(stream):
+        name = _local_name(element.tag)
+        if name == text_tag:
+            text.add(element.text)
+        elif name == paragraph_tag:
+            text.add('\n')
+            # Only the elements of the current paragraph are kept in memory
+            element.clear()
+        if text.full:
+            return
+
+
+def extract_ooxml(path, text, file_type):
+    pattern, text_tag, paragraph_tag = OOXML_PARTS[file_type]
+    with zipfile.ZipFile(path) as archive:
+        members = []
+        for name in archive.namelist():
+            match = pattern.match(name)
+            if match:
+                # Slides are numbered, slide10 follows slide9
+                members.append((int(match.group(1) or 0)
+                                if match.groups() else 0, name))
+        for _, name in sorted(members):
+            with archive.open(name) as stream:
+                _extract_xml(stream, text, text_tag, paragraph_tag)
+            if text.full:
+                return
+
+
+def _unescape_pdf_string(value):
+    def replace(match):
+        escaped = match.group(1)
+        if escaped.isdigit():
+            return bytes([int(escaped, 8) & 0xff])
+        # Escaped line breaks continue the string
+        return PDF_ESCAPES.get(escaped, b'' if escaped in b'\r\n'
+                               else escaped)
+    return PDF_ESCAPE.sub(replace, value).decode('latin-1')
+
+
+class _PdfStream(object):
+    """
+    Collects the content of a stream, decompressed if it is FlateDecode
+    encoded, up to PDF_MAX_STREAM_SIZE bytes.
+    """
+    def __init__(self, dictionary):
+        self.parts = []
+        self.remaining = PDF_MAX_STREAM_SIZE
+        self.decompressor = None
+        # Images and other encodings without text are skipped
+        self.skipped = b'/Filter' in dictionary and \
+            b'/FlateDecode' not in dictionary
+        if b'/FlateDecode' in dictionary:
+            self.decompressor = zlib.decompressobj()
+
+    def add(self, data):
+        if self.skipped or self.remaining <= 0 or not data:
+            return
+        if self.decompressor is not None:
+            try:
+                data = self.decompressor.decompress(data, self.remaining)
+            except zlib.error:
+                self.skipped = True
+                return
+        else:
+            data = data[:self.remaining]
+        self.parts.append(data)
+        self.remaining -= len(data)
+
+    def __bytes__(self):
+        return b''.join(self.parts)
+
+
+def _iter_pdf_streams(file):
+    """
+    Yields the contents of the streams of the PDF `file`, which is read in
+    chunks of CHUNK_SIZE bytes.
+    """
+    data = b''
+    stream = None
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        data += chunk
+        while True:
+            if stream is None:
+                match = PDF_STREAM.search(data)
+                if match is None:
+                    # The rest may hold the dictionary of the next stream
+                    data = data[-PDF_MAX_DICTIONARY_SIZE:]
+                    break
+                stream = _PdfStream(
+                    data[data.rfind(b'<<', 0, match.start()):match.start()])
+                data = data[match.end():]
+
+            end = data.find(b'endstream')
+            if end < 0:
+                # Keeps enough to find an endstream across the chunks
+                keep = len(b'endstream') - 1
+                stream.add(data[:-keep])
+                data = data[-keep:]
+                break
+            stream.add(data[:end])
+            data = data[end + len(b'endstream'):]
+            if not stream.skipped:
+                yield bytes(stream)
+            stream = None
+
+
+def extract_pdf(path, text):
+    """
+    Extracts the strings shown in the content streams. Text of fonts with
+    custom encodings is not readable this way and comes out garbled.
+    """
+    with open(path, 'rb') as file:
+        for content in _iter_pdf_streams(file):
+            for block in PDF_TEXT_BLOCK.finditer(content):
+                for shown in PDF_SHOWN_TEXT.finditer(block.group(1)):
+                    for value in PDF_STRING.findall(shown.group(1)):
+                        text.add(_unescape_pdf_string(value))
+                    text.add(' ' if shown.group(2) in (b'Tj', b'TJ')
+                             else '\n')
+                text.add('\n')
+                if text.full:
+                    return
+
+
+def extract(path, file_type, max_length):
+    """
+    Returns the plain text of the file at `path`, at most `max_length`
+    characters.
+    """
+    text = _Text(max_length)
+    if file_type == 'txt':
+        extract_txt(path, text)
+    elif file_type == 'pdf':
+        extract_pdf(path, text)
+    elif file_type in OOXML_PARTS:
+        extract_ooxml(path, text, file_type)
+    else:
+        raise ValueError('Unsupported file type {}'.format(file_type))
+    return str(text)
+
+
+def main(file_type, path, max_length, max_memory):
+    max_memory = int(max_memory)
+    if max_memory:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    result = extract(path, file_type, int(max_length))
+    sys.stdout.buffer.write(result.encode('utf-8', 'replace'))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,134 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+FIT_CROP = 'crop'
+FIT_CONTAIN = 'contain'
+
+FIT_CHOICES = (
+    (FIT_CROP, 'Scale and crop to fill the size'),
+    (FIT_CONTAIN, 'Scale to fit into the size, keeping the whole image'),
+)
+
+IMAGE_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'gif': 'GIF',
+    'png': 'PNG',
+}
+
+# Images are reduced cheaply to at least this many times the output size,
+# the final resampling with the slow, high quality filter starts there.
+REDUCING_GAP = 2
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def get_scaled_size(image_size, size, fit=FIT_CROP):
+    """
+    Returns the size the whole image is scaled to by `resize_image`, before
+    it is cropped.
+    """
+    if fit == FIT_CONTAIN:
+        scale = min(size[0] / image_size[0], size[1] / image_size[1], 1)
+    else:
+        scale = max(size[0] / image_size[0], size[1] / image_size[1])
+    return (max(int(image_size[0] * scale), 1),
+            max(int(image_size[1] * scale), 1))
+
+
+def open_image(file, size, fit=FIT_CROP, max_pixels=None):
+    """
+    Opens the image in `file` reduced for resizing to `size`.
+
+    JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) which
+    keeps them `REDUCING_GAP` times larger than needed, so large photos are
+    never decoded at full resolution. Other formats are reduced with a box
+    filter to that size after decoding. Raises `ImageTooLarge` if more than
+    `max_pixels` pixels would have to be decoded.
+    """
+    image = Image.open(file)
+    scaled_size = get_scaled_size(image.size, size, fit)
+    reduced_size = (scaled_size[0] * REDUCING_GAP,
+                    scaled_size[1] * REDUCING_GAP)
+
+    if image.format == 'JPEG':
+        image.draft(image.mode, reduced_size)
+
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        raise ImageTooLarge(
+            'The image has {}x{} pixels, at most {} are allowed.'.format(
+                image.size[0], image.size[1], max_pixels))
+
+    factor = min(image.size[0] // reduced_size[0],
+                 image.size[1] // reduced_size[1])
+    if factor >= 2:
+        image = image.resize((-(-image.size[0] // factor),
+                              -(-image.size[1] // factor)), Image.BOX)
+    return image
+
+
+def resize_image(image, size, fit=FIT_CROP):
+    """
+    Returns `image` resized to `size`. `FIT_CROP` scales the image to cover
+    the size and crops the overflow in the center, `FIT_CONTAIN` scales it
+    down to fit into the size keeping its ratio.
+    """
+    if fit == FIT_CONTAIN:
+        scale = min(size[0] / image.size[0], size[1] / image.size[1], 1)
+        return image.resize(
+            (max(int(image.size[0] * scale), 1),
+             max(int(image.size[1] * scale), 1)),
+            Image.ANTIALIAS)
+
+    # scale and crop image to maintain ratio
+    image_ratio = image.size[0] / image.size[1]
+
+    ratio = size[0] / size[1]
+
+    if ratio > image_ratio:
+        image = image.resize(
+            (size[0], int(size[0] * image.size[1] / image.size[0])),
+            Image.ANTIALIAS)
+
+        box = (0, (image.size[1] - size[1]) / 2,
+               image.size[0], (image.size[1] + size[1]) / 2)
+
+        image = image.crop(box)
+    elif ratio < image_ratio:
+        image = image.resize(
+            (int(size[1] * image.size[0] / image.size[1]), size[1]),
+            Image.ANTIALIAS)
+
+        box = (
+            int((image.size[0] - size[0]) / 2), 0,
+            int((image.size[0] + size[0]) / 2), image.size[1])
+
+        image = image.crop(box)
+    else:
+        image = image.resize((size[0], size[1]), Image.ANTIALIAS)
+
+    return image
+
+
+def make_resized_file(file, file_type, size, fit=FIT_CROP, name=None):
+    """
+    Returns a `ContentFile` with the image in `file` resized to `size`, in
+    the format of `file_type`, or None if the type is no image.
+    """
+    image_format = IMAGE_FORMATS.get(file_type)
+    if image_format is None:
+        return None
+
+    image = open_image(file, size, fit,
+                       max_pixels=settings.DOCUMENT_IMAGE_MAX_PIXELS)
+    image = resize_image(image, size, fit)
+
+    temp_file = BytesIO()
+    image.save(temp_file, image_format)
+    temp_file.seek(0)
+    return ContentFile(temp_file.read(), name=name)
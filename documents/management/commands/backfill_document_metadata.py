@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...metadata import get_file_metadata
+from ...models import Blob, Document
+
+
+class Command(BaseCommand):
+    help = ('Stores the size, MIME type, SHA-256 and image dimensions of '
+            'documents uploaded before they were recorded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of documents loaded at once.')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(file_size=None).exclude(
+            file='').exclude(file=None).order_by('id')
+
+        processed = failed = 0
+        last_id = 0
+        while True:
+            batch = list(documents.filter(id__gt=last_id).values_list(
+                'id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+
+            for document_id in batch:
+                last_id = document_id
+                try:
+                    self.backfill(document_id)
+                except Exception as exc:
+                    # e.g. the stored file is missing, keep the document
+                    failed += 1
+                    self.stderr.write('Document {}: {}'.format(
+                        document_id, exc))
+            processed += len(batch)
+            self.stdout.write('Processed {} documents'.format(processed))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Stored the metadata of {} documents'.format(
+                processed - failed)))
+
+    def backfill(self, document_id):
+        with transaction.atomic():
+            document = Document.objects.select_for_update(
+                of=('self',)).select_related('blob').get(pk=document_id)
+            if document.file_size is not None:
+                return
+            storage = document.file.storage
+
+            blob = document.blob
+            if blob is not None and blob.mime_type:
+                metadata = (blob.sha256, blob.size, blob.mime_type,
+                            blob.width, blob.height)
+            else:
+                with storage.open(document.file.name, 'rb') as file:
+                    metadata = get_file_metadata(file, document.file.name)
+                if blob is not None:
+                    Blob.objects.filter(pk=blob.pk).update(
+                        **metadata._asdict())
+
+            (document.file_sha256, document.file_size,
+             document.file_mime_type, document.image_width,
+             document.image_height) = metadata
+            document.file_modified_date = storage.get_modified_time(
+                document.file.name)
+            if document.thumbnail and document.thumbnail_size is None:
+                document.thumbnail_size = storage.size(
+                    document.thumbnail.name)
+                if blob is not None and \
+                        blob.thumbnail.name == document.thumbnail.name:
+                    Blob.objects.filter(pk=blob.pk).update(
+                        thumbnail_size=document.thumbnail_size)
+
+            # The update counts the size of the document in the statistics
+            Document.objects.filter(pk=document.pk).update(
+                file_sha256=document.file_sha256,
+                file_size=document.file_size,
+                file_mime_type=document.file_mime_type,
+                image_width=document.image_width,
+                image_height=document.image_height,
+                file_modified_date=document.file_modified_date,
+                thumbnail_size=document.thumbnail_size)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+
+from ...models import Document
+
+
+class Command(BaseCommand):
+    help = ('Fills the search vectors of documents created before the '
+            'search, in id ranges which are committed one by one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Range of document ids whose search vectors '
+                                 'are filled by one UPDATE.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_id = Document.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        filled = 0
+        with connection.cursor() as cursor:
+            for start in range(0, max_id, batch_size):
+                # The documents_document_search_vector trigger computes the
+                # vector on updates of the file name. Every UPDATE locks only
+                # the documents of its range.
+                cursor.execute(
+                    'UPDATE documents_document SET file_name = file_name '
+                    'WHERE id > %s AND id <= %s AND search_vector IS NULL',
+                    [start, start + batch_size])
+                filled += cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(
+            'Filled the search vectors of {} documents'.format(filled)))
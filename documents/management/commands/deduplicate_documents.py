@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Blob, Document
+
+
+class Command(BaseCommand):
+    help = ('Moves the files of documents uploaded before the content '
+            'addressed storage to blobs and deletes duplicate files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of documents loaded at once.')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(blob=None).exclude(
+            file='').exclude(file=None).order_by('id')
+
+        processed = 0
+        last_id = 0
+        while True:
+            batch = list(documents.filter(id__gt=last_id).only(
+                'id', 'file', 'thumbnail')[:options['batch_size']])
+            if not batch:
+                break
+
+            for document in batch:
+                last_id = document.id
+                try:
+                    document.move_to_blob()
+                except Exception as exc:
+                    # e.g. the stored file is missing, keep the document
+                    self.stderr.write('Document {}: {}'.format(
+                        document.id, exc))
+            processed += len(batch)
+            self.stdout.write('Processed {} documents'.format(processed))
+
+        self.stdout.write(self.style.SUCCESS(
+            '{} blobs for {} documents'.format(
+                Blob.objects.count(), processed)))
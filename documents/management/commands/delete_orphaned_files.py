@@ -0,0 +1,167 @@
+import heapq
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from ...models import Blob, Document, Rendition, UploadSession
+from ...storage import S3_DELETE_BATCH_SIZE, delete_files, iter_files
+from ...uploads import SESSION_PARTS_PATH, get_chunk_backend
+
+# Chunks of open upload sessions are deleted with their session
+SESSION_PARTS_PREFIX = SESSION_PARTS_PATH.split('{}')[0]
+
+# Fields which reference stored files
+FILE_FIELDS = (
+    (Document, ('file', 'thumbnail')),
+    (Blob, ('file', 'thumbnail')),
+    (Rendition, ('file',)),
+)
+
+
+class Command(BaseCommand):
+    help = ('Aborts expired upload sessions and deletes stored files below '
+            'the upload directory which are not referenced by any document, '
+            'blob or rendition.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='uploads/',
+                            help='Directory which is checked.')
+        parser.add_argument('--start-after', default=None,
+                            help='Resume after this file name.')
+        parser.add_argument('--batch-size', type=int,
+                            default=S3_DELETE_BATCH_SIZE,
+                            help='Number of files checked at once.')
+        parser.add_argument('--rate', type=float, default=100,
+                            help='Maximum number of files deleted per '
+                                 'second, 0 for no limit.')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Only files older than this many hours are '
+                                 'deleted, so uploads in progress are kept.')
+        parser.add_argument('--session-max-age', type=float, default=48,
+                            help='Upload sessions which are not finalized '
+                                 'after this many hours are aborted, 0 '
+                                 'keeps them.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the expired sessions and the orphaned '
+                                 'files only.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if not 0 < batch_size <= S3_DELETE_BATCH_SIZE:
+            raise CommandError('The batch size must be between 1 and '
+                               '{}.'.format(S3_DELETE_BATCH_SIZE))
+
+        self.storage = Document._meta.get_field('file').storage
+        self.options = options
+        self.checked = self.deleted = 0
+        max_modified_time = timezone.now() - timedelta(
+            hours=options['min_age'])
+
+        if options['session_max_age']:
+            self._expire_sessions(timezone.now() - timedelta(
+                hours=options['session_max_age']))
+        if not options['dry_run']:
+            # Blobs whose deletion after the commit failed
+            Blob.objects.delete_unreferenced()
+
+        # The referenced names are read once at the start, files which are
+        # referenced after this point are new uploads younger than the
+        # minimum age or blob files whose blob is read here.
+        referenced = self._iter_referenced_names(options['prefix'])
+        reference = next(referenced, None)
+        sessions = {str(session_uuid) for session_uuid in
+                    UploadSession.objects.values_list('uuid', flat=True)}
+
+        batch = []
+        for name, modified_time in iter_files(self.storage,
+                                              options['prefix'],
+                                              options['start_after']):
+            self.checked += 1
+            # Both are in key order, the names are compared like a merge
+            # join
+            while reference is not None and reference < name:
+                reference = next(referenced, None)
+            if modified_time > max_modified_time or name == reference:
+                continue
+            if name.startswith(SESSION_PARTS_PREFIX) and \
+                    name[len(SESSION_PARTS_PREFIX):].split('/')[0] \
+                    in sessions:
+                continue
+
+            batch.append(name)
+            if len(batch) >= batch_size:
+                self._process(batch)
+                batch = []
+        self._process(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Checked {} files, {} {} orphaned files'.format(
+                self.checked,
+                'found' if options['dry_run'] else 'deleted',
+                self.deleted)))
+
+    def _expire_sessions(self, max_create_date):
+        """
+        Aborts the upload sessions created before `max_create_date` which
+        were not finalized: their chunks or S3 multipart upload and rows.
+        """
+        backend = get_chunk_backend(self.storage)
+        expired = UploadSession.objects.filter(
+            document__isnull=True, create_date__lt=max_create_date)
+        count = 0
+        for pk in expired.values_list('pk', flat=True).iterator():
+            # Locked like a finalization, which either finished before or
+            # does not find the session anymore
+            with transaction.atomic():
+                session = UploadSession.objects.select_for_update().filter(
+                    pk=pk, document__isnull=True).first()
+                if session is None:
+                    continue
+                self.stdout.write('Upload session {}'.format(session.uuid),
+                                  self.style.NOTICE)
+                if not self.options['dry_run']:
+                    backend.abort(session, session.chunks.all())
+                    session.delete()
+            count += 1
+
+        self.stdout.write('{} {} expired upload sessions'.format(
+            'Found' if self.options['dry_run'] else 'Aborted', count))
+
+    def _iter_referenced_names(self, prefix):
+        """
+        Yields the names of the referenced files below `prefix` in key
+        order. Every field is read sorted by bytes with a server side cursor
+        and the fields are merged, so the names are not held in memory.
+        """
+        names = []
+        for model, fields in FILE_FIELDS:
+            for field in fields:
+                column = '"{}"."{}"'.format(
+                    model._meta.db_table, model._meta.get_field(field).column)
+                names.append(model.objects.filter(**{
+                    field + '__startswith': prefix}).order_by(
+                    RawSQL(column + ' COLLATE "C"', ()).asc()).values_list(
+                    field, flat=True).iterator())
+        return heapq.merge(*names)
+
+    def _process(self, orphaned):
+        if not orphaned:
+            return
+
+        start = time.time()
+        for name in orphaned:
+            self.stdout.write(name, self.style.NOTICE)
+        if not self.options['dry_run']:
+            delete_files(self.storage, orphaned)
+        self.deleted += len(orphaned)
+
+        self.stdout.write('Checked {} files, resume with --start-after '
+                          '{}'.format(self.checked, orphaned[-1]))
+
+        if self.options['rate']:
+            time.sleep(max(len(orphaned) / self.options['rate'] -
+                           (time.time() - start), 0))
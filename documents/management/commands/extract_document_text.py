@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from ...models import (Document, TEXT_FILE_TYPES, TEXT_STATUS_FAILED,
+                       TEXT_STATUS_PENDING)
+from ...tasks import extract_document_text
+
+
+def extract(document_id):
+    try:
+        extract_document_text(document_id)
+    finally:
+        # Every thread uses its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ('Extracts the text of the documents uploaded before the text '
+            'extraction or left pending, in parallel child processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of documents loaded at once.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of files extracted at once.')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Extract the documents which failed again.')
+
+    def handle(self, *args, **options):
+        statuses = [TEXT_STATUS_PENDING]
+        if options['retry_failed']:
+            statuses.append(TEXT_STATUS_FAILED)
+        documents = Document.objects.filter(
+            Q(text_status__in=statuses) | Q(text_status=None),
+            file_type__in=TEXT_FILE_TYPES).exclude(file='').exclude(
+            file=None).order_by('id')
+
+        # Each thread waits for the child process extracting one file, a
+        # single worker extracts in this thread
+        executor = None
+        if options['workers'] > 1:
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+        processed = failed = 0
+        last_id = 0
+        try:
+            while True:
+                batch = list(documents.filter(id__gt=last_id).values_list(
+                    'id', flat=True)[:options['batch_size']])
+                if not batch:
+                    break
+
+                last_id = batch[-1]
+                if executor is None:
+                    for document_id in batch:
+                        extract_document_text(document_id)
+                else:
+                    list(executor.map(extract, batch))
+                processed += len(batch)
+                failed += Document.objects.filter(
+                    pk__in=batch, text_status=TEXT_STATUS_FAILED).count()
+                self.stdout.write('Processed {} documents'.format(processed))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Extracted the text of {} documents, {} failed'.format(
+                processed - failed, failed)))
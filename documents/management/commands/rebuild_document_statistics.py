@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ...models import STATISTIC_FIELDS, Document, DocumentStatistic
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the document statistics from the documents, e.g. '
+            'after they drifted or after the upgrade which added them.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Documents can be read but not changed during the rebuild
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {} IN SHARE MODE'.format(
+                    connection.ops.quote_name(Document._meta.db_table)))
+
+            previous = {
+                (row.organization_uuid, row.workflowlevel,
+                 row.workflowlevel_uuid, row.file_type):
+                [row.document_count, row.total_size]
+                for row in DocumentStatistic.objects.filter(
+                    document_count__gt=0)}
+            changes = DocumentStatistic.objects.count_documents(
+                Document.objects.values_list(*STATISTIC_FIELDS).iterator())
+
+            DocumentStatistic.objects.all().delete()
+            DocumentStatistic.objects.apply(changes)
+
+        drifted = {key for key in set(previous) | set(changes)
+                   if previous.get(key, [0, 0]) != changes.get(key, [0, 0])}
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} statistics, {} of them had drifted'.format(
+                len([change for change in changes.values() if any(change)]),
+                len(drifted))))
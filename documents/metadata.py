@@ -0,0 +1,106 @@
+import codecs
+import hashlib
+from collections import namedtuple
+
+from PIL import Image
+
+FileMetadata = namedtuple('FileMetadata',
+                          ('sha256', 'size', 'mime_type', 'width', 'height'))
+
+# Bytes at the start of a file used to detect its type
+SNIFF_SIZE = 512
+
+EXTENSION_MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'pdf': 'application/pdf',
+    'txt': 'text/plain',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.'
+            'wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.'
+            'spreadsheetml.sheet',
+    'ppt': 'application/vnd.ms-powerpoint',
+    'pptx': 'application/vnd.openxmlformats-officedocument.'
+            'presentationml.presentation',
+}
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+# Container formats shared by several file types, which are told apart by
+# the extension of the file name
+CONTAINER_SIGNATURES = (
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage',
+     ('doc', 'xls', 'ppt')),
+    (b'PK\x03\x04', 'application/zip', ('docx', 'xlsx', 'pptx')),
+)
+
+
+def _is_text(head):
+    if b'\x00' in head:
+        return False
+    try:
+        # The head may end within a multibyte character
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def sniff_mime_type(head, file_name):
+    """
+    Returns the MIME type of a file from the bytes `head` at its start.
+    The extension of `file_name` only decides between the file types of
+    one container format.
+    """
+    extension = file_name.split('.')[-1].lower()
+    for signature, mime_type in SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+
+    for signature, mime_type, extensions in CONTAINER_SIGNATURES:
+        if head.startswith(signature):
+            if extension in extensions:
+                return EXTENSION_MIME_TYPES[extension]
+            return mime_type
+
+    if _is_text(head):
+        return 'text/plain'
+    return 'application/octet-stream'
+
+
+def get_file_metadata(file, file_name):
+    """
+    Returns the `FileMetadata` of `file` with one pass over its content.
+    The dimensions are read from the header of images.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b''
+    for chunk in file.chunks():
+        sha256.update(chunk)
+        size += len(chunk)
+        if len(head) < SNIFF_SIZE:
+            head += chunk[:SNIFF_SIZE - len(head)]
+    file.seek(0)
+
+    mime_type = sniff_mime_type(head, file_name)
+    width = height = None
+    if mime_type.startswith('image/'):
+        try:
+            # Only the header is read, the image is not decoded
+            width, height = Image.open(file).size
+        except (IOError, ValueError):
+            pass
+        file.seek(0)
+
+    return FileMetadata(sha256.hexdigest(), size, mime_type, width, height)
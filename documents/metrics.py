@@ -0,0 +1,138 @@
+import hmac
+import ipaddress
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# Label of the requests which did not resolve to a view
+UNMATCHED_VIEW = 'unmatched'
+# Methods recorded by name, the others are recorded as OTHER_METHOD so a
+# client cannot create new label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+OTHER_METHOD = 'other'
+
+REQUEST_LATENCY = Histogram(
+    'documents_request_duration_seconds',
+    'Time until the response of a request is returned, without the '
+    'streaming of its content.', ['view', 'method'])
+REQUESTS = Counter(
+    'documents_requests_total', 'Requests per view and response status.',
+    ['view', 'method', 'status'])
+REQUEST_QUERIES = Histogram(
+    'documents_request_queries', 'Database queries per request.', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')))
+STREAMED_BYTES = Counter(
+    'documents_streamed_bytes_total', 'Bytes of streamed responses sent.',
+    ['view'])
+THUMBNAIL_DURATION = Histogram(
+    'documents_thumbnail_duration_seconds',
+    'Time to create a thumbnail with Document.make_thumbnail.')
+THUMBNAIL_FAILURES = Counter(
+    'documents_thumbnail_failures_total',
+    'Failed thumbnail creations, including the retried ones.')
+
+
+def get_view_label(view_func, method):
+    """
+    Returns the metrics label of a view, the class and action of viewsets,
+    e.g. `DocumentViewSet.list`, and the name of other views. Methods
+    without an action are labelled `<class>.other`.
+    """
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        # Viewsets answer HEAD requests with the action of GET
+        action = actions.get('get' if method == 'HEAD' else method.lower())
+        return '{}.{}'.format(view_func.cls.__name__, action or OTHER_METHOD)
+    return getattr(view_func, '__name__', UNMATCHED_VIEW)
+
+
+def _count_streamed_bytes(content, view):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        # Counted once per response, the client may disconnect early
+        STREAMED_BYTES.labels(view).inc(size)
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency, the response status and the database queries of
+    every request and the bytes of streamed responses.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics_view = UNMATCHED_VIEW
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = request.metrics_view
+        method = request.method if request.method in METHODS \
+            else OTHER_METHOD
+        REQUEST_LATENCY.labels(view, method).observe(duration)
+        REQUESTS.labels(view, method, response.status_code).inc()
+        REQUEST_QUERIES.labels(view).observe(queries[0])
+        if response.streaming:
+            response.streaming_content = _count_streamed_bytes(
+                response.streaming_content, view)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = get_view_label(view_func, request.method)
+
+
+def get_registry():
+    """
+    Returns the registry with the metrics of all processes when
+    `prometheus_multiproc_dir` is set, as with several gunicorn workers,
+    or the registry of this process.
+    """
+    if not os.environ.get('prometheus_multiproc_dir'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def is_metrics_request_allowed(request):
+    """
+    Returns whether the request comes from one of METRICS_ALLOWED_NETWORKS
+    or carries the METRICS_TOKEN as bearer token.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization.encode(),
+                                     'Bearer {}'.format(token).encode()):
+        return True
+
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics_view(request):
+    if not is_metrics_request_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,44 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:07
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+# The indexes are built without blocking writes to the documents table.
+# CREATE INDEX CONCURRENTLY cannot run in a transaction, a failed build
+# leaves an invalid index which has to be dropped before migrating again.
+CREATE_INDEX = """
+CREATE INDEX CONCURRENTLY {name} ON documents_document USING gin ({column});
+"""
+
+DROP_INDEX = "DROP INDEX CONCURRENTLY {name};"
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('documents', '0011_auto_20190228_0912'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    CREATE_INDEX.format(name=name, column=column),
+                    DROP_INDEX.format(name=name))
+                for name, column in (
+                    ('document_wfl1_uuids_gin', 'workflowlevel1_uuids'),
+                    ('document_wfl2_uuids_gin', 'workflowlevel2_uuids'))
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['workflowlevel1_uuids'], name='document_wfl1_uuids_gin'),
+                ),
+                migrations.AddIndex(
+                    model_name='document',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['workflowlevel2_uuids'], name='document_wfl2_uuids_gin'),
+                ),
+            ],
+        ),
+    ]
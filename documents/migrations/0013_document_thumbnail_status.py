@@ -0,0 +1,26 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+def mark_existing_thumbnails_ready(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.exclude(thumbnail='').exclude(thumbnail__isnull=True)\
+        .update(thumbnail_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_auto_20261018_0807'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='thumbnail_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], help_text='Status of the thumbnail generation', max_length=10, null=True),
+        ),
+        migrations.RunPython(mark_existing_thumbnails_ready,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_document_thumbnail_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('file_name', models.CharField(help_text='Filename', max_length=200)),
+                ('file_path', models.CharField(editable=False, help_text='Storage name of the final file', max_length=255)),
+                ('size', models.BigIntegerField(help_text='Total file size in bytes')),
+                ('chunk_size', models.PositiveIntegerField(help_text='Size in bytes of every chunk except the last one')),
+                ('upload_id', models.CharField(blank=True, editable=False, help_text='Storage multipart upload ID', max_length=1024, null=True)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+                ('document', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='documents.Document')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadchunk',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='documents.UploadSession'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='uploadchunk',
+            unique_together={('session', 'number')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import documents.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_auto_20261018_0810'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='SHA-256 of the content', max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to=documents.models.make_blob_filepath)),
+                ('thumbnail', models.FileField(blank=True, max_length=255, null=True, upload_to=documents.models.make_blob_filepath)),
+                ('size', models.BigIntegerField(help_text='File size in bytes')),
+                ('reference_count', models.PositiveIntegerField(default=0)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='documents.Blob'),
+        ),
+    ]
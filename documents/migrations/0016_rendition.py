@@ -0,0 +1,31 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import documents.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('fit', models.CharField(choices=[('crop', 'Scale and crop to fill the size'), ('contain', 'Scale to fit into the size, keeping the whole image')], max_length=10)),
+                ('file', models.FileField(max_length=255, upload_to=documents.models.make_rendition_filepath)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='documents.Blob')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rendition',
+            unique_together={('blob', 'width', 'height', 'fit')},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_rendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('organization_uuid', models.CharField(blank=True, max_length=36)),
+                ('workflowlevel', models.CharField(blank=True, choices=[('', 'All documents of the organization'), ('workflowlevel1', 'Workflowlevel1'), ('workflowlevel2', 'Workflowlevel2')], max_length=20)),
+                ('workflowlevel_uuid', models.CharField(blank=True, max_length=36)),
+                ('file_type', models.CharField(max_length=10)),
+                ('document_count', models.BigIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentstatistic',
+            unique_together={('organization_uuid', 'workflowlevel', 'workflowlevel_uuid', 'file_type')},
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_documentstatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='mime_type',
+            field=models.CharField(blank=True, help_text='MIME type of the content', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='thumbnail_size',
+            field=models.BigIntegerField(blank=True, help_text='Thumbnail size in bytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_mime_type',
+            field=models.CharField(blank=True, help_text='MIME type of the content', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_modified_date',
+            field=models.DateTimeField(blank=True, help_text='Time the file was stored', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_sha256',
+            field=models.CharField(blank=True, help_text='SHA-256 of the content', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, help_text='File size in bytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='thumbnail_size',
+            field=models.BigIntegerField(blank=True, help_text='Thumbnail size in bytes', null=True),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:45
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Keeps the search vector of a document up to date on every insert and on
+# every update of the searched columns, including bulk inserts and updates
+CREATE_TRIGGER = """
+CREATE FUNCTION documents_document_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.file_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.file_description, '')),
+                  'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER documents_document_search_vector
+    BEFORE INSERT OR UPDATE OF file_name, file_description
+    ON documents_document
+    FOR EACH ROW EXECUTE PROCEDURE documents_document_search_vector();
+"""
+# The search vectors of the existing documents are filled in batches by the
+# backfill_document_metadata management command, an UPDATE of the whole
+# table here would lock it until the migration is committed.
+
+DROP_TRIGGER = """
+DROP TRIGGER documents_document_search_vector ON documents_document;
+DROP FUNCTION documents_document_search_vector();
+"""
+
+# The indexes are built without blocking writes to the documents table,
+# see 0012_auto_20261018_0807.
+CREATE_SEARCH_VECTOR_INDEX = """
+CREATE INDEX CONCURRENTLY document_search_vector_gin ON documents_document
+    USING gin (search_vector);
+"""
+
+DROP_SEARCH_VECTOR_INDEX = \
+    "DROP INDEX CONCURRENTLY document_search_vector_gin;"
+
+# Django lookups compare UPPER(file_name::text), the index matches the same
+# expression so partial file name matches (icontains) use it
+CREATE_TRIGRAM_INDEX = """
+CREATE INDEX CONCURRENTLY document_file_name_trgm ON documents_document
+    USING gin ((UPPER(file_name::text)) gin_trgm_ops);
+"""
+
+DROP_TRIGRAM_INDEX = "DROP INDEX CONCURRENTLY document_file_name_trgm;"
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('documents', '0018_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_SEARCH_VECTOR_INDEX,
+                                  DROP_SEARCH_VECTOR_INDEX),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='document_search_vector_gin'),
+                ),
+            ],
+        ),
+        TrigramExtension(),
+        migrations.RunSQL(CREATE_TRIGRAM_INDEX, DROP_TRIGRAM_INDEX),
+    ]
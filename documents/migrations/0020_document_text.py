@@ -0,0 +1,91 @@
+# Generated by Django 2.0.5 on 2026-10-18 08:48
+
+from django.db import migrations, models
+from django.db.models import Max
+
+# The content_text column is added nullable, which does not rewrite the
+# table, filled in batches and made NOT NULL at the end, which also drops
+# the database default covering the documents inserted meanwhile.
+SET_DEFAULT = """
+ALTER TABLE documents_document ALTER COLUMN content_text SET DEFAULT '';
+"""
+
+DROP_DEFAULT = """
+ALTER TABLE documents_document ALTER COLUMN content_text DROP DEFAULT;
+"""
+
+BACKFILL_BATCH_SIZE = 10000
+
+BACKFILL_CONTENT_TEXT = """
+UPDATE documents_document SET content_text = ''
+WHERE id > %s AND id <= %s AND content_text IS NULL
+"""
+
+SEARCH_VECTOR_FUNCTION = """
+CREATE OR REPLACE FUNCTION documents_document_search_vector()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.file_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.file_description, '')),
+                  'B'){};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER documents_document_search_vector ON documents_document;
+CREATE TRIGGER documents_document_search_vector
+    BEFORE INSERT OR UPDATE OF {}
+    ON documents_document
+    FOR EACH ROW EXECUTE PROCEDURE documents_document_search_vector();
+"""
+
+# The extracted text is searched with the lowest weight
+CREATE_TRIGGER = SEARCH_VECTOR_FUNCTION.format(
+    " ||\n        setweight(to_tsvector('simple', NEW.content_text), 'C')") + \
+    SEARCH_VECTOR_TRIGGER.format('file_name, file_description, content_text')
+
+RESTORE_TRIGGER = SEARCH_VECTOR_FUNCTION.format('') + \
+    SEARCH_VECTOR_TRIGGER.format('file_name, file_description')
+
+
+def backfill_content_text(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    max_id = Document.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    with schema_editor.connection.cursor() as cursor:
+        # Every batch is committed on its own
+        for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL_CONTENT_TEXT,
+                           [start, start + BACKFILL_BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('documents', '0019_document_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(SET_DEFAULT, DROP_DEFAULT),
+        migrations.RunPython(backfill_content_text,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='document',
+            name='content_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='text_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], help_text='Status of the text extraction for the search', max_length=10, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, RESTORE_TRIGGER),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.0.5 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+# The indexes are built without blocking writes to the documents table,
+# see 0012_auto_20261018_0807.
+CREATE_INDEX = """
+CREATE INDEX CONCURRENTLY {name} ON documents_document ({columns});
+"""
+
+DROP_INDEX = "DROP INDEX CONCURRENTLY {name};"
+
+INDEXES = (
+    ('document_file_type_id_idx', ['file_type', 'id']),
+    ('document_contact_uuid_id_idx', ['contact_uuid', 'id']),
+    ('document_upload_date_idx', ['upload_date']),
+    ('document_create_date_idx', ['create_date']),
+)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('documents', '0020_document_text'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    CREATE_INDEX.format(name=name, columns=', '.join(fields)),
+                    DROP_INDEX.format(name=name))
+                for name, fields in INDEXES
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='document',
+                    index=models.Index(fields=fields, name=name),
+                )
+                for name, fields in INDEXES
+            ],
+        ),
+    ]
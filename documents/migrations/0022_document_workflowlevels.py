@@ -0,0 +1,70 @@
+# Generated by Django 2.0.5 on 2026-10-18 09:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Keeps one row per workflowlevel UUID of a document in
+# documents_documentworkflowlevel on every insert, delete and update of the
+# workflowlevel columns, including bulk inserts and updates
+CREATE_TRIGGER = """
+CREATE FUNCTION documents_document_workflowlevels() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND
+            NEW.workflowlevel1_uuids IS NOT DISTINCT FROM
+                OLD.workflowlevel1_uuids AND
+            NEW.workflowlevel2_uuids IS NOT DISTINCT FROM
+                OLD.workflowlevel2_uuids THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM documents_documentworkflowlevel
+            WHERE document_id = OLD.id;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    INSERT INTO documents_documentworkflowlevel (
+        document_id, workflowlevel, workflowlevel_uuid)
+    SELECT NEW.id, 'workflowlevel1', unnest(NEW.workflowlevel1_uuids)
+    UNION ALL
+    SELECT NEW.id, 'workflowlevel2', unnest(NEW.workflowlevel2_uuids)
+    ON CONFLICT DO NOTHING;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER documents_document_workflowlevels
+    AFTER INSERT OR DELETE OR UPDATE OF workflowlevel1_uuids,
+        workflowlevel2_uuids
+    ON documents_document
+    FOR EACH ROW EXECUTE PROCEDURE documents_document_workflowlevels();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER documents_document_workflowlevels ON documents_document;
+DROP FUNCTION documents_document_workflowlevels();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0021_document_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentWorkflowLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('workflowlevel', models.CharField(choices=[('', 'All documents of the organization'), ('workflowlevel1', 'Workflowlevel1'), ('workflowlevel2', 'Workflowlevel2')], max_length=20)),
+                ('workflowlevel_uuid', models.CharField(max_length=36)),
+                ('document', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='workflowlevels', to='documents.Document')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentworkflowlevel',
+            unique_together={('workflowlevel', 'workflowlevel_uuid', 'document')},
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.0.5 on 2026-10-18 09:52
+
+from django.db import migrations, transaction
+from django.db.models import Max
+
+# Documents per transaction, the migration is not atomic so the documents
+# are only locked for the insert of their batch
+BACKFILL_BATCH_SIZE = 10000
+
+# The documents of the batch are locked first, so the insert reads their
+# committed workflowlevels and the trigger maintains them afterwards
+LOCK_DOCUMENTS = """
+SELECT id FROM documents_document WHERE id > %s AND id <= %s FOR SHARE
+"""
+
+INSERT_WORKFLOWLEVELS = """
+INSERT INTO documents_documentworkflowlevel (
+    document_id, workflowlevel, workflowlevel_uuid)
+SELECT id, 'workflowlevel1', unnest(workflowlevel1_uuids)
+    FROM documents_document WHERE id > %s AND id <= %s
+UNION ALL
+SELECT id, 'workflowlevel2', unnest(workflowlevel2_uuids)
+    FROM documents_document WHERE id > %s AND id <= %s
+ON CONFLICT DO NOTHING
+"""
+
+
+def backfill_workflowlevels(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    max_id = Document.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+        end = start + BACKFILL_BATCH_SIZE
+        with transaction.atomic(using=schema_editor.connection.alias), \
+                schema_editor.connection.cursor() as cursor:
+            cursor.execute(LOCK_DOCUMENTS, [start, end])
+            cursor.execute(INSERT_WORKFLOWLEVELS, [start, end, start, end])
+
+
+class Migration(migrations.Migration):
+    # Reads the documents in batches instead of one long transaction
+    atomic = False
+
+    dependencies = [
+        ('documents', '0022_document_workflowlevels'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_workflowlevels,
+                             migrations.RunPython.noop),
+    ]
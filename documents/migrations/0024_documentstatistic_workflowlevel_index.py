@@ -0,0 +1,34 @@
+# Generated by Django 2.0.5 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+# Built without blocking the statistic upserts of document changes, see
+# 0012_auto_20261018_0807.
+CREATE_INDEX = """
+CREATE INDEX CONCURRENTLY statistic_workflowlevel_idx
+ON documents_documentstatistic (workflowlevel, workflowlevel_uuid);
+"""
+
+DROP_INDEX = "DROP INDEX CONCURRENTLY statistic_workflowlevel_idx;"
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('documents', '0023_backfill_document_workflowlevels'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='documentstatistic',
+                    index=models.Index(fields=['workflowlevel', 'workflowlevel_uuid'], name='statistic_workflowlevel_idx'),
+                ),
+            ],
+        ),
+    ]
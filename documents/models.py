@@ -1,14 +1,25 @@
 from __future__ import unicode_literals
 import uuid
-from io import BytesIO
+from collections import Counter, defaultdict
 
 from django.contrib.postgres.fields import ArrayField
-from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField,
+                                            TrigramSimilarity)
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, FloatField, Func, Q, Sum, Value
+from django.db.models.functions import Cast
+from django.db.models.sql import UpdateQuery
 
 from functools import partial
-from PIL import Image
+
+from .caching import (WORKFLOWLEVEL_FIELDS, bump_versions,
+                      get_document_scopes, get_workflowlevel_scope)
+from .images import FIT_CHOICES, make_resized_file
+from .metadata import get_file_metadata
+from .storage import delete_files
 
 try:
     from django.utils import timezone
@@ -34,6 +45,56 @@ FILE_TYPE_CHOICES = (
 IMAGE_FILE_TYPES = ['jpg', 'jpeg', 'png', '.gif']
 THUMBNAIL_DIMENSIONS = (200, 200)
 
+THUMBNAIL_STATUS_PENDING = 'pending'
+THUMBNAIL_STATUS_READY = 'ready'
+THUMBNAIL_STATUS_FAILED = 'failed'
+
+THUMBNAIL_STATUS_CHOICES = (
+    (THUMBNAIL_STATUS_PENDING, 'Pending'),
+    (THUMBNAIL_STATUS_READY, 'Ready'),
+    (THUMBNAIL_STATUS_FAILED, 'Failed'),
+)
+
+# File types whose text is extracted into the search index
+TEXT_FILE_TYPES = ('txt', 'pdf', 'docx', 'xlsx', 'pptx')
+
+TEXT_STATUS_PENDING = 'pending'
+TEXT_STATUS_READY = 'ready'
+TEXT_STATUS_FAILED = 'failed'
+
+TEXT_STATUS_CHOICES = (
+    (TEXT_STATUS_PENDING, 'Pending'),
+    (TEXT_STATUS_READY, 'Ready'),
+    (TEXT_STATUS_FAILED, 'Failed'),
+)
+
+
+WORKFLOWLEVEL1 = 'workflowlevel1'
+WORKFLOWLEVEL2 = 'workflowlevel2'
+
+WORKFLOWLEVEL_CHOICES = (
+    ('', 'All documents of the organization'),
+    (WORKFLOWLEVEL1, 'Workflowlevel1'),
+    (WORKFLOWLEVEL2, 'Workflowlevel2'),
+)
+
+# Text search configuration of the search_vector column, it must match the
+# one of the documents_document_search_vector trigger
+SEARCH_CONFIG = 'simple'
+# Shorter search texts cannot use the trigram index of the file name
+TRIGRAM_MIN_LENGTH = 3
+
+# Document values the statistics are computed from
+STATISTIC_FIELDS = ('organization_uuid', 'file_type', 'workflowlevel1_uuids',
+                    'workflowlevel2_uuids', 'file_size')
+# Statistic rows written by one upsert
+STATISTIC_BATCH_SIZE = 1000
+# Workflowlevel of the statistics of each array field
+WORKFLOWLEVEL_FIELD_LEVELS = {
+    'workflowlevel1_uuids': WORKFLOWLEVEL1,
+    'workflowlevel2_uuids': WORKFLOWLEVEL2,
+}
+
 
 def make_filepath(field_name, instance, filename):
     now = timezone.now()
@@ -49,6 +110,227 @@ def make_filepath_thumbnail(field_name, instance, filename):
     return filepath+new_filename
 
 
+def make_blob_filepath(instance, filename):
+    return "uploads/blobs/%s/%s" % (instance.sha256[:2], filename)
+
+
+def make_rendition_filepath(instance, filename):
+    return "uploads/blobs/%s/renditions/%s" % (instance.blob.sha256[:2],
+                                               filename)
+
+
+class DocumentQuerySet(models.QuerySet):
+    def create_documents(self, documents):
+        """
+        Inserts the validated, unsaved `documents` with a single query. New
+        files are stored as blobs first, the thumbnails are queued once the
+        transaction is committed.
+        """
+        from .tasks import queue_text_extraction, queue_thumbnails
+
+        with transaction.atomic():
+            for document in documents:
+                if document.file and not document.file._committed:
+                    document.attach_blob(Blob.objects.acquire(document.file))
+            documents = self.bulk_create(documents)
+            DocumentStatistic.objects.apply(
+                DocumentStatistic.objects.count_documents(
+                    document.get_statistic_values()
+                    for document in documents))
+            bump_versions(get_document_scopes(*documents))
+            queue_thumbnails([
+                document for document in documents
+                if document.thumbnail_status == THUMBNAIL_STATUS_PENDING])
+            queue_text_extraction([
+                document for document in documents
+                if document.text_status == TEXT_STATUS_PENDING])
+        return documents
+
+    def add_to_array(self, field, value):
+        """
+        Appends `value` to the array `field` of all documents which do not
+        contain it yet, with one UPDATE. Returns the number of documents.
+        """
+        return self._update_array(field, value, 'array_append', 1)
+
+    def remove_from_array(self, field, value):
+        """
+        Removes `value` from the array `field` of all documents containing
+        it, with one UPDATE. Returns the number of documents.
+        """
+        return self._update_array(field, value, 'array_remove', -1)
+
+    def _update_array(self, field, value, function, sign):
+        queryset = self
+        if self.query.count_active_tables() > 1:
+            # The filters of joined tables become a subquery, the array is
+            # checked on the updated row itself, which is checked again
+            # after waiting for a concurrent update of it
+            queryset = self.model.objects.filter(pk__in=self.values('pk'))
+        lookup = {field + '__contains': [value]}
+        queryset = queryset.exclude(**lookup) if sign > 0 \
+            else queryset.filter(**lookup)
+
+        # The statistics of the other workflowlevels and of the whole
+        # organization do not change, only the counts of `value`.
+        table = connection.ops.quote_name(DocumentStatistic._meta.db_table)
+        statistics_sql = (
+            'INSERT INTO {table} (organization_uuid, workflowlevel, '
+            'workflowlevel_uuid, file_type, document_count, total_size) '
+            'SELECT COALESCE(organization_uuid, \'\'), %s, %s, file_type, '
+            '%s * COUNT(*), %s * COALESCE(SUM(file_size), 0) FROM updated '
+            # Sorted, so concurrent transactions lock the rows in one order
+            'GROUP BY 1, 4 ORDER BY 1, 4 ON CONFLICT (organization_uuid, '
+            'workflowlevel, workflowlevel_uuid, file_type) DO UPDATE SET '
+            'document_count = {table}.document_count + '
+            'EXCLUDED.document_count, '
+            'total_size = {table}.total_size + EXCLUDED.total_size'.format(
+                table=table))
+        with transaction.atomic():
+            updated, scopes = queryset._update_returning_scopes(
+                {field: Func(F(field), Value(value), function=function,
+                             output_field=self.model._meta.get_field(field))},
+                statistics_sql,
+                [WORKFLOWLEVEL_FIELD_LEVELS[field], value, sign, sign])
+            if updated:
+                scopes.add(get_workflowlevel_scope(field, value))
+                bump_versions(scopes)
+        return updated
+
+    def _update_returning_scopes(self, values, statistics_sql=None,
+                                 statistics_params=(), changes=None):
+        """
+        Updates the documents to `values` and returns their number and the
+        scopes of their workflowlevels after the update, which the UPDATE
+        returns. `statistics_sql` is run with the updated rows as `updated`,
+        with the columns of STATISTIC_FIELDS. If `changes` are given, the
+        returned rows are added to these statistic changes.
+        """
+        query = self.query.chain(UpdateQuery)
+        query.add_update_values(values)
+        query._annotations = None
+        try:
+            update_sql, params = query.get_compiler(self.db).as_sql()
+        except EmptyResultSet:
+            return 0, set()
+
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        if changes is None:
+            columns = ['(SELECT COUNT(*) FROM updated)'] + [
+                'ARRAY(SELECT DISTINCT unnest({}) FROM updated)'.format(
+                    connection.ops.quote_name(field))
+                for field in WORKFLOWLEVEL_FIELDS]
+        else:
+            columns = ['* FROM updated']
+        sql = 'WITH updated AS ({} RETURNING {}){} SELECT {}'.format(
+            update_sql,
+            ', '.join('{}.{}'.format(table, connection.ops.quote_name(field))
+                      for field in STATISTIC_FIELDS),
+            ', statistics AS ({})'.format(statistics_sql)
+            if statistics_sql else '',
+            ', '.join(columns))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, tuple(params) + tuple(statistics_params))
+            if changes is None:
+                row = cursor.fetchone()
+                return row[0], get_document_scopes(
+                    dict(zip(WORKFLOWLEVEL_FIELDS, row[1:])))
+            rows = cursor.fetchall()
+        DocumentStatistic.objects.count_documents(rows, changes=changes)
+        return len(rows), get_document_scopes(
+            *(dict(zip(STATISTIC_FIELDS, row)) for row in rows))
+
+    def search(self, text):
+        """
+        Returns the documents whose file name, description or extracted
+        text contains the words of `text`, or whose file name contains
+        `text`, annotated with their `search_rank`.
+        """
+        query = SearchQuery(text, config=SEARCH_CONFIG)
+        condition = Q(search_vector=query)
+        if len(text) >= TRIGRAM_MIN_LENGTH:
+            condition |= Q(file_name__icontains=text)
+        # The rank is read back as a double precision value, so the cursor
+        # of the pagination compares equal to it
+        return self.annotate(search_rank=Cast(
+            SearchRank(F('search_vector'), query) +
+            TrigramSimilarity('file_name', text), FloatField())).filter(
+                condition)
+
+    def update(self, **kwargs):
+        # Updates send no signals, so the cached lists and the statistics of
+        # the documents are changed here, from the rows the UPDATE returns
+        with transaction.atomic():
+            queryset = self
+            scopes = set()
+            changes = None
+            if any(field in kwargs for field in STATISTIC_FIELDS):
+                # Only the locked documents are updated, so the statistics
+                # change from exactly these previous values
+                previous = list(self.select_for_update(
+                    of=('self',)).values_list('pk', *STATISTIC_FIELDS))
+                queryset = self.model.objects.filter(
+                    pk__in=[row[0] for row in previous])
+                scopes = get_document_scopes(*(
+                    dict(zip(STATISTIC_FIELDS, row[1:])) for row in previous))
+                changes = DocumentStatistic.objects.count_documents(
+                    (row[1:] for row in previous), sign=-1)
+            updated, updated_scopes = queryset._update_returning_scopes(
+                kwargs, changes=changes)
+            if changes:
+                DocumentStatistic.objects.apply(changes)
+            if updated:
+                bump_versions(scopes | updated_scopes)
+        return updated
+
+    def delete(self):
+        """
+        Deletes the documents and their stored files, which are shared by
+        the documents with the same content.
+        """
+        with transaction.atomic():
+            rows = list(self.select_for_update(of=('self',)).values_list(
+                'pk', 'blob_id', 'file', 'thumbnail', *STATISTIC_FIELDS))
+            # Only the locked documents are deleted, so the statistics
+            # change by exactly these
+            result = super(DocumentQuerySet, self.model.objects.filter(
+                pk__in=[row[0] for row in rows])).delete()
+            DocumentStatistic.objects.apply(
+                DocumentStatistic.objects.count_documents(
+                    (row[4:] for row in rows), sign=-1))
+
+            stored = [row[1:4] for row in rows]
+
+            # Every deleted document held one reference to its blob
+            Blob.objects.release(blob_id for blob_id, _, _ in stored)
+            # Files stored before the blob storage belong to the document
+            transaction.on_commit(partial(
+                delete_files, self.model._meta.get_field('file').storage, [
+                    name for blob_id, file, thumbnail in stored
+                    if blob_id is None for name in (file, thumbnail)]))
+        return result
+
+
+def get_blob_values(blob):
+    """
+    Returns the values of the document fields which describe the content
+    of `blob`.
+    """
+    values = {
+        'blob': blob,
+        'file': blob.file.name,
+        'file_size': blob.size,
+        'file_mime_type': blob.mime_type,
+        'file_sha256': blob.sha256,
+        'image_width': blob.width,
+        'image_height': blob.height,
+    }
+    if blob.thumbnail:
+        values.update(thumbnail=blob.thumbnail.name,
+                      thumbnail_size=blob.thumbnail_size)
+    return values
+
+
 class Document(models.Model):
     uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
 
@@ -71,6 +353,29 @@ class Document(models.Model):
                             null=True,
                             blank=True,
                             )
+    thumbnail_status = models.CharField(
+        max_length=10, choices=THUMBNAIL_STATUS_CHOICES,
+        null=True, blank=True,
+        help_text='Status of the thumbnail generation')
+    file_size = models.BigIntegerField(null=True, blank=True,
+                                       help_text='File size in bytes')
+    file_mime_type = models.CharField(max_length=100, blank=True,
+                                      help_text='MIME type of the content')
+    file_sha256 = models.CharField(max_length=64, blank=True,
+                                   help_text='SHA-256 of the content')
+    file_modified_date = models.DateTimeField(
+        null=True, blank=True, help_text='Time the file was stored')
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail_size = models.BigIntegerField(
+        null=True, blank=True, help_text='Thumbnail size in bytes')
+    text_status = models.CharField(
+        max_length=10, choices=TEXT_STATUS_CHOICES, null=True, blank=True,
+        help_text='Status of the text extraction for the search')
+    content_text = models.TextField(blank=True, editable=False)
+    blob = models.ForeignKey('Blob', null=True, blank=True, editable=False,
+                             on_delete=models.PROTECT,
+                             related_name='documents')
 
     create_date = models.DateTimeField(null=True, blank=True)
     upload_date = models.DateTimeField(null=True, blank=True,
@@ -90,6 +395,30 @@ class Document(models.Model):
     workflowlevel2_uuids = ArrayField(models.CharField(max_length=36),
                                       blank=True, null=True,
                                       help_text='List of Workflowlevel2 UUIDs')
+    # Maintained by the documents_document_search_vector trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['workflowlevel1_uuids'],
+                     name='document_wfl1_uuids_gin'),
+            GinIndex(fields=['workflowlevel2_uuids'],
+                     name='document_wfl2_uuids_gin'),
+            GinIndex(fields=['search_vector'],
+                     name='document_search_vector_gin'),
+            # The list filters read the first page in the order of the ids
+            models.Index(fields=['file_type', 'id'],
+                         name='document_file_type_id_idx'),
+            models.Index(fields=['contact_uuid', 'id'],
+                         name='document_contact_uuid_id_idx'),
+            # Orderings of the list
+            models.Index(fields=['upload_date'],
+                         name='document_upload_date_idx'),
+            models.Index(fields=['create_date'],
+                         name='document_create_date_idx'),
+        ]
 
     def clean_fields(self, exclude=None):
         super(Document, self).clean_fields(exclude=exclude)
@@ -100,64 +429,552 @@ class Document(models.Model):
                                     ', '.join([ft[0] for ft in
                                                FILE_TYPE_CHOICES])))
 
-    def save(self, *args, **kwargs):
-        self.file_type = self.file_name.lower().split('.')[-1]
-        self.full_clean()
+    def get_file_type(self):
+        return self.file_name.lower().split('.')[-1]
 
-        if self.file_type in IMAGE_FILE_TYPES and self.file:
-            self.make_thumbnail()
+    def get_statistic_values(self):
+        """
+        Returns the values of STATISTIC_FIELDS of this document.
+        """
+        return (self.organization_uuid, self.file_type,
+                self.workflowlevel1_uuids, self.workflowlevel2_uuids,
+                self.file_size)
 
-        super(Document, self).save()
+    def save(self, *args, **kwargs):
+        self.file_type = self.get_file_type()
+        # Deferred fields are not loaded for the validation, the blob is
+        # only set by attach_blob and the uuid is unique by default
+        self.full_clean(exclude=list(self.get_deferred_fields()) + ['blob'],
+                        validate_unique=False)
+
+        previous_blob_id = self.blob_id
+        # A file which is not committed to the storage yet is a new upload
+        new_upload = bool(self.file) and not self.file._committed
+        previous_files = ()
+
+        with transaction.atomic():
+            previous = None
+            update_fields = kwargs.get('update_fields')
+            if self.pk and (update_fields is None or set(update_fields) & {
+                    'organization_uuid', 'file_name', 'file_type', 'file',
+                    'file_size', 'workflowlevel1_uuids',
+                    'workflowlevel2_uuids'}):
+                previous = Document.objects.select_for_update(
+                    of=('self',)).filter(pk=self.pk).values_list(
+                    'file', 'thumbnail', *STATISTIC_FIELDS).first()
+            # A document moved to other workflowlevels leaves their cached
+            # lists, see signals.py
+            self._previous_list_scopes = get_document_scopes(dict(zip(
+                STATISTIC_FIELDS, previous[2:]))) if previous else set()
+
+            if new_upload and previous and previous_blob_id is None:
+                # Files stored before the blob storage belong to the
+                # document
+                previous_files = previous[:2]
+            if new_upload:
+                self.attach_blob(Blob.objects.acquire(self.file))
+
+            super(Document, self).save(*args, **kwargs)
+
+            if previous or update_fields is None:
+                changes = DocumentStatistic.objects.count_documents(
+                    [self.get_statistic_values()])
+                if previous:
+                    DocumentStatistic.objects.count_documents(
+                        [previous[2:]], sign=-1, changes=changes)
+                DocumentStatistic.objects.apply(changes)
+
+            if previous_blob_id is not None and \
+                    previous_blob_id != self.blob_id:
+                Blob.objects.release([previous_blob_id])
+            if previous_files:
+                transaction.on_commit(partial(
+                    delete_files, self.file.storage, previous_files))
+
+        if new_upload and self.thumbnail_status == THUMBNAIL_STATUS_PENDING:
+            from .tasks import schedule_thumbnail
+            schedule_thumbnail(self)
+        if new_upload and self.text_status == TEXT_STATUS_PENDING:
+            from .tasks import queue_text_extraction
+            queue_text_extraction([self])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            stored = Document.objects.select_for_update(of=('self',)).filter(
+                pk=self.pk).values_list(*STATISTIC_FIELDS).first()
+            result = super(Document, self).delete(*args, **kwargs)
+            if stored:
+                DocumentStatistic.objects.apply(
+                    DocumentStatistic.objects.count_documents(
+                        [stored], sign=-1))
+            if self.blob_id is not None:
+                Blob.objects.release([self.blob_id])
+            else:
+                transaction.on_commit(partial(
+                    delete_files, self.file.storage,
+                    [self.file.name, self.thumbnail.name]))
+        return result
+
+    def move_to_blob(self):
+        """
+        Moves the stored file of a document without a blob, e.g. stored
+        before the content addressed storage, into a blob and returns the
+        blob. The file is hashed before the document is locked.
+        """
+        document = Document.objects.only('blob', 'file').get(pk=self.pk)
+        if document.blob_id is not None or not document.file:
+            self.blob = document.blob
+            return self.blob
+        name = document.file.name
+        with document.file.storage.open(name, 'rb') as stored_file:
+            metadata = get_file_metadata(stored_file, name)
+
+        with transaction.atomic():
+            document = Document.objects.select_for_update().only(
+                'blob', 'file', 'thumbnail', 'thumbnail_status', 'text_status',
+                *STATISTIC_FIELDS).get(pk=self.pk)
+            if document.blob_id is not None or document.file.name != name:
+                # Moved or given another file concurrently
+                self.blob = document.blob
+                return self.blob
+
+            blob = Blob.objects.acquire_stored(
+                name, document.thumbnail.name or None, metadata=metadata)
+            values = get_blob_values(blob)
+            values.update(thumbnail_status=document.thumbnail_status,
+                          text_status=document.text_status)
+            if blob.thumbnail:
+                values['thumbnail_status'] = THUMBNAIL_STATUS_READY
+            # The update counts the size of the document in the statistics
+            Document.objects.filter(pk=self.pk).update(**values)
+
+        for field, value in values.items():
+            setattr(self, field, value)
+        return blob
+
+    def attach_blob(self, blob):
+        """
+        Points the file and the thumbnail to the stored content of `blob`
+        and copies its metadata.
+        """
+        for field, value in get_blob_values(blob).items():
+            setattr(self, field, value)
+        self.file_modified_date = timezone.now()
+        if not blob.thumbnail:
+            self.thumbnail = None
+            self.thumbnail_size = None
+        self.reset_file_statuses()
+
+    def reset_file_statuses(self):
+        """
+        Sets the thumbnail and text statuses of a new file.
+        """
+        if self.thumbnail:
+            self.thumbnail_status = THUMBNAIL_STATUS_READY
+        elif self.get_file_type() in IMAGE_FILE_TYPES:
+            self.thumbnail_status = THUMBNAIL_STATUS_PENDING
+        else:
+            self.thumbnail_status = None
+
+        # The text of the previous file is not searchable anymore
+        self.content_text = ''
+        self.text_status = TEXT_STATUS_PENDING \
+            if self.get_file_type() in TEXT_FILE_TYPES else None
 
     def make_thumbnail(self):
-        if self.file_type in ['jpg', 'jpeg']:
-            ftype = 'JPEG'
-        elif self.file_type == 'gif':
-            ftype = 'GIF'
-        elif self.file_type == 'png':
-            ftype = 'PNG'
-        else:
+        thumbnail = make_resized_file(self.file, self.file_type,
+                                      THUMBNAIL_DIMENSIONS,
+                                      name=self.file.name)
+        if thumbnail is None:
             return False
 
-        # load image
-        image = Image.open(self.file)
+        self.thumbnail = thumbnail
+        self.thumbnail_size = thumbnail.size
 
-        # scale and crop image to maintain ratio
-        size = THUMBNAIL_DIMENSIONS
-        image_ratio = image.size[0] / image.size[1]
+    def __str__(self):
+        return u'{} {}'.format(self.file_type, self.file_name)
 
-        ratio = size[0] / size[1]
 
-        if ratio > image_ratio:
-            image = image.resize(
-                (size[0], int(size[0] * image.size[1] / image.size[0])),
-                Image.ANTIALIAS)
+class DocumentWorkflowLevel(models.Model):
+    """
+    One row per workflowlevel UUID of a document, maintained by the
+    documents_document_workflowlevels trigger. The workflowlevel filters of
+    the list read the documents of a workflowlevel from its unique index in
+    the order of their ids.
+    """
+    document = models.ForeignKey(Document, on_delete=models.DO_NOTHING,
+                                 db_constraint=False,
+                                 related_name='workflowlevels')
+    workflowlevel = models.CharField(max_length=20,
+                                     choices=WORKFLOWLEVEL_CHOICES)
+    workflowlevel_uuid = models.CharField(max_length=36)
 
-            box = (0, (image.size[1] - size[1]) / 2,
-                   image.size[0], (image.size[1] + size[1]) / 2)
+    class Meta:
+        unique_together = ('workflowlevel', 'workflowlevel_uuid', 'document')
 
-            image = image.crop(box)
-        elif ratio < image_ratio:
-            image = image.resize(
-                (int(size[1] * image.size[0] / image.size[1]), size[1]),
-                Image.ANTIALIAS)
+    def __str__(self):
+        return u'{} {}'.format(self.workflowlevel_uuid, self.document_id)
+
+
+class BlobManager(models.Manager):
+    def acquire(self, field_file):
+        """
+        Returns the blob with the content of the uncommitted `field_file`
+        and adds a reference to it. The content is only stored if no blob
+        with the same content exists yet.
+        """
+        metadata = get_file_metadata(field_file, field_file.name)
+        sha256 = metadata.sha256
+        extension = field_file.name.split('.')[-1].lower()
+
+        with transaction.atomic():
+            blob = self.select_for_update().filter(sha256=sha256).first()
+            if blob is not None:
+                return self._add_reference(blob, metadata)
+
+            try:
+                with transaction.atomic():
+                    blob = self.model(reference_count=1,
+                                      **metadata._asdict())
+                    blob.file.save('%s.%s' % (sha256, extension),
+                                   field_file.file, save=False)
+                    blob.save()
+                    return blob
+            except IntegrityError:
+                # The same content was stored concurrently
+                return self._add_reference(
+                    self.select_for_update().get(sha256=sha256), metadata)
+
+    def acquire_stored(self, name, thumbnail_name=None, metadata=None):
+        """
+        Returns the blob with the content of the already stored file `name`
+        and adds a reference to it. If a blob with the same content exists
+        the stored file is deleted once the transaction is committed,
+        otherwise it becomes the new blob. The file is read to get its
+        `metadata` unless they are given.
+        """
+        storage = self.model._meta.get_field('file').storage
+        if metadata is None:
+            with storage.open(name, 'rb') as stored_file:
+                metadata = get_file_metadata(stored_file, name)
+        thumbnail_size = storage.size(thumbnail_name) \
+            if thumbnail_name else None
+
+        with transaction.atomic():
+            blob = self.select_for_update().filter(
+                sha256=metadata.sha256).first()
+            if blob is None:
+                return self.create(reference_count=1, file=name,
+                                   thumbnail=thumbnail_name,
+                                   thumbnail_size=thumbnail_size,
+                                   **metadata._asdict())
+
+            blob = self._add_reference(blob, metadata)
+            duplicates = [name] if blob.file.name != name else []
+            if thumbnail_name and not blob.thumbnail:
+                blob.thumbnail = thumbnail_name
+                blob.thumbnail_size = thumbnail_size
+                blob.save(update_fields=['thumbnail', 'thumbnail_size'])
+            elif thumbnail_name and thumbnail_name != blob.thumbnail.name:
+                duplicates.append(thumbnail_name)
+
+            def delete_duplicates():
+                for duplicate in duplicates:
+                    storage.delete(duplicate)
+
+            transaction.on_commit(delete_duplicates)
+            return blob
+
+    def _add_reference(self, blob, metadata):
+        values = {}
+        if not blob.mime_type:
+            # Blobs stored before the metadata was recorded
+            values = metadata._asdict()
+            for field, value in values.items():
+                setattr(blob, field, value)
+        self.filter(pk=blob.pk).update(
+            reference_count=F('reference_count') + 1, **values)
+        blob.reference_count += 1
+        return blob
+
+    def release(self, blob_ids):
+        """
+        Removes a reference from the blob of every id in `blob_ids`, ids of
+        blobs referenced several times are repeated. Blobs without
+        references are deleted with their stored files once the
+        transaction is committed.
+        """
+        counts = Counter(blob_id for blob_id in blob_ids if blob_id)
+        if not counts:
+            return
+
+        with transaction.atomic():
+            released = defaultdict(list)
+            for blob_id, count in counts.items():
+                released[count].append(blob_id)
+            for count, ids in released.items():
+                self.filter(pk__in=ids).update(
+                    reference_count=F('reference_count') - count)
+
+            # A rollback keeps the files of the blobs
+            transaction.on_commit(partial(self.delete_unreferenced,
+                                          list(counts)))
+
+    def delete_unreferenced(self, blob_ids=None):
+        """
+        Deletes the blobs of `blob_ids`, or all blobs, which have no
+        references anymore with their stored files, which are deleted in
+        batches.
+        """
+        with transaction.atomic():
+            blobs = self.select_for_update().filter(reference_count=0)
+            referenced = Document.objects.exclude(blob=None)
+            if blob_ids is not None:
+                blobs = blobs.filter(pk__in=blob_ids)
+                referenced = referenced.filter(blob__in=blob_ids)
+            blobs = list(blobs.exclude(pk__in=referenced.values('blob')))
+            if not blobs:
+                return
+
+            names = list(Rendition.objects.filter(
+                blob__in=blobs).values_list('file', flat=True))
+            for blob in blobs:
+                names += [blob.file.name, blob.thumbnail.name]
+
+            # Delete while the rows are locked, so a concurrent upload of
+            # the same content waits and stores it again afterwards, or
+            # adds a reference first and keeps the blob.
+            self.filter(pk__in=[blob.pk for blob in blobs]).delete()
+            delete_files(self.model._meta.get_field('file').storage, names)
+
+
+class Blob(models.Model):
+    """
+    Stored file content, shared by all documents with the same content.
+    """
+    sha256 = models.CharField(max_length=64, unique=True,
+                              help_text='SHA-256 of the content')
+    file = models.FileField(upload_to=make_blob_filepath, max_length=255)
+    thumbnail = models.FileField(upload_to=make_blob_filepath,
+                                 max_length=255, null=True, blank=True)
+    size = models.BigIntegerField(help_text='File size in bytes')
+    mime_type = models.CharField(max_length=100, blank=True,
+                                 help_text='MIME type of the content')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail_size = models.BigIntegerField(
+        null=True, blank=True, help_text='Thumbnail size in bytes')
+    reference_count = models.PositiveIntegerField(default=0)
+    create_date = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def set_thumbnail(self, content):
+        """
+        Stores the thumbnail `content` and points all documents with this
+        blob to it.
+        """
+        extension = self.file.name.split('.')[-1].lower()
+        self.thumbnail_size = content.size
+        self.thumbnail.save('%s_thumbnail.%s' % (self.sha256, extension),
+                            content, save=False)
+        Blob.objects.filter(pk=self.pk).update(
+            thumbnail=self.thumbnail.name, thumbnail_size=self.thumbnail_size)
+        self.documents.update(thumbnail=self.thumbnail.name,
+                              thumbnail_size=self.thumbnail_size,
+                              thumbnail_status=THUMBNAIL_STATUS_READY)
 
-            box = (
-                int((image.size[0] - size[0]) / 2), 0,
-                int((image.size[0] + size[0]) / 2), image.size[1])
+    def __str__(self):
+        return self.sha256
 
-            image = image.crop(box)
-        else:
-            image = image.resize((size[0], size[1]), Image.ANTIALIAS)
 
-        # save temporary image
-        temp_thumb = BytesIO()
+class Rendition(models.Model):
+    """
+    Resized image of a blob, generated on the first request.
+    """
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE,
+                             related_name='renditions')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    fit = models.CharField(max_length=10, choices=FIT_CHOICES)
+    file = models.FileField(upload_to=make_rendition_filepath,
+                            max_length=255)
+    create_date = models.DateTimeField(auto_now_add=True)
 
-        image.save(temp_thumb, ftype)
-        temp_thumb.seek(0)
+    class Meta:
+        unique_together = ('blob', 'width', 'height', 'fit')
 
-        self.thumbnail = ContentFile(temp_thumb.read(),
-                                     name=self.file.name)
+    def __str__(self):
+        return u'{} {}x{} {}'.format(self.blob, self.width, self.height,
+                                     self.fit)
+
+
+class DocumentStatisticManager(models.Manager):
+    def get_file_types(self, organization_uuid=None, workflowlevel1_uuid=None,
+                       workflowlevel2_uuid=None):
+        """
+        Returns the number and total size of the documents per file type of
+        an organization and/or a workflowlevel, or of all documents.
+        """
+        filters = {'workflowlevel': '', 'workflowlevel_uuid': ''}
+        if workflowlevel1_uuid is not None:
+            filters.update(workflowlevel=WORKFLOWLEVEL1,
+                           workflowlevel_uuid=workflowlevel1_uuid)
+        elif workflowlevel2_uuid is not None:
+            filters.update(workflowlevel=WORKFLOWLEVEL2,
+                           workflowlevel_uuid=workflowlevel2_uuid)
+        if organization_uuid is not None:
+            filters['organization_uuid'] = organization_uuid
+
+        rows = self.filter(document_count__gt=0, **filters).values(
+            'file_type').annotate(count=Sum('document_count'),
+                                  size=Sum('total_size')).order_by('file_type')
+        return [{'file_type': row['file_type'],
+                 'document_count': row['count'],
+                 'total_size': row['size']} for row in rows]
+
+    def count_documents(self, rows, sign=1, changes=None):
+        """
+        Adds `sign` times the documents `rows`, tuples of the values of
+        STATISTIC_FIELDS, to the statistic `changes` and returns them.
+        """
+        if changes is None:
+            changes = defaultdict(lambda: [0, 0])
+        for organization_uuid, file_type, workflowlevel1_uuids, \
+                workflowlevel2_uuids, size in rows:
+            organization_uuid = organization_uuid or ''
+            keys = [(organization_uuid, '', '', file_type)]
+            for workflowlevel, values in (
+                    (WORKFLOWLEVEL1, workflowlevel1_uuids),
+                    (WORKFLOWLEVEL2, workflowlevel2_uuids)):
+                keys += [(organization_uuid, workflowlevel, value, file_type)
+                         for value in set(values or ())]
+            for key in keys:
+                changes[key][0] += sign
+                changes[key][1] += sign * (size or 0)
+        return changes
+
+    def apply(self, changes):
+        """
+        Adds the `changes` to the stored statistics with one upsert per
+        STATISTIC_BATCH_SIZE rows.
+        """
+        # Sorted, so concurrent transactions lock the rows in one order
+        rows = [key + tuple(change) for key, change in sorted(changes.items())
+                if any(change)]
+        if not rows:
+            return
+
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        placeholders = '({})'.format(', '.join(['%s'] * len(rows[0])))
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), STATISTIC_BATCH_SIZE):
+                self._upsert(cursor, table, placeholders,
+                             rows[start:start + STATISTIC_BATCH_SIZE])
+
+    def _upsert(self, cursor, table, placeholders, rows):
+        cursor.execute(
+            'INSERT INTO {table} (organization_uuid, workflowlevel, '
+            'workflowlevel_uuid, file_type, document_count, total_size) '
+            'VALUES {values} ON CONFLICT (organization_uuid, '
+            'workflowlevel, workflowlevel_uuid, file_type) DO UPDATE SET '
+            'document_count = {table}.document_count + '
+            'EXCLUDED.document_count, '
+            'total_size = {table}.total_size + EXCLUDED.total_size'.format(
+                table=table, values=', '.join([placeholders] * len(rows))),
+            [value for row in rows for value in row])
+
+
+class DocumentStatistic(models.Model):
+    """
+    Number and total file size of the documents per organization, file type
+    and workflowlevel, changed in the transactions which change the
+    documents.
+    """
+    organization_uuid = models.CharField(max_length=36, blank=True)
+    workflowlevel = models.CharField(max_length=20, blank=True,
+                                     choices=WORKFLOWLEVEL_CHOICES)
+    workflowlevel_uuid = models.CharField(max_length=36, blank=True)
+    file_type = models.CharField(max_length=10)
+    document_count = models.BigIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+
+    objects = DocumentStatisticManager()
+
+    class Meta:
+        unique_together = ('organization_uuid', 'workflowlevel',
+                           'workflowlevel_uuid', 'file_type')
+        # The statistics of a workflowlevel without an organization
+        indexes = [
+            models.Index(fields=['workflowlevel', 'workflowlevel_uuid'],
+                         name='statistic_workflowlevel_idx'),
+        ]
 
     def __str__(self):
-        return u'{} {}'.format(self.file_type, self.file_name)
+        return u'{} {} {} {}'.format(self.organization_uuid,
+                                     self.workflowlevel_uuid, self.file_type,
+                                     self.document_count)
+
+
+class UploadSession(models.Model):
+    """
+    Resumable upload of a file in numbered chunks. The chunks can arrive
+    in any order and are assembled into `file_path` on finalization.
+    """
+    uuid = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
+    file_name = models.CharField(max_length=200, help_text='Filename')
+    file_path = models.CharField(max_length=255, editable=False,
+                                 help_text='Storage name of the final file')
+    size = models.BigIntegerField(help_text='Total file size in bytes')
+    chunk_size = models.PositiveIntegerField(
+        help_text='Size in bytes of every chunk except the last one')
+    upload_id = models.CharField(max_length=1024, null=True, blank=True,
+                                 editable=False,
+                                 help_text='Storage multipart upload ID')
+    document = models.OneToOneField(Document, null=True, blank=True,
+                                    on_delete=models.SET_NULL,
+                                    related_name='upload_session')
+    create_date = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def get_chunk_size(self, number):
+        """
+        Returns the expected size of the chunk `number` (zero-based).
+        """
+        if number == self.chunk_count - 1:
+            return self.size - number * self.chunk_size
+        return self.chunk_size
+
+    def get_received_ranges(self, numbers):
+        """
+        Merges the received chunk numbers into inclusive byte ranges.
+        """
+        ranges = []
+        for number in sorted(numbers):
+            start = number * self.chunk_size
+            end = start + self.get_chunk_size(number) - 1
+            if ranges and ranges[-1][1] + 1 == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def __str__(self):
+        return u'{} {}'.format(self.uuid, self.file_name)
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE,
+                                related_name='chunks')
+    number = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    etag = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        unique_together = ('session', 'number')
+
+    def __str__(self):
+        return u'{} #{}'.format(self.session_id, self.number)
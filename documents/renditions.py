@@ -0,0 +1,44 @@
+import hashlib
+
+from django.db import connection, transaction
+
+from .images import make_resized_file
+from .models import Rendition
+
+
+def _lock(key):
+    """
+    Takes a Postgres advisory lock on `key` which is released at the end of
+    the current transaction.
+    """
+    lock_id = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:15], 16)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [lock_id])
+
+
+def get_rendition(blob, width, height, fit):
+    """
+    Returns the rendition of `blob`, generating and storing it on the first
+    request. Concurrent requests for the same missing rendition wait for
+    one of them to generate it instead of resizing the image each.
+    """
+    lookup = {'blob': blob, 'width': width, 'height': height, 'fit': fit}
+    rendition = Rendition.objects.filter(**lookup).first()
+    if rendition is not None:
+        return rendition
+
+    with transaction.atomic():
+        _lock('rendition:{}:{}x{}:{}'.format(blob.pk, width, height, fit))
+        # The rendition was generated while waiting for the lock
+        rendition = Rendition.objects.filter(**lookup).first()
+        if rendition is not None:
+            return rendition
+
+        file_type = blob.file.name.split('.')[-1].lower()
+        content = make_resized_file(blob.file, file_type, (width, height),
+                                    fit)
+        rendition = Rendition(**lookup)
+        rendition.file.save('{}_{}x{}_{}.{}'.format(
+            blob.sha256, width, height, fit, file_type), content, save=False)
+        rendition.save()
+        return rendition
@@ -0,0 +1,35 @@
+from rest_framework import filters
+
+SEARCH_PARAM = 'search'
+SEARCH_RANK = 'search_rank'
+
+
+def get_search_text(request):
+    """
+    Returns the text of the `search` query parameter, or an empty string if
+    the documents are not searched.
+    """
+    return request.query_params.get(SEARCH_PARAM, '').strip()
+
+
+class DocumentSearchFilter(filters.BaseFilterBackend):
+    """
+    Full text search over the file name and description of the documents,
+    which also matches parts of file names.
+    """
+    def filter_queryset(self, request, queryset, view):
+        text = get_search_text(request)
+        if not text:
+            return queryset
+        return queryset.search(text)
+
+
+class DocumentOrderingFilter(filters.OrderingFilter):
+    """
+    Orders searched documents by their rank unless an ordering is given.
+    """
+    def get_default_ordering(self, view):
+        if get_search_text(view.request):
+            # The id breaks ties, which keeps the cursor pages stable
+            return ('-' + SEARCH_RANK, 'id')
+        return super(DocumentOrderingFilter, self).get_default_ordering(view)
@@ -1,33 +1,87 @@
 from rest_framework import serializers
-from .models import Document, FILE_TYPE_CHOICES
-import base64
+from .models import Document, FILE_TYPE_CHOICES, UploadSession, make_filepath
+from .images import FIT_CHOICES, FIT_CROP
+from .uploads import get_chunk_backend
+import binascii
+import os
 import uuid
-from django.core.files.base import ContentFile
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+BASE64_BLOCK_SIZE = 64 * 1024
+
+
+def decode_base64(data, start=0, max_memory_size=None):
+    """
+    Decodes the base64 `data` from the index `start` on block by block into
+    a spooled temporary file, which is kept in memory up to
+    `max_memory_size` bytes and moved to disk above.
+    """
+    output = SpooledTemporaryFile(max_size=max_memory_size or 0)
+    remainder = ''
+    for offset in range(start, len(data), BASE64_BLOCK_SIZE):
+        # Drop whitespace and keep the blocks aligned to 4 characters
+        block = remainder + ''.join(
+            data[offset:offset + BASE64_BLOCK_SIZE].split())
+        cut = len(block) - len(block) % 4
+        output.write(binascii.a2b_base64(block[:cut]))
+        remainder = block[cut:]
+
+    if remainder:
+        output.close()
+        raise binascii.Error('Incorrect padding')
+
+    output.seek(0)
+    return output
 
 
 class Base64FileField(serializers.FileField):
     base_url = '/documents/file/{}/'
+    default_error_messages = {
+        'max_size': 'Ensure this file is not larger than {max_size} bytes.',
+    }
 
     def to_representation(self, value):
         if not value:
             return None
 
-        doc = Document.objects.get(file=value)
-        url = self.base_url.format(doc.id)
-
-        return url
+        return self.base_url.format(value.instance.pk)
 
     def to_internal_value(self, data):
+        max_size = settings.DOCUMENT_MAX_UPLOAD_SIZE
+
         if isinstance(data, str) and (data.startswith('data:')):
-            format, filestr = data.split(';base64,')
-            ext = format.split('/')[-1]
+            separator = data.find(';base64,', 0, 255)
+            if separator == -1:
+                self.fail('invalid')
 
+            content_type = data[len('data:'):separator]
+            ext = content_type.split('/')[-1]
             if ext not in [ft[0] for ft in FILE_TYPE_CHOICES]:
-                super(Base64FileField, self).fail('invalid')
-
+                self.fail('invalid')
+
+            start = separator + len(';base64,')
+            # Reject too large files before decoding anything
+            if max_size and (len(data) - start) // 4 * 3 > max_size + 2:
+                self.fail('max_size', max_size=max_size)
+
+            try:
+                content = decode_base64(
+                    data, start, settings.DOCUMENT_BASE64_MAX_MEMORY_SIZE)
+            except (binascii.Error, ValueError):
+                self.fail('invalid')
+
+            content.seek(0, os.SEEK_END)
+            size = content.tell()
+            content.seek(0)
             id = uuid.uuid4()
-            data = ContentFile(base64.b64decode(filestr),
-                               name=id.urn[9:] + '.' + ext)
+            data = UploadedFile(content, name=id.urn[9:] + '.' + ext,
+                                content_type=content_type, size=size)
+
+        if max_size and getattr(data, 'size', 0) > max_size:
+            self.fail('max_size', max_size=max_size)
+
         return super(Base64FileField, self).to_internal_value(data)
 
 
@@ -38,10 +92,7 @@ class MaskedThumbnailField(serializers.ReadOnlyField):
         if not value:
             return None
 
-        doc = Document.objects.get(thumbnail=value)
-        url = self.base_url.format(doc.id)
-
-        return url
+        return self.base_url.format(value.instance.pk)
 
     def to_internal_value(self, data):
         return None
@@ -53,7 +104,149 @@ class DocumentSerializer(serializers.ModelSerializer):
     upload_date = serializers.ReadOnlyField()
     file = Base64FileField()
     thumbnail = MaskedThumbnailField()
+    thumbnail_status = serializers.ReadOnlyField()
 
     class Meta:
         model = Document
-        fields = '__all__'
+        exclude = ('blob', 'search_vector', 'content_text')
+        read_only_fields = ('file_size', 'file_mime_type', 'file_sha256',
+                            'file_modified_date', 'image_width',
+                            'image_height', 'thumbnail_size', 'text_status')
+
+    def __init__(self, *args, **kwargs):
+        # Limits the serialized fields to these names
+        fields = kwargs.pop('fields', None)
+        super(DocumentSerializer, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    id = serializers.ReadOnlyField()
+    uuid = serializers.ReadOnlyField()
+    size = serializers.IntegerField(min_value=1)
+    chunk_size = serializers.IntegerField(
+        min_value=1, default=settings.DOCUMENT_UPLOAD_CHUNK_SIZE)
+    chunk_count = serializers.ReadOnlyField()
+    received_ranges = serializers.SerializerMethodField()
+    missing_chunks = serializers.SerializerMethodField()
+    document = serializers.PrimaryKeyRelatedField(read_only=True)
+    create_date = serializers.ReadOnlyField()
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'uuid', 'file_name', 'size', 'chunk_size',
+                  'chunk_count', 'received_ranges', 'missing_chunks',
+                  'document', 'create_date')
+
+    def _get_received_chunks(self, obj):
+        if not hasattr(obj, '_received_chunks'):
+            obj._received_chunks = list(
+                obj.chunks.values_list('number', flat=True))
+        return obj._received_chunks
+
+    def get_received_ranges(self, obj):
+        return obj.get_received_ranges(self._get_received_chunks(obj))
+
+    def get_missing_chunks(self, obj):
+        received = set(self._get_received_chunks(obj))
+        return [number for number in range(obj.chunk_count)
+                if number not in received]
+
+    def validate_size(self, value):
+        max_size = settings.DOCUMENT_MAX_UPLOAD_SIZE
+        if max_size and value > max_size:
+            raise serializers.ValidationError(
+                'Ensure this value is less than or equal to {}.'.format(
+                    max_size))
+        return value
+
+    def validate_file_name(self, value):
+        if value.lower().split('.')[-1] not in \
+                [ft[0] for ft in FILE_TYPE_CHOICES]:
+            raise serializers.ValidationError(
+                'Allowed File Types: {}'.format(
+                    ', '.join([ft[0] for ft in FILE_TYPE_CHOICES])))
+        return value
+
+    def validate(self, attrs):
+        backend = get_chunk_backend()
+        size, chunk_size = attrs['size'], attrs['chunk_size']
+
+        if size > chunk_size and chunk_size < backend.min_chunk_size:
+            raise serializers.ValidationError(
+                {'chunk_size': 'Ensure this value is greater than or equal '
+                               'to {}.'.format(backend.min_chunk_size)})
+
+        if -(-size // chunk_size) > backend.max_chunk_count:
+            raise serializers.ValidationError(
+                {'chunk_size': 'The file cannot be split into more than '
+                               '{} chunks.'.format(backend.max_chunk_count)})
+        return attrs
+
+    def create(self, validated_data):
+        session = UploadSession(
+            file_path=make_filepath('file', None, validated_data['file_name']),
+            **validated_data)
+        get_chunk_backend().start(session)
+        session.save()
+        return session
+
+
+class RenditionSerializer(serializers.Serializer):
+    width = serializers.IntegerField(min_value=1)
+    height = serializers.IntegerField(min_value=1)
+    fit = serializers.ChoiceField(choices=FIT_CHOICES, default=FIT_CROP)
+
+    def validate(self, attrs):
+        size = (attrs['width'], attrs['height'])
+        if size not in settings.DOCUMENT_RENDITION_SIZES:
+            raise serializers.ValidationError(
+                'Allowed sizes are {}.'.format(', '.join(
+                    '{}x{}'.format(*allowed)
+                    for allowed in settings.DOCUMENT_RENDITION_SIZES)))
+        return attrs
+
+
+class DocumentSelectionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                required=False)
+
+
+class WorkflowlevelUpdateSerializer(DocumentSelectionSerializer):
+    OPERATION_ADD = 'add'
+    OPERATION_REMOVE = 'remove'
+
+    operation = serializers.ChoiceField(choices=(OPERATION_ADD,
+                                                 OPERATION_REMOVE))
+    field = serializers.ChoiceField(choices=('workflowlevel1_uuids',
+                                             'workflowlevel2_uuids'))
+    uuid = serializers.CharField(max_length=36)
+
+
+class DocumentStatisticsQuerySerializer(serializers.Serializer):
+    organization_uuid = serializers.CharField(max_length=36, required=False)
+    workflowlevel1_uuid = serializers.CharField(max_length=36,
+                                                required=False)
+    workflowlevel2_uuid = serializers.CharField(max_length=36,
+                                                required=False)
+
+    def validate(self, attrs):
+        if 'workflowlevel1_uuid' in attrs and 'workflowlevel2_uuid' in attrs:
+            raise serializers.ValidationError(
+                'Filter by workflowlevel1_uuid or workflowlevel2_uuid, '
+                'not both.')
+        return attrs
+
+
+class FileTypeStatisticSerializer(serializers.Serializer):
+    file_type = serializers.CharField()
+    document_count = serializers.IntegerField()
+    total_size = serializers.IntegerField()
+
+
+class DocumentStatisticsSerializer(serializers.Serializer):
+    document_count = serializers.IntegerField()
+    total_size = serializers.IntegerField()
+    file_types = FileTypeStatisticSerializer(many=True)
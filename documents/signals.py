@@ -1,9 +1,17 @@
 from django.db.models import signals
 from django.dispatch import receiver
 
+from .caching import bump_versions, get_document_scopes
 from .models import Document
 
 
-@receiver(signals.pre_save, sender=Document)
-def pre_save_handler(sender, instance, *args, **kwargs):
-    instance.full_clean()
+@receiver(signals.post_save, sender=Document)
+def invalidate_lists_on_save(sender, instance, **kwargs):
+    # Document.save sets the scopes of the row it replaced
+    bump_versions(get_document_scopes(instance) |
+                  getattr(instance, '_previous_list_scopes', set()))
+
+
+@receiver(signals.post_delete, sender=Document)
+def invalidate_lists_on_delete(sender, instance, **kwargs):
+    bump_versions(get_document_scopes(instance))
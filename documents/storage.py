@@ -0,0 +1,428 @@
+import fcntl
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files import File
+from storages.backends.s3boto3 import S3Boto3Storage
+
+logger = logging.getLogger(__name__)
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+
+# Seconds between the attempts to lock a cache entry which another worker
+# is filling
+CACHE_LOCK_INTERVAL = 0.05
+# Temporary files of a fill which are older were left by a killed worker
+CACHE_FILL_MAX_AGE = 3600
+# Seconds after which the cache directory is scanned even if the recorded
+# size is within the limit, which corrects the size and removes the
+# temporary files of killed workers
+CACHE_SCAN_INTERVAL = 3600
+# An eviction deletes files until the cache is this much of its size, so
+# it does not run again on the next fill
+CACHE_EVICT_RATIO = 0.9
+CACHE_LOCK_NAME = '.lock'
+CACHE_SIZE_NAME = '.size'
+CACHE_FILL_PREFIX = '.fill-'
+CACHE_ENTRY_LOCK_PREFIX = '.lock-'
+
+
+def get_s3_key(storage, name):
+    """
+    Returns the S3 key of the file `name` in the S3 `storage`.
+    """
+    return storage._encode_name(storage._normalize_name(
+        storage._clean_name(name)))
+
+
+def _flock(file, wait=True):
+    """
+    Locks `file` exclusively between processes and returns True, or False
+    if it is locked and `wait` is False. The lock is polled, a blocking
+    flock would stop all greenlets of a gevent worker.
+    """
+    while True:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if not wait:
+                return False
+            time.sleep(CACHE_LOCK_INTERVAL)
+
+
+@contextmanager
+def _lock_file(path, wait=True, remove=False):
+    """
+    Locks the file `path` exclusively between processes and yields True,
+    or False if it is locked and `wait` is False. With `remove` the file is
+    deleted when it is unlocked, waiting processes then lock a new one.
+    """
+    while True:
+        file = open(path, 'a')
+        locked = _flock(file, wait)
+        if locked and remove:
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(file.fileno()).st_ino:
+                # Removed by the previous holder while this one waited
+                file.close()
+                continue
+        break
+
+    with file:
+        try:
+            yield locked
+        finally:
+            if locked:
+                if remove:
+                    _remove_cache_entry(path)
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _add_to_counter(path, delta):
+    """
+    Adds `delta` to the number stored in the file `path` and returns the
+    new number, starting from 0.
+    """
+    with open(path, 'a+') as file:
+        _flock(file)
+        try:
+            file.seek(0)
+            value = int(file.read() or 0) + delta
+            file.truncate(0)
+            file.write(str(value))
+            file.flush()
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+    return value
+
+
+def _open_cache_entry(path):
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    # The modification time is the time of the last read
+    now = time.time()
+    os.utime(file.fileno(), (now, now))
+    return file
+
+
+def _remove_cache_entry(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class CachedS3Storage(S3Boto3Storage):
+    """
+    S3 storage which keeps the files it reads in a local directory, so hot
+    files are downloaded once per host instead of once per read.
+
+    A missing file is downloaded to a temporary file and renamed into the
+    cache, the workers wait for a fill of the same file by another worker
+    instead of downloading it again. The size of the cached files is
+    recorded with every fill; once it is above `cache_size` bytes the least
+    recently read files are evicted. The size of a missing file is checked
+    with a HEAD request first, files larger than `max_file_size` or
+    `cache_size` are read from S3 directly.
+    """
+    def __init__(self, cache_dir=None, cache_size=None, max_file_size=None,
+                 **kwargs):
+        super(CachedS3Storage, self).__init__(**kwargs)
+        self.cache_dir = cache_dir or settings.DOCUMENT_STORAGE_CACHE_DIR
+        self.cache_size = settings.DOCUMENT_STORAGE_CACHE_SIZE \
+            if cache_size is None else cache_size
+        self.max_file_size = settings.DOCUMENT_STORAGE_CACHE_MAX_FILE_SIZE \
+            if max_file_size is None else max_file_size
+
+    def get_cache_path(self, name):
+        key = hashlib.sha256(
+            get_s3_key(self, name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def open_cached(self, name):
+        """
+        Returns the cached file `name` opened for reading, downloaded first
+        if it is not cached yet, or None if it is too large to be cached.
+        """
+        path = self.get_cache_path(name)
+        file = _open_cache_entry(path)
+        if file is not None:
+            return file
+
+        directory, key = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        # Every file has its own lock, fills of different files run at once
+        with _lock_file(os.path.join(directory,
+                                     CACHE_ENTRY_LOCK_PREFIX + key),
+                        remove=True):
+            # Filled by another worker while this one waited
+            file = _open_cache_entry(path)
+            if file is not None:
+                return file
+
+            size = self.connection.meta.client.head_object(
+                Bucket=self.bucket_name,
+                Key=get_s3_key(self, name))['ContentLength']
+            if size > self.get_max_file_size():
+                return None
+            file = self._fill(name, path)
+
+        if file is not None:
+            total = _add_to_counter(
+                os.path.join(self.cache_dir, CACHE_SIZE_NAME),
+                os.fstat(file.fileno()).st_size)
+            if total > self.cache_size or self._scan_due():
+                self.evict()
+        return file
+
+    def get_max_file_size(self):
+        return min(self.max_file_size or self.cache_size, self.cache_size)
+
+    def _fill(self, name, path):
+        response = self.connection.meta.client.get_object(
+            Bucket=self.bucket_name, Key=get_s3_key(self, name))
+        body = response['Body']
+        try:
+            # Replaced by a larger file since the HEAD request
+            if response['ContentLength'] > self.get_max_file_size():
+                return None
+
+            descriptor, temporary = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=CACHE_FILL_PREFIX)
+            try:
+                with os.fdopen(descriptor, 'wb') as file:
+                    shutil.copyfileobj(body, file, 64 * 1024)
+                # Opened before the rename, an eviction cannot remove it
+                # before it is read
+                file = open(temporary, 'rb')
+                os.rename(temporary, path)
+            except BaseException:
+                _remove_cache_entry(temporary)
+                raise
+        finally:
+            body.close()
+        return file
+
+    def _scan_due(self):
+        try:
+            scanned = os.stat(os.path.join(self.cache_dir,
+                                           CACHE_LOCK_NAME)).st_mtime
+        except FileNotFoundError:
+            return True
+        return time.time() - scanned > CACHE_SCAN_INTERVAL
+
+    def evict(self):
+        """
+        Deletes the least recently read files until the cache holds at most
+        CACHE_EVICT_RATIO of `cache_size` bytes and records the size of the
+        remaining files. Skipped while another worker evicts.
+        """
+        lock_path = os.path.join(self.cache_dir, CACHE_LOCK_NAME)
+        with _lock_file(lock_path, wait=False) as locked:
+            if not locked:
+                return
+
+            entries = []
+            now = time.time()
+            for directory in os.scandir(self.cache_dir):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.startswith(CACHE_FILL_PREFIX):
+                        if now - stat.st_mtime > CACHE_FILL_MAX_AGE:
+                            _remove_cache_entry(entry.path)
+                    elif not entry.name.startswith('.'):
+                        entries.append((stat.st_mtime, stat.st_size,
+                                        entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            if total > self.cache_size:
+                for _, size, path in sorted(entries):
+                    if total - removed <= \
+                            self.cache_size * CACHE_EVICT_RATIO:
+                        break
+                    # Files which are open stay readable until they are
+                    # closed
+                    _remove_cache_entry(path)
+                    removed += size
+
+            # The recorded size becomes the scanned one, fills recorded
+            # after it was read stay added
+            size_path = os.path.join(self.cache_dir, CACHE_SIZE_NAME)
+            recorded = _add_to_counter(size_path, 0)
+            _add_to_counter(size_path, total - removed - recorded)
+            os.utime(lock_path, (now, now))
+
+    def discard(self, name):
+        """
+        Removes the file `name` from the cache of this host.
+        """
+        path = self.get_cache_path(name)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return
+        _remove_cache_entry(path)
+        _add_to_counter(os.path.join(self.cache_dir, CACHE_SIZE_NAME),
+                        -size)
+
+    def _open(self, name, mode='rb'):
+        file = None
+        if not any(flag in mode for flag in 'wa+'):
+            try:
+                file = self.open_cached(name)
+            except ClientError as err:
+                if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                    raise IOError('File does not exist: %s' % name)
+                raise
+        if file is None:
+            return super(CachedS3Storage, self)._open(name, mode)
+        return File(file, name=name)
+
+    def _save(self, name, content):
+        name = super(CachedS3Storage, self)._save(name, content)
+        # An overwritten file must not be read from the cache
+        self.discard(name)
+        return name
+
+    def delete(self, name):
+        super(CachedS3Storage, self).delete(name)
+        self.discard(name)
+
+
+def delete_files(storage, names):
+    """
+    Deletes the files `names` from the storage. S3 objects are deleted with
+    one DeleteObjects request per `S3_DELETE_BATCH_SIZE` files.
+    """
+    names = [name for name in names if name]
+    if not isinstance(storage, S3Boto3Storage):
+        for name in names:
+            storage.delete(name)
+        return
+    if isinstance(storage, CachedS3Storage):
+        for name in names:
+            storage.discard(name)
+
+    client = storage.connection.meta.client
+    for start in range(0, len(names), S3_DELETE_BATCH_SIZE):
+        response = client.delete_objects(
+            Bucket=storage.bucket_name,
+            Delete={'Objects': [
+                {'Key': get_s3_key(storage, name)}
+                for name in names[start:start + S3_DELETE_BATCH_SIZE]],
+                'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.warning('Deleting %s failed: %s', error['Key'],
+                           error['Message'])
+
+
+def iter_chunks(storage, name, chunk_size=64 * 1024, start=0, end=None):
+    """
+    Yields the content of the stored file, or of the inclusive byte range
+    from `start` to `end`, in chunks. S3 objects are read from the response
+    stream of a single GET request instead of being downloaded to a
+    temporary file first. Files of a `CachedS3Storage` are read from its
+    cache.
+    """
+    if isinstance(storage, CachedS3Storage):
+        file = storage.open_cached(name)
+        if file is not None:
+            with file:
+                for chunk in _iter_file(file, chunk_size, start, end):
+                    yield chunk
+            return
+
+    if isinstance(storage, S3Boto3Storage):
+        parameters = {}
+        if start or end is not None:
+            parameters['Range'] = 'bytes={}-{}'.format(
+                start, '' if end is None else end)
+        body = storage.bucket.Object(get_s3_key(storage, name)).get(
+            **parameters)['Body']
+        try:
+            for chunk in iter(lambda: body.read(chunk_size), b''):
+                yield chunk
+        finally:
+            body.close()
+        return
+
+    with storage.open(name, 'rb') as file:
+        for chunk in _iter_file(file, chunk_size, start, end):
+            yield chunk
+
+
+def _iter_file(file, chunk_size, start, end):
+    file.seek(start)
+    remaining = None if end is None else end - start + 1
+    while remaining is None or remaining > 0:
+        chunk = file.read(chunk_size if remaining is None
+                          else min(chunk_size, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+def iter_files(storage, prefix, start_after=None):
+    """
+    Yields the name and the modification time of every file below the
+    directory `prefix` in lexicographic order, starting after the name
+    `start_after`.
+    """
+    prefix = prefix.rstrip('/') + '/'
+
+    if isinstance(storage, S3Boto3Storage):
+        key_prefix = get_s3_key(storage, prefix)
+        parameters = {'Bucket': storage.bucket_name, 'Prefix': key_prefix}
+        if start_after:
+            parameters['StartAfter'] = get_s3_key(storage, start_after)
+
+        paginator = storage.connection.meta.client.get_paginator(
+            'list_objects_v2')
+        for page in paginator.paginate(**parameters):
+            for obj in page.get('Contents', []):
+                yield (prefix + obj['Key'][len(key_prefix):],
+                       obj['LastModified'])
+        return
+
+    for name in _walk(storage, prefix):
+        if start_after is None or name > start_after:
+            yield name, storage.get_modified_time(name)
+
+
+def _walk(storage, directory):
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    entries = [(posixpath.join(directory, name), False) for name in files]
+    entries += [(posixpath.join(directory, name) + '/', True)
+                for name in directories]
+
+    for path, is_directory in sorted(entries):
+        if is_directory:
+            for name in _walk(storage, path):
+                yield name
+        else:
+            yield path
@@ -0,0 +1,174 @@
+import logging
+
+from celery import shared_task
+from django.db import transaction
+
+from .extraction import extract_text
+from .images import ImageTooLarge
+from .metrics import THUMBNAIL_DURATION, THUMBNAIL_FAILURES
+from .models import (Document, TEXT_STATUS_FAILED, TEXT_STATUS_PENDING,
+                     TEXT_STATUS_READY, THUMBNAIL_STATUS_FAILED,
+                     THUMBNAIL_STATUS_PENDING, THUMBNAIL_STATUS_READY)
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MAX_RETRIES = 3
+THUMBNAIL_RETRY_DELAY = 10
+
+
+@shared_task(bind=True, max_retries=THUMBNAIL_MAX_RETRIES,
+             default_retry_delay=THUMBNAIL_RETRY_DELAY)
+def generate_thumbnail(self, document_id):
+    try:
+        document = Document.objects.get(pk=document_id)
+    except Document.DoesNotExist:
+        # The document was deleted before the task was picked up
+        return
+
+    blob = document.blob
+    if blob is not None and blob.thumbnail:
+        # Another document with the same content already has a thumbnail
+        document.thumbnail = blob.thumbnail.name
+        document.thumbnail_size = blob.thumbnail_size
+        document.thumbnail_status = THUMBNAIL_STATUS_READY
+        document.save(update_fields=['thumbnail', 'thumbnail_size',
+                                     'thumbnail_status'])
+        return
+
+    try:
+        with THUMBNAIL_DURATION.time():
+            document.make_thumbnail()
+        if blob is not None:
+            blob.set_thumbnail(document.thumbnail.file)
+            return
+    except Exception as exc:
+        THUMBNAIL_FAILURES.inc()
+        # Retrying does not make an image smaller
+        if self.request.retries < self.max_retries and \
+                not isinstance(exc, ImageTooLarge):
+            raise self.retry(exc=exc)
+
+        logger.exception('Thumbnail generation failed for document %s',
+                         document_id)
+        Document.objects.filter(pk=document_id).update(
+            thumbnail_status=THUMBNAIL_STATUS_FAILED)
+        return
+
+    document.thumbnail_status = THUMBNAIL_STATUS_READY
+    document.save(update_fields=['thumbnail', 'thumbnail_size',
+                                 'thumbnail_status'])
+
+
+def schedule_thumbnail(document):
+    """
+    Queues the thumbnail generation of a saved document. In eager mode
+    the thumbnail is generated inline and the instance is refreshed.
+    """
+    if generate_thumbnail.app.conf.task_always_eager:
+        generate_thumbnail.delay(document.pk)
+        document.refresh_from_db(fields=['thumbnail', 'thumbnail_status'])
+    else:
+        # The worker must not pick up the task before the row is visible
+        transaction.on_commit(lambda: generate_thumbnail.delay(document.pk))
+
+
+def queue_thumbnails(documents):
+    """
+    Queues the thumbnail generation of saved documents once the transaction
+    is committed. Unlike `schedule_thumbnail` the instances are not
+    refreshed, in eager mode the tasks run right after the commit.
+    """
+    document_ids = [document.pk for document in documents]
+
+    def queue():
+        for document_id in document_ids:
+            generate_thumbnail.delay(document_id)
+
+    if document_ids:
+        transaction.on_commit(queue)
+
+
+@shared_task
+def store_document_blob(document_id):
+    """
+    Moves the file assembled by a finalized upload session into a blob,
+    then queues its thumbnail and text extraction. If it fails the file
+    stays with the document until `deduplicate_documents` moves it.
+    """
+    document = Document(pk=document_id)
+    try:
+        if document.move_to_blob() is None:
+            return
+    except Document.DoesNotExist:
+        # The document was deleted before the task was picked up
+        return
+
+    if document.thumbnail_status == THUMBNAIL_STATUS_PENDING:
+        queue_thumbnails([document])
+    if document.text_status == TEXT_STATUS_PENDING:
+        queue_text_extraction([document])
+
+
+def schedule_blob_storage(document):
+    """
+    Queues the blob storage of a saved document whose file is already
+    stored. In eager mode it runs inline and the instance is refreshed.
+    """
+    if store_document_blob.app.conf.task_always_eager:
+        store_document_blob.delay(document.pk)
+        document.refresh_from_db()
+    else:
+        transaction.on_commit(lambda: store_document_blob.delay(document.pk))
+
+
+@shared_task
+def extract_document_text(document_id):
+    """
+    Extracts the text of the document file into the search index.
+    """
+    document = Document.objects.only(
+        'id', 'file', 'file_type', 'blob').filter(pk=document_id).first()
+    if document is None or not document.file:
+        return
+    # Only the file the text belongs to is updated, the document may have
+    # been given another one in the meantime
+    documents = Document.objects.filter(pk=document_id,
+                                        file=document.file.name)
+
+    if document.blob_id is not None:
+        # Another document with the same content already has the text
+        text = Document.objects.filter(
+            blob_id=document.blob_id, text_status=TEXT_STATUS_READY).exclude(
+            pk=document_id).values_list('content_text', flat=True).first()
+        if text is not None:
+            documents.update(content_text=text, text_status=TEXT_STATUS_READY)
+            return
+
+    try:
+        text = extract_text(document.file, document.file_type)
+    except Exception:
+        # e.g. a damaged file, the time or memory limit or the storage
+        logger.exception('Text extraction failed for document %s',
+                         document_id)
+        documents.update(text_status=TEXT_STATUS_FAILED)
+        return
+
+    documents.update(content_text=text, text_status=TEXT_STATUS_READY)
+
+
+def queue_text_extraction(documents):
+    """
+    Queues the text extraction of saved documents once the transaction is
+    committed. The extraction never runs in the request: in eager mode the
+    documents stay pending for the `extract_document_text` command.
+    """
+    if extract_document_text.app.conf.task_always_eager:
+        return
+    document_ids = [document.pk for document in documents]
+
+    def queue():
+        for document_id in document_ids:
+            extract_document_text.delay(document_id)
+
+    if document_ids:
+        transaction.on_commit(queue)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..downloads import _release_connections, parse_range_header
+
+
+class ParseRangeHeaderTest(SimpleTestCase):
+    def test_single_range(self):
+        self.assertEqual(parse_range_header('bytes=0-3', 10), [(0, 3)])
+        self.assertEqual(parse_range_header('bytes=8-', 10), [(8, 9)])
+        self.assertEqual(parse_range_header('bytes=5-20', 10), [(5, 9)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header('bytes=-3', 10), [(7, 9)])
+        self.assertEqual(parse_range_header('bytes=-20', 10), [(0, 9)])
+
+    def test_multiple_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-1, 4-5,-1', 10),
+                         [(0, 1), (4, 5), (9, 9)])
+
+    def test_not_satisfiable(self):
+        self.assertEqual(parse_range_header('bytes=10-', 10), [])
+        self.assertEqual(parse_range_header('bytes=-0', 10), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+
+    def test_invalid(self):
+        for header in ('bytes=3-1', 'items=0-1', 'bytes=a-b', 'bytes=1',
+                       'bytes=0-1,x'):
+            self.assertIsNone(parse_range_header(header, 10), header)
+
+
+class ReleaseConnectionsTest(SimpleTestCase):
+    def test_closes_connections_before_streaming(self):
+        idle = mock.Mock(in_atomic_block=False)
+        in_transaction = mock.Mock(in_atomic_block=True)
+
+        with mock.patch('documents.downloads.connections') as connections:
+            connections.all.return_value = [idle, in_transaction]
+            chunks = _release_connections(iter([b'a', b'b']))
+            # Nothing is closed before the response is sent
+            self.assertFalse(idle.close.called)
+            self.assertEqual(list(chunks), [b'a', b'b'])
+
+        self.assertTrue(idle.close.called)
+        self.assertFalse(in_transaction.close.called)
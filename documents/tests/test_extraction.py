@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO, StringIO
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+import boto3
+from moto import mock_s3
+
+from .. import extractors
+from ..extraction import ExtractionFailed, extract_text
+from ..models import (Document, TEXT_STATUS_FAILED, TEXT_STATUS_PENDING,
+                      TEXT_STATUS_READY)
+from ..tasks import extract_document_text
+
+WORD_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+DRAWING_NAMESPACE = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+SHEET_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+def make_zip_file(members):
+    content = BytesIO()
+    with zipfile.ZipFile(content, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return content.getvalue()
+
+
+def make_docx(*paragraphs):
+    return make_zip_file({'word/document.xml': (
+        '<w:document xmlns:w="{}"><w:body>{}</w:body></w:document>'.format(
+            WORD_NAMESPACE, ''.join(
+                '<w:p><w:r><w:t>{}</w:t></w:r></w:p>'.format(paragraph)
+                for paragraph in paragraphs)))})
+
+
+def make_pptx(*slides):
+    return make_zip_file({
+        'ppt/slides/slide{}.xml'.format(number): (
+            '<p:sld xmlns:a="{}" xmlns:p="p"><a:p><a:r><a:t>{}</a:t>'
+            '</a:r></a:p></p:sld>'.format(DRAWING_NAMESPACE, text))
+        for number, text in enumerate(slides, 1)})
+
+
+def make_xlsx(*strings):
+    return make_zip_file({'xl/sharedStrings.xml': (
+        '<sst xmlns="{}">{}</sst>'.format(SHEET_NAMESPACE, ''.join(
+            '<si><t>{}</t></si>'.format(string) for string in strings)))})
+
+
+def make_pdf(*lines):
+    content = b'BT /F1 12 Tf ' + b' '.join(
+        b'(' + line + b') Tj T*' for line in lines) + b' ET'
+    compressed = zlib.compress(content)
+    return (b'%PDF-1.4\n1 0 obj\n<< /Length ' +
+            str(len(compressed)).encode() + b' /Filter /FlateDecode >>\n'
+            b'stream\n' + compressed + b'\nendstream\nendobj\n%%EOF\n')
+
+
+class ExtractorsTest(SimpleTestCase):
+    def extract(self, content, file_type, max_length=1000):
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(content)
+            file.flush()
+            return extractors.extract(file.name, file_type, max_length)
+
+    def test_txt(self):
+        self.assertEqual(self.extract('Grüße\x00'.encode(), 'txt'), 'Grüße')
+        self.assertEqual(self.extract(b'abc\xff', 'txt'), 'abc�')
+
+    def test_docx(self):
+        self.assertEqual(self.extract(make_docx('First', 'Second'), 'docx'),
+                         'First\nSecond\n')
+
+    def test_pptx_slide_order(self):
+        slides = ['Slide {}'.format(number) for number in range(1, 12)]
+        self.assertEqual(self.extract(make_pptx(*slides), 'pptx'),
+                         ''.join(slide + '\n' for slide in slides))
+
+    def test_xlsx(self):
+        self.assertEqual(self.extract(make_xlsx('Name', 'Total'), 'xlsx'),
+                         'Name\nTotal\n')
+
+    def test_pdf(self):
+        self.assertEqual(
+            self.extract(make_pdf(b'Hello', b'(World\\051'), 'pdf'),
+            'Hello (World) \n')
+
+    def test_pdf_read_in_chunks(self):
+        content = make_pdf(b'Hello') + (
+            b'2 0 obj\n<< /Filter /DCTDecode >>\nstream\nBT (Image) Tj ET'
+            b'\nendstream\nendobj\n3 0 obj\n<< /Length 16 >>\nstream\n'
+            b'BT (World) Tj ET\nendstream\nendobj\n')
+        # Keywords and compressed data are split across the chunks
+        with mock.patch('documents.extractors.CHUNK_SIZE', 5):
+            self.assertEqual(self.extract(content, 'pdf'),
+                             'Hello \nWorld \n')
+
+    def test_pdf_stream_size_limit(self):
+        # The text block of the first stream is cut off
+        with mock.patch('documents.extractors.PDF_MAX_STREAM_SIZE', 40):
+            self.assertEqual(
+                self.extract(make_pdf(b'Hello' * 10) + make_pdf(b'World'),
+                             'pdf'), 'World \n')
+
+    def test_max_length(self):
+        self.assertEqual(self.extract(make_docx('First', 'Second'), 'docx',
+                                      max_length=8), 'First\nSe')
+
+    def test_unsupported_file_type(self):
+        with self.assertRaises(ValueError):
+            self.extract(b'', 'doc')
+
+
+class ExtractTextTest(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.media_root)
+        self.file = self.save('a.docx', make_docx('Quarterly report'))
+
+    def save(self, name, content):
+        # Stands in for the FieldFile of a document
+        return SimpleNamespace(storage=self.storage, name=self.storage.save(
+            name, ContentFile(content)))
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root)
+
+    def test_extract_text(self):
+        self.assertEqual(extract_text(self.file, 'docx'),
+                         'Quarterly report\n')
+
+    @override_settings(DOCUMENT_TEXT_MAX_LENGTH=9)
+    def test_max_length(self):
+        self.assertEqual(extract_text(self.file, 'docx'), 'Quarterly')
+
+    def test_damaged_file(self):
+        with self.assertRaisesRegex(ExtractionFailed, 'BadZipFile'):
+            extract_text(self.save('b.docx', b'PK\x03\x04'), 'docx')
+
+    @override_settings(DOCUMENT_TEXT_EXTRACTION_MAX_MEMORY=1)
+    def test_memory_limit(self):
+        # PDFs are read into memory at once
+        pdf = self.save('a.pdf', b'%PDF-1.4\n' + b' ' * 8 * 1024 * 1024)
+        with self.assertRaisesRegex(ExtractionFailed, 'MemoryError'):
+            extract_text(pdf, 'pdf')
+
+    @override_settings(DOCUMENT_TEXT_EXTRACTION_TIMEOUT=0.001)
+    def test_time_limit(self):
+        with self.assertRaisesRegex(ExtractionFailed, 'longer than'):
+            extract_text(self.file, 'docx')
+
+
+@mock_s3
+class ExtractDocumentTextTaskTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def create_document(self, content=None, file_name='Report.docx'):
+        return Document.objects.create(
+            file_name=file_name, file=ContentFile(
+                content or make_docx('Quarterly revenue'), name=file_name))
+
+    def test_upload_leaves_text_pending_in_eager_mode(self):
+        # The upload commits outside of a transaction, the extraction must
+        # not run in the request anyway
+        with mock.patch('documents.models.transaction.on_commit',
+                        side_effect=lambda func: func()), \
+                mock.patch('documents.tasks.transaction.on_commit',
+                           side_effect=lambda func: func()), \
+                mock.patch('documents.tasks.extract_text') as extract:
+            document = self.create_document()
+        self.assertFalse(extract.called)
+
+        document.refresh_from_db()
+        self.assertEqual(document.text_status, TEXT_STATUS_PENDING)
+        self.assertEqual(document.content_text, '')
+
+        image = self.create_document(b'image', file_name='Image.jpg')
+        self.assertIsNone(image.text_status)
+
+    def test_upload_queues_extraction_after_commit(self):
+        with mock.patch('documents.tasks.transaction.on_commit') \
+                as on_commit, \
+                mock.patch('documents.tasks.extract_document_text') as task:
+            # With a worker
+            task.app.conf.task_always_eager = False
+            document = self.create_document()
+            self.assertFalse(task.delay.called)
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+        task.delay.assert_called_once_with(document.pk)
+
+    def test_extract_document_text(self):
+        document = self.create_document()
+        extract_document_text(document.pk)
+
+        document.refresh_from_db()
+        self.assertEqual(document.text_status, TEXT_STATUS_READY)
+        self.assertEqual(document.content_text, 'Quarterly revenue\n')
+        self.assertEqual(list(Document.objects.search('revenue')),
+                         [document])
+
+    def test_same_content_is_extracted_once(self):
+        document = self.create_document()
+        extract_document_text(document.pk)
+        copy = self.create_document()
+
+        with mock.patch('documents.tasks.extract_text') as extract:
+            extract_document_text(copy.pk)
+        self.assertFalse(extract.called)
+
+        copy.refresh_from_db()
+        self.assertEqual(copy.text_status, TEXT_STATUS_READY)
+        self.assertEqual(copy.content_text, 'Quarterly revenue\n')
+
+    def test_damaged_file_fails(self):
+        document = self.create_document(b'PK\x03\x04')
+        extract_document_text(document.pk)
+        document.refresh_from_db()
+        self.assertEqual(document.text_status, TEXT_STATUS_FAILED)
+
+    def test_extract_document_text_command(self):
+        pending = self.create_document()
+        failed = self.create_document(b'PK\x03\x04', file_name='Other.docx')
+        Document.objects.filter(pk=failed.pk).update(
+            text_status=TEXT_STATUS_FAILED)
+        # Uploaded before the text extraction
+        legacy = self.create_document(make_docx('Legacy'), 'Legacy.docx')
+        Document.objects.filter(pk=legacy.pk).update(text_status=None)
+
+        out = StringIO()
+        call_command('extract_document_text', '--workers=1', stdout=out)
+
+        self.assertEqual(
+            dict(Document.objects.values_list('pk', 'text_status')),
+            {pending.pk: TEXT_STATUS_READY, failed.pk: TEXT_STATUS_FAILED,
+             legacy.pk: TEXT_STATUS_READY})
+        self.assertIn('Extracted the text of 2 documents, 0 failed',
+                      out.getvalue())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageStat
+from django.test import SimpleTestCase, override_settings
+
+from ..images import (FIT_CONTAIN, FIT_CROP, ImageTooLarge,
+                      make_resized_file, open_image, resize_image)
+
+
+def make_image(size, image_format, mode='RGB'):
+    image = Image.new(mode, size)
+    # Horizontal gradient, so the resampling quality shows in the output
+    image.paste(Image.linear_gradient('L').rotate(90).resize(size).convert(
+        mode))
+    temp_file = BytesIO()
+    image.save(temp_file, image_format)
+    temp_file.seek(0)
+    return temp_file
+
+
+class OpenImageTest(SimpleTestCase):
+    def test_open_jpeg_decodes_reduced(self):
+        image = open_image(make_image((3200, 2400), 'JPEG'), (200, 200))
+        # 1/4 scale keeps the image twice as large as the scaled 267x200
+        self.assertEqual(image.size, (800, 600))
+
+    def test_open_png_reduces_after_decoding(self):
+        image = open_image(make_image((3200, 2400), 'PNG'), (200, 200))
+        self.assertEqual(image.size, (534, 400))
+
+    def test_open_small_image_is_not_reduced(self):
+        image = open_image(make_image((300, 300), 'JPEG'), (200, 200))
+        self.assertEqual(image.size, (300, 300))
+
+    def test_open_fails_above_max_pixels(self):
+        with self.assertRaises(ImageTooLarge):
+            open_image(make_image((1000, 1000), 'PNG'), (200, 200),
+                       max_pixels=999999)
+
+    def test_max_pixels_counts_reduced_jpeg(self):
+        image = open_image(make_image((2000, 2000), 'JPEG'), (100, 100),
+                           max_pixels=250 * 250)
+        self.assertEqual(image.size, (250, 250))
+
+
+class MakeResizedFileTest(SimpleTestCase):
+    def assertLooksLike(self, file, image_format, size, fit=FIT_CROP):
+        resized = Image.open(make_resized_file(
+            file, image_format.lower(), size, fit))
+
+        file.seek(0)
+        expected = resize_image(Image.open(file), size, fit)
+        self.assertEqual(resized.size, expected.size)
+
+        difference = ImageChops.difference(resized.convert('RGB'),
+                                           expected.convert('RGB'))
+        self.assertLess(max(ImageStat.Stat(difference).mean), 2)
+
+    def test_jpeg_looks_like_full_decode(self):
+        self.assertLooksLike(make_image((4000, 3000), 'JPEG'), 'JPEG',
+                             (200, 200))
+
+    def test_png_looks_like_full_decode(self):
+        self.assertLooksLike(make_image((3000, 4000), 'PNG'), 'PNG',
+                             (200, 200))
+
+    def test_gif_looks_like_full_decode(self):
+        self.assertLooksLike(make_image((1600, 1200), 'GIF', mode='L'),
+                             'GIF', (200, 200))
+
+    def test_contain(self):
+        self.assertLooksLike(make_image((4000, 3000), 'JPEG'), 'JPEG',
+                             (400, 400), fit=FIT_CONTAIN)
+
+    def test_no_image(self):
+        self.assertIsNone(make_resized_file(BytesIO(b'text'), 'txt',
+                                            (200, 200)))
+
+    @override_settings(DOCUMENT_IMAGE_MAX_PIXELS=1000)
+    def test_max_pixels_setting(self):
+        with self.assertRaises(ImageTooLarge):
+            make_resized_file(make_image((200, 200), 'PNG'), 'png',
+                              (100, 100))
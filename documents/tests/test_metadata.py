@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+import hashlib
+
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from ..metadata import get_file_metadata, sniff_mime_type
+
+
+class SniffMimeTypeTest(SimpleTestCase):
+    def test_signatures(self):
+        self.assertEqual(sniff_mime_type(b'\xff\xd8\xff\xe0', 'a.png'),
+                         'image/jpeg')
+        self.assertEqual(sniff_mime_type(b'%PDF-1.4', 'a.pdf'),
+                         'application/pdf')
+
+    def test_containers_use_extension(self):
+        self.assertEqual(
+            sniff_mime_type(b'PK\x03\x04rest', 'a.docx'),
+            'application/vnd.openxmlformats-officedocument.'
+            'wordprocessingml.document')
+        self.assertEqual(sniff_mime_type(b'PK\x03\x04rest', 'a.pdf'),
+                         'application/zip')
+        self.assertEqual(
+            sniff_mime_type(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'a.xls'),
+            'application/vnd.ms-excel')
+
+    def test_text(self):
+        self.assertEqual(sniff_mime_type('Grüße'.encode()[:-3], 'a.txt'),
+                         'text/plain')
+        self.assertEqual(sniff_mime_type(b'\x00\x01', 'a.txt'),
+                         'application/octet-stream')
+
+
+class GetFileMetadataTest(SimpleTestCase):
+    def test_image(self):
+        image = BytesIO()
+        Image.new('RGB', (30, 20)).save(image, 'PNG')
+        content = image.getvalue()
+
+        file = ContentFile(content, name='a.png')
+        metadata = get_file_metadata(file, 'a.png')
+        self.assertEqual(metadata.sha256,
+                         hashlib.sha256(content).hexdigest())
+        self.assertEqual(metadata.size, len(content))
+        self.assertEqual(metadata.mime_type, 'image/png')
+        self.assertEqual((metadata.width, metadata.height), (30, 20))
+        self.assertEqual(file.read(), content)
+
+    def test_broken_image(self):
+        metadata = get_file_metadata(
+            ContentFile(b'\x89PNG\r\n\x1a\nbroken', name='a.png'), 'a.png')
+        self.assertEqual(metadata.mime_type, 'image/png')
+        self.assertIsNone(metadata.width)
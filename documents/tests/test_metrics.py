@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from prometheus_client import REGISTRY
+from rest_framework.test import APIRequestFactory
+
+from . import model_factories as mfactories
+from ..caching import get_cache
+from ..metrics import MetricsMiddleware, get_view_label, metrics_view
+from ..views import DocumentViewSet, document_download_view
+
+
+def get_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class GetViewLabelTest(SimpleTestCase):
+    def test_viewset_actions(self):
+        view = DocumentViewSet.as_view({'get': 'retrieve',
+                                        'patch': 'partial_update'})
+        self.assertEqual(get_view_label(view, 'GET'),
+                         'DocumentViewSet.retrieve')
+        self.assertEqual(get_view_label(view, 'PATCH'),
+                         'DocumentViewSet.partial_update')
+        self.assertEqual(get_view_label(view, 'HEAD'),
+                         'DocumentViewSet.retrieve')
+        # Methods without an action share one label
+        self.assertEqual(get_view_label(view, 'FOO'),
+                         'DocumentViewSet.other')
+        self.assertEqual(get_view_label(view, 'DELETE'),
+                         'DocumentViewSet.other')
+
+    def test_function_views(self):
+        self.assertEqual(get_view_label(document_download_view, 'GET'),
+                         'document_download_view')
+
+
+class MetricsMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def call(self, response, view=document_download_view, method='get'):
+        def get_response(request):
+            # Django calls process_view once the URL is resolved
+            middleware.process_view(request, view, (), {})
+            return response
+
+        middleware = MetricsMiddleware(get_response)
+        return middleware(self.factory.generic(method, '/file/1/'))
+
+    def test_records_request(self):
+        labels = {'view': 'document_download_view', 'method': 'GET'}
+        count = get_value('documents_request_duration_seconds_count',
+                          **labels)
+        requests = get_value('documents_requests_total', status='404',
+                             **labels)
+
+        self.call(HttpResponse(status=404))
+
+        self.assertEqual(get_value('documents_request_duration_seconds_count',
+                                   **labels), count + 1)
+        self.assertEqual(get_value('documents_requests_total',
+                                   status='404', **labels), requests + 1)
+
+    def test_unknown_methods_share_label(self):
+        labels = {'view': 'document_download_view', 'method': 'other'}
+        count = get_value('documents_request_duration_seconds_count',
+                          **labels)
+
+        self.call(HttpResponse(status=405), method='FOO')
+        self.call(HttpResponse(status=405), method='BAR')
+
+        self.assertEqual(get_value('documents_request_duration_seconds_count',
+                                   **labels), count + 2)
+        self.assertEqual(get_value('documents_request_duration_seconds_count',
+                                   view='document_download_view',
+                                   method='FOO'), 0)
+
+    def test_unknown_methods_share_viewset_label(self):
+        view = DocumentViewSet.as_view({'get': 'list'})
+        labels = {'view': 'DocumentViewSet.other', 'method': 'other'}
+        count = get_value('documents_request_duration_seconds_count',
+                          **labels)
+
+        self.call(HttpResponse(status=405), view=view, method='FOO')
+
+        self.assertEqual(get_value('documents_request_duration_seconds_count',
+                                   **labels), count + 1)
+        self.assertEqual(get_value('documents_request_duration_seconds_count',
+                                   view='DocumentViewSet.foo',
+                                   method='other'), 0)
+
+    def test_counts_streamed_bytes(self):
+        labels = {'view': 'document_download_view'}
+        streamed = get_value('documents_streamed_bytes_total', **labels)
+
+        response = self.call(StreamingHttpResponse(iter([b'abc', b'de'])))
+        self.assertEqual(get_value('documents_streamed_bytes_total',
+                                   **labels), streamed)
+        self.assertEqual(b''.join(response.streaming_content), b'abcde')
+
+        self.assertEqual(get_value('documents_streamed_bytes_total',
+                                   **labels), streamed + 5)
+
+    def test_metrics_view(self):
+        response = metrics_view(self.factory.get('/metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'documents_request_duration_seconds',
+                      response.content)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8'],
+                       METRICS_TOKEN='secret')
+    def test_metrics_view_access(self):
+        def get(remote_addr, **headers):
+            return metrics_view(self.factory.get(
+                '/metrics', REMOTE_ADDR=remote_addr, **headers)).status_code
+
+        self.assertEqual(get('10.1.2.3'), 200)
+        self.assertEqual(get('127.0.0.1'), 403)
+        self.assertEqual(get('127.0.0.1', HTTP_AUTHORIZATION='Bearer x'),
+                         403)
+        self.assertEqual(
+            get('127.0.0.1', HTTP_AUTHORIZATION='Bearer secret'), 200)
+
+
+class MetricsQueriesTest(TestCase):
+    def test_counts_queries(self):
+        get_cache().clear()
+        user = mfactories.User()
+        labels = {'view': 'DocumentViewSet.list'}
+        total = get_value('documents_request_queries_sum', **labels)
+
+        view = DocumentViewSet.as_view({'get': 'list'})
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            request.user = user
+            return view(request)
+
+        middleware = MetricsMiddleware(get_response)
+        response = middleware(
+            APIRequestFactory().get('/documents/?page_size=1'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(get_value('documents_request_queries_sum',
+                                     **labels), total)
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from io import BytesIO
+from io import BytesIO, StringIO
+import hashlib
 import uuid
+from unittest import mock
 
 from PIL import Image
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
 from django.core.files.base import ContentFile
 from django.conf import settings
@@ -12,7 +17,9 @@ import pytz
 import boto3
 from moto import mock_s3
 
-from ..models import Document
+from ..models import (Blob, Document, DocumentStatistic,
+                      DocumentWorkflowLevel, THUMBNAIL_STATUS_READY,
+                      WORKFLOWLEVEL1, WORKFLOWLEVEL2)
 
 
 class DocumentTest(TestCase):
@@ -301,3 +308,337 @@ class DocumentTest(TestCase):
         self.assertEqual(document_db.contact_uuid, contact_uuid)
         thumbnail = Image.open(document_db.thumbnail)
         self.assertEqual(thumbnail.size, (200, 200))
+        self.assertEqual(document_db.thumbnail_status, THUMBNAIL_STATUS_READY)
+
+    def test_document_save_without_file_has_no_thumbnail_status(self):
+        document = Document.objects.create(
+            file_name="Test.jpg",
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+
+        document_db = Document.objects.get(pk=document.pk)
+        self.assertFalse(document_db.thumbnail)
+        self.assertIsNone(document_db.thumbnail_status)
+
+
+def make_image_file(name='Testfile.jpg', color='blue'):
+    image = Image.new('RGB', (400, 500), color=color)
+    temp_file = BytesIO()
+    image.save(temp_file, 'JPEG')
+    temp_file.seek(0)
+    return ContentFile(temp_file.read(), name=name)
+
+
+@mock_s3
+class BlobTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        self.bucket = conn.create_bucket(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        # The mocked bucket is kept between the tests of a class
+        self.bucket.objects.all().delete()
+
+    def create_document(self, file, file_name='Test.jpg'):
+        return Document.objects.create(
+            file_name=file_name,
+            file=file,
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+
+    def test_identical_uploads_share_blob(self):
+        document_1 = self.create_document(make_image_file())
+        document_2 = self.create_document(make_image_file('Copy.jpg'))
+
+        self.assertEqual(document_1.blob_id, document_2.blob_id)
+        self.assertEqual(document_1.file.name, document_2.file.name)
+        self.assertEqual(document_1.thumbnail.name,
+                         document_2.thumbnail.name)
+        self.assertEqual(document_2.thumbnail_status, THUMBNAIL_STATUS_READY)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.reference_count, 2)
+        self.assertEqual(blob.size, document_1.file.size)
+        self.assertEqual(document_1.file.name,
+                         'uploads/blobs/{}/{}.jpg'.format(blob.sha256[:2],
+                                                          blob.sha256))
+        # The file and one thumbnail
+        self.assertEqual(len(list(self.bucket.objects.all())), 2)
+
+    def test_different_content_creates_blob(self):
+        document_1 = self.create_document(make_image_file())
+        document_2 = self.create_document(make_image_file(color='red'))
+
+        self.assertNotEqual(document_1.blob_id, document_2.blob_id)
+        self.assertNotEqual(document_1.file.name, document_2.file.name)
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_delete_last_reference_deletes_blob(self):
+        document_1 = self.create_document(make_image_file())
+        document_2 = self.create_document(make_image_file())
+        file_name = document_1.file.name
+
+        with mock.patch('documents.models.transaction.on_commit') \
+                as on_commit:
+            document_1.delete()
+            blob = Blob.objects.get()
+            self.assertEqual(blob.reference_count, 1)
+
+            Document.objects.filter(pk=document_2.pk).delete()
+            # The files are deleted once the transaction is committed
+            self.assertEqual(Blob.objects.get().reference_count, 0)
+            self.assertTrue(default_storage.exists(file_name))
+
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(file_name))
+        self.assertEqual(len(list(self.bucket.objects.all())), 0)
+
+    def test_blob_referenced_again_before_commit_is_kept(self):
+        document = self.create_document(make_image_file())
+        file_name = document.file.name
+
+        with mock.patch('documents.models.transaction.on_commit') \
+                as on_commit:
+            document.delete()
+            self.create_document(make_image_file())
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+
+        self.assertEqual(Blob.objects.get().reference_count, 1)
+        self.assertTrue(default_storage.exists(file_name))
+
+    def test_replace_file_releases_previous_blob(self):
+        document = self.create_document(ContentFile(b'v1', name='a.txt'),
+                                        file_name='a.txt')
+        previous_blob_id = document.blob_id
+
+        document.file = ContentFile(b'v2', name='a.txt')
+        with mock.patch('documents.models.transaction.on_commit',
+                        side_effect=lambda func: func()):
+            document.save()
+
+        self.assertNotEqual(document.blob_id, previous_blob_id)
+        self.assertFalse(Blob.objects.filter(pk=previous_blob_id).exists())
+        self.assertIsNone(document.thumbnail_status)
+
+    def test_replace_legacy_file_is_deleted_after_commit(self):
+        name = default_storage.save('uploads/2019-1/1/legacy.txt',
+                                    ContentFile(b'legacy'))
+        document = Document.objects.create(file_name='Test.txt', file=name)
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                document.file = ContentFile(b'v2', name='Test.txt')
+                document.save()
+                raise RuntimeError
+        # The rolled back row still points to the legacy file
+        self.assertEqual(Document.objects.get(pk=document.pk).file.name,
+                         name)
+        self.assertTrue(default_storage.exists(name))
+
+        document = Document.objects.get(pk=document.pk)
+        document.file = ContentFile(b'v2', name='Test.txt')
+        with mock.patch('documents.models.transaction.on_commit') \
+                as on_commit:
+            document.save()
+            self.assertTrue(default_storage.exists(name))
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_deduplicate_documents_command(self):
+        names = [default_storage.save('uploads/2019-1/1/%s.txt' % i,
+                                      ContentFile(b'same content'))
+                 for i in range(2)]
+        documents = [
+            Document.objects.create(file_name='Test.txt', file=name)
+            for name in names]
+        self.assertFalse(Blob.objects.exists())
+
+        call_command('deduplicate_documents', '--batch-size=1',
+                     stdout=StringIO())
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.reference_count, 2)
+        self.assertEqual(blob.file.name, names[0])
+        for document in documents:
+            document.refresh_from_db()
+            self.assertEqual(document.blob, blob)
+            self.assertEqual(document.file.name, names[0])
+
+
+class DocumentWorkflowLevelTest(TestCase):
+    def get_workflowlevels(self):
+        return set(DocumentWorkflowLevel.objects.values_list(
+            'document_id', 'workflowlevel', 'workflowlevel_uuid'))
+
+    def test_workflowlevels_follow_document(self):
+        wfl1_uuid, wfl2_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+        document = Document.objects.create(
+            file_name='Test.txt', workflowlevel1_uuids=[wfl1_uuid],
+            workflowlevel2_uuids=[wfl2_uuid, wfl2_uuid])
+        self.assertEqual(self.get_workflowlevels(), {
+            (document.pk, WORKFLOWLEVEL1, wfl1_uuid),
+            (document.pk, WORKFLOWLEVEL2, wfl2_uuid)})
+
+        document.workflowlevel1_uuids = None
+        document.save()
+        Document.objects.all().add_to_array('workflowlevel1_uuids',
+                                            wfl2_uuid)
+        self.assertEqual(self.get_workflowlevels(), {
+            (document.pk, WORKFLOWLEVEL1, wfl2_uuid),
+            (document.pk, WORKFLOWLEVEL2, wfl2_uuid)})
+
+        Document.objects.all().delete()
+        self.assertEqual(self.get_workflowlevels(), set())
+
+
+@mock_s3
+class DocumentStatisticTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.organization_uuid = str(uuid.uuid4())
+        self.wfl1_uuid = str(uuid.uuid4())
+
+    def create_document(self, content, file_name='Test.txt'):
+        return Document.objects.create(
+            file_name=file_name, file=ContentFile(content, name=file_name),
+            organization_uuid=self.organization_uuid,
+            workflowlevel1_uuids=[self.wfl1_uuid])
+
+    def get_file_types(self, **kwargs):
+        return {row['file_type']: (row['document_count'], row['total_size'])
+                for row in DocumentStatistic.objects.get_file_types(
+                    organization_uuid=self.organization_uuid, **kwargs)}
+
+    def test_create_and_change_documents(self):
+        document = self.create_document(b'12345')
+        self.create_document(b'123', file_name='Test.pdf')
+        self.assertEqual(self.get_file_types(), {'txt': (1, 5),
+                                                 'pdf': (1, 3)})
+        self.assertEqual(
+            self.get_file_types(workflowlevel1_uuid=self.wfl1_uuid),
+            {'txt': (1, 5), 'pdf': (1, 3)})
+
+        document.file_name = 'Test.pdf'
+        document.workflowlevel1_uuids = []
+        document.save()
+        self.assertEqual(self.get_file_types(), {'pdf': (2, 8)})
+        self.assertEqual(
+            self.get_file_types(workflowlevel1_uuid=self.wfl1_uuid),
+            {'pdf': (1, 3)})
+
+        document.delete()
+        self.assertEqual(self.get_file_types(), {'pdf': (1, 3)})
+
+    def test_bulk_changes(self):
+        self.create_document(b'12345')
+        self.create_document(b'123')
+        wfl2_uuid = str(uuid.uuid4())
+
+        Document.objects.all().add_to_array('workflowlevel2_uuids',
+                                            wfl2_uuid)
+        Document.objects.all().add_to_array('workflowlevel2_uuids',
+                                            wfl2_uuid)
+        self.assertEqual(self.get_file_types(workflowlevel2_uuid=wfl2_uuid),
+                         {'txt': (2, 8)})
+
+        Document.objects.all().remove_from_array('workflowlevel1_uuids',
+                                                 self.wfl1_uuid)
+        self.assertEqual(
+            self.get_file_types(workflowlevel1_uuid=self.wfl1_uuid), {})
+        self.assertEqual(self.get_file_types(), {'txt': (2, 8)})
+
+        Document.objects.all().delete()
+        self.assertEqual(self.get_file_types(), {})
+        self.assertEqual(self.get_file_types(workflowlevel2_uuid=wfl2_uuid),
+                         {})
+
+    def test_queryset_update(self):
+        self.create_document(b'12345')
+        self.create_document(b'123', file_name='Test.pdf')
+        wfl1_uuid = str(uuid.uuid4())
+
+        Document.objects.filter(file_type='txt').update(
+            file_type='pdf', file_size=2, workflowlevel1_uuids=[wfl1_uuid])
+        self.assertEqual(self.get_file_types(), {'pdf': (2, 5)})
+        self.assertEqual(
+            self.get_file_types(workflowlevel1_uuid=self.wfl1_uuid),
+            {'pdf': (1, 3)})
+        self.assertEqual(self.get_file_types(workflowlevel1_uuid=wfl1_uuid),
+                         {'pdf': (1, 2)})
+
+        # Other fields leave the statistics alone
+        Document.objects.update(file_description='Description')
+        self.assertEqual(self.get_file_types(), {'pdf': (2, 5)})
+
+    def test_rebuild_document_statistics_command(self):
+        self.create_document(b'12345')
+        DocumentStatistic.objects.update(document_count=7)
+
+        out = StringIO()
+        call_command('rebuild_document_statistics', stdout=out)
+
+        self.assertEqual(self.get_file_types(), {'txt': (1, 5)})
+        self.assertIn('2 of them had drifted', out.getvalue())
+
+
+@mock_s3
+class DocumentMetadataTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def test_save_stores_metadata(self):
+        document = Document.objects.create(file_name='Test.jpg',
+                                           file=make_image_file())
+        document.refresh_from_db()
+
+        self.assertEqual(document.file_size, document.blob.size)
+        self.assertEqual(document.file_sha256, document.blob.sha256)
+        self.assertEqual(document.file_mime_type, 'image/jpeg')
+        self.assertEqual(document.blob.mime_type, 'image/jpeg')
+        self.assertEqual((document.image_width, document.image_height),
+                         (400, 500))
+        self.assertIsNotNone(document.file_modified_date)
+        self.assertEqual(document.thumbnail_size,
+                         default_storage.size(document.thumbnail.name))
+
+    def test_backfill_document_metadata_command(self):
+        name = default_storage.save('uploads/2019-1/1/legacy.txt',
+                                    ContentFile(b'legacy'))
+        document = Document.objects.create(file_name='Test.txt', file=name)
+        self.assertIsNone(document.file_size)
+
+        call_command('backfill_document_metadata', stdout=StringIO())
+
+        document.refresh_from_db()
+        self.assertEqual(document.file_size, 6)
+        self.assertEqual(document.file_mime_type, 'text/plain')
+        self.assertEqual(document.file_sha256,
+                         hashlib.sha256(b'legacy').hexdigest())
+        self.assertIsNotNone(document.file_modified_date)
+        self.assertEqual(
+            DocumentStatistic.objects.get_file_types(),
+            [{'file_type': 'txt', 'document_count': 1, 'total_size': 6}])
+
+
+class DocumentSearchVectorTest(TestCase):
+    def test_backfill_search_vectors_command(self):
+        documents = [Document.objects.create(file_name='Report %s.txt' % i)
+                     for i in range(3)]
+        # Documents created before the search_vector column
+        Document.objects.filter(pk__in=[documents[0].pk, documents[2].pk])\
+            .update(search_vector=None)
+
+        out = StringIO()
+        call_command('backfill_search_vectors', '--batch-size=1', stdout=out)
+
+        self.assertFalse(Document.objects.filter(
+            search_vector=None).exists())
+        self.assertEqual(list(Document.objects.search('report').order_by(
+            'pk')), documents)
+        self.assertIn('Filled the search vectors of 2 documents',
+                      out.getvalue())
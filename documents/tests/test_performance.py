@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import json
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+import boto3
+from moto import mock_s3
+
+from . import model_factories as mfactories
+from ..caching import get_cache
+from ..models import (Document, DocumentStatistic, DocumentWorkflowLevel,
+                      WORKFLOWLEVEL2)
+from ..views import (DocumentViewSet, UploadSessionViewSet,
+                     document_download_view, document_rendition_view,
+                     document_thumbnail_view)
+from .test_tasks import make_image_file
+
+# Rows of the table the query plans of the list are checked on
+EXPLAIN_DOCUMENT_COUNT = 100000
+
+
+class QueryBudgetMixin(object):
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """
+        Fails if the block runs more than `budget` queries. The savepoints
+        of the atomic blocks in the views are not counted, they are the
+        transactions of the requests outside of the tests.
+        """
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = [query['sql'] for query in context.captured_queries
+                   if not query['sql'].startswith(('SAVEPOINT',
+                                                   'RELEASE SAVEPOINT'))]
+        context.count = len(queries)
+        self.assertLessEqual(
+            len(queries), budget,
+            'Expected at most {} queries, got {}:\n{}'.format(
+                budget, len(queries), '\n'.join(queries)))
+
+
+@tag('performance')
+@mock_s3
+@override_settings(DOCUMENT_LIST_CACHE_TIMEOUT=0)
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Queries per request of every endpoint, which must not grow with the
+    page size or the number of documents.
+    """
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.wfl2_uuid = str(uuid.uuid4())
+
+    def call(self, method, actions, path='', data=None, **kwargs):
+        request = getattr(self.factory, method)(path, data, format='json')
+        request.user = self.user
+        view = DocumentViewSet.as_view(actions)
+        return view(request, **kwargs)
+
+    def create_documents(self, count):
+        # Not images, which would generate thumbnails
+        return [Document.objects.create(
+            file_name='Test{}.pdf'.format(number),
+            file=ContentFile(b'content %d' % number, name='Test.pdf'),
+            workflowlevel2_uuids=[self.wfl2_uuid])
+            for number in range(count)]
+
+    def assertListBudget(self, query, budget):
+        view = DocumentViewSet.as_view({'get': 'list'})
+        counts = []
+        for page_size in (1, 25):
+            request = self.factory.get('/documents/' + query, {
+                'page_size': page_size})
+            request.user = self.user
+            with self.assertQueryBudget(budget) as queries:
+                response = view(request)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+            counts.append(queries.count)
+        self.assertEqual(counts[0], counts[1], query)
+
+    def test_list(self):
+        self.create_documents(25)
+        self.assertListBudget('', 1)
+        self.assertListBudget('?fields=id,file_name,file,thumbnail', 1)
+        self.assertListBudget('?file_type=pdf&contact_uuid=', 1)
+        self.assertListBudget('?workflowlevel2_uuid=' + self.wfl2_uuid, 1)
+        self.assertListBudget('?ordering=-upload_date', 1)
+        self.assertListBudget('?search=test', 1)
+
+    @override_settings(DOCUMENT_LIST_CACHE_TIMEOUT=60)
+    def test_list_cached(self):
+        get_cache().clear()
+        self.create_documents(2)
+        self.call('get', {'get': 'list'})
+        with self.assertQueryBudget(0):
+            self.call('get', {'get': 'list'})
+
+    def test_retrieve(self):
+        document = self.create_documents(1)[0]
+        with self.assertQueryBudget(1):
+            response = self.call('get', {'get': 'retrieve'}, pk=document.pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        with self.assertQueryBudget(4):
+            response = self.call('post', {'post': 'create'}, data={
+                'file_name': 'Test.pdf',
+                'file': 'data:application/pdf;base64,c29tZSBjb250ZW50'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_partial_update(self):
+        document = self.create_documents(1)[0]
+        with self.assertQueryBudget(3):
+            response = self.call('patch', {'patch': 'partial_update'},
+                                 data={'file_description': 'Changed'},
+                                 pk=document.pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_destroy(self):
+        document = self.create_documents(1)[0]
+        # The last reference deletes the blob and its renditions
+        with self.assertQueryBudget(12):
+            response = self.call('delete', {'delete': 'destroy'},
+                                 pk=document.pk)
+        self.assertEqual(response.status_code, 204)
+
+    def test_bulk_create(self):
+        # Every file is stored and referenced as a blob on its own, the
+        # documents are inserted at once
+        for size in (1, 10):
+            items = [{'file_name': 'Test{}.pdf'.format(number),
+                      'file': 'data:application/pdf;base64,' +
+                      'c29tZSBjb250ZW50'}
+                     for number in range(size)]
+            with self.assertQueryBudget(2 + 2 * size):
+                response = self.call('post', {'post': 'bulk_create'},
+                                     data=items)
+            self.assertEqual(response.status_code, 201)
+
+    def test_selection_actions(self):
+        # The documents of a selection are changed at once
+        for action, path, data, budget in (
+                ('update_workflowlevels', '/documents/workflowlevels/',
+                 {'operation': 'add', 'field': 'workflowlevel1_uuids',
+                  'uuid': str(uuid.uuid4())}, 3),
+                ('bulk_destroy', '/documents/delete/', {}, 7)):
+            counts = []
+            for size in (1, 10):
+                self.wfl2_uuid = str(uuid.uuid4())
+                self.create_documents(size)
+                with self.assertQueryBudget(budget) as queries:
+                    response = self.call(
+                        'post', {'post': action},
+                        path + '?workflowlevel2_uuid=' + self.wfl2_uuid,
+                        data)
+                self.assertEqual(response.status_code, 200)
+                counts.append(queries.count)
+            self.assertEqual(counts[0], counts[1], action)
+
+    def test_archive(self):
+        counts = []
+        for size in (1, 10):
+            self.wfl2_uuid = str(uuid.uuid4())
+            self.create_documents(size)
+            with self.assertQueryBudget(1) as queries:
+                response = self.call(
+                    'get', {'get': 'archive'},
+                    '/documents/archive/?workflowlevel2_uuid=' +
+                    self.wfl2_uuid)
+                b''.join(response.streaming_content)
+            counts.append(queries.count)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_statistics(self):
+        self.create_documents(2)
+        with self.assertQueryBudget(1):
+            response = self.call(
+                'get', {'get': 'statistics'},
+                '/documents/statistics/?workflowlevel2_uuid=' +
+                self.wfl2_uuid)
+        self.assertEqual(response.status_code, 200)
+
+    def test_file_views(self):
+        document = Document.objects.create(
+            file_name='Test.jpg', file=make_image_file())
+        # The first rendition is generated, later requests serve it
+        self.get_file(document_rendition_view, document, width=100,
+                      height=100)
+        for view, budget in ((document_download_view, 1),
+                             (document_thumbnail_view, 1),
+                             (document_rendition_view, 2)):
+            with self.assertQueryBudget(budget):
+                response = self.get_file(view, document, width=100,
+                                         height=100)
+                b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+
+    def get_file(self, view, document, **params):
+        request = self.factory.get('', params)
+        request.user = self.user
+        return view(request, id=document.pk)
+
+    def test_upload_session(self):
+        def call(method, actions, data=None, **kwargs):
+            if method == 'put':
+                request = self.factory.put(
+                    '', data, content_type='application/octet-stream')
+            else:
+                request = getattr(self.factory, method)('', data,
+                                                        format='json')
+            request.user = self.user
+            view = UploadSessionViewSet.as_view(actions)
+            return view(request, **kwargs)
+
+        with self.assertQueryBudget(2):
+            response = call('post', {'post': 'create'}, {
+                'file_name': 'Large.pdf', 'size': 10, 'chunk_size': 10})
+        self.assertEqual(response.status_code, 201)
+        session_id = response.data['id']
+
+        with self.assertQueryBudget(4):
+            response = call('put', {'put': 'chunks'}, b'0123456789',
+                            pk=session_id, number='0')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertQueryBudget(2):
+            response = call('get', {'get': 'retrieve'}, pk=session_id)
+        self.assertEqual(response.status_code, 200)
+
+        # Includes the blob storage task, which runs inline in eager mode
+        with self.assertQueryBudget(14):
+            response = call('post', {'post': 'finalize'}, pk=session_id)
+        self.assertEqual(response.status_code, 201)
+
+
+@tag('performance')
+class ListQueryPlanTest(TestCase):
+    """
+    Plans of the list queries on a table which is large enough for the
+    planner to prefer a sequential scan to an unsuitable index.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        # Every contact, workflowlevel1 and workflowlevel2 has a few
+        # documents, 1 in 200 is a text file
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO documents_document (
+                    uuid, file_name, file_description, file_type,
+                    file_mime_type, file_sha256, content_text, contact_uuid,
+                    workflowlevel1_uuids, workflowlevel2_uuids, upload_date,
+                    create_date)
+                SELECT md5(i::text)::uuid, 'Report ' || i || '.pdf',
+                    'Quarterly report of contact ' || i %% 1000,
+                    CASE WHEN i %% 200 = 0 THEN 'txt' ELSE (ARRAY[
+                        'pdf', 'docx', 'jpg', 'png', 'xlsx'])[i %% 5 + 1] END,
+                    '', '', '',
+                    'contact-' || i %% 1000, ARRAY['wfl1-' || i %% 2000],
+                    ARRAY['wfl2-' || i %% 20000],
+                    '2018-01-01'::timestamptz + i * interval '1 minute',
+                    '2018-01-01'::timestamptz +
+                        i * 7919 %% %s * interval '1 minute'
+                FROM generate_series(1, %s) AS i
+            """, [EXPLAIN_DOCUMENT_COUNT, EXPLAIN_DOCUMENT_COUNT])
+            cursor.execute('ANALYZE documents_document')
+            # Filled by the documents_document_workflowlevels trigger
+            cursor.execute('ANALYZE documents_documentworkflowlevel')
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+
+    def get_plan_nodes(self, query):
+        """
+        Returns the plan nodes of the query of the first list page.
+        """
+        request = self.factory.get('/documents/' + query)
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        with override_settings(DOCUMENT_LIST_CACHE_TIMEOUT=0), \
+                CaptureQueriesContext(connection) as context:
+            response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'], query)
+
+        sql = [query['sql'] for query in context.captured_queries
+               if query['sql'].startswith('SELECT') and
+               'FROM "documents_document"' in query['sql']][-1]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        nodes = [plan[0]['Plan']]
+        for node in nodes:
+            nodes.extend(node.get('Plans', ()))
+        return nodes
+
+    def assertUsesIndex(self, query, *index_names):
+        nodes = self.get_plan_nodes(query)
+        summary = ', '.join('{} {}'.format(
+            node['Node Type'],
+            node.get('Index Name') or node.get('Relation Name') or '')
+            for node in nodes)
+        self.assertNotIn('Seq Scan', [node['Node Type'] for node in nodes],
+                         '{}: {}'.format(query, summary))
+        for index_name in index_names:
+            self.assertIn(index_name, [node.get('Index Name')
+                                       for node in nodes],
+                          '{}: {}'.format(query, summary))
+
+    def test_filters(self):
+        self.assertUsesIndex('', 'documents_document_pkey')
+        self.assertUsesIndex('?file_type=txt', 'document_file_type_id_idx')
+        self.assertUsesIndex('?contact_uuid=contact-7',
+                             'document_contact_uuid_id_idx')
+        # The unique index of DocumentWorkflowLevel has a generated name
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, DocumentWorkflowLevel._meta.db_table)
+        workflowlevel_index = [
+            name for name, constraint in constraints.items()
+            if constraint['unique'] and len(constraint['columns']) == 3][0]
+        self.assertUsesIndex('?workflowlevel1_uuid=wfl1-7',
+                             workflowlevel_index)
+        self.assertUsesIndex('?workflowlevel2_uuid=wfl2-7',
+                             workflowlevel_index)
+        self.assertUsesIndex(
+            '?workflowlevel1_uuid=wfl1-7&workflowlevel2_uuid=wfl2-7',
+            workflowlevel_index)
+
+    def test_orderings(self):
+        for ordering in ('upload_date', 'create_date'):
+            for direction in ('', '-'):
+                self.assertUsesIndex(
+                    '?ordering=' + direction + ordering,
+                    'document_{}_idx'.format(ordering))
+
+    def test_search(self):
+        self.assertUsesIndex('?search=77777', 'document_search_vector_gin',
+                             'document_file_name_trgm')
+
+
+@tag('performance')
+class StatisticQueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Statistics of 20000 workflowlevel2 in 50 organizations
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO documents_documentstatistic (
+                    organization_uuid, workflowlevel, workflowlevel_uuid,
+                    file_type, document_count, total_size)
+                SELECT 'organization-' || i %% 50, %s, 'wfl2-' || i,
+                    file_type, 1, 100
+                FROM generate_series(1, 20000) AS i,
+                    unnest(ARRAY['pdf', 'docx', 'jpg', 'png', 'xlsx'])
+                    AS file_type
+            """, [WORKFLOWLEVEL2])
+            cursor.execute('ANALYZE documents_documentstatistic')
+
+    def test_get_file_types(self):
+        with CaptureQueriesContext(connection) as context:
+            file_types = DocumentStatistic.objects.get_file_types(
+                workflowlevel2_uuid='wfl2-7')
+        self.assertEqual(len(file_types), 5)
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' +
+                           context.captured_queries[-1]['sql'])
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = [plan[0]['Plan']]
+        for node in nodes:
+            nodes.extend(node.get('Plans', ()))
+        self.assertIn('statistic_workflowlevel_idx',
+                      [node.get('Index Name') for node in nodes])
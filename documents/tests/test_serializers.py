@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+import base64
+import os
+from unittest import mock
+
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIRequestFactory
 import boto3
 from moto import mock_s3
 
 from . import model_factories as mfactories
-from ..serializers import DocumentSerializer
+from ..serializers import Base64FileField, DocumentSerializer
 
 
 @mock_s3
@@ -43,10 +48,21 @@ class DocumentSerializerTest(TestCase):
             'id',
             'file',
             'file_name',
-            'thumbnail'
+            'thumbnail',
+            'thumbnail_status',
+            'thumbnail_size',
+            'file_size',
+            'file_mime_type',
+            'file_sha256',
+            'file_modified_date',
+            'image_width',
+            'image_height',
+            'text_status',
         ]
 
         self.assertEqual(set(data.keys()), set(keys))
+        self.assertEqual(data['file_size'], 12)
+        self.assertEqual(data['file_mime_type'], 'text/plain')
 
     def test_mock_s3(self):
         # Mock with pdf since image files will trigger thumbnail generation
@@ -66,3 +82,62 @@ class DocumentSerializerTest(TestCase):
 
         serializer = DocumentSerializer(instance=self.document)
         self.assertIsNone(serializer.data['file'])
+
+
+class Base64FileFieldTest(TestCase):
+    def setUp(self):
+        self.content = os.urandom(10000)
+        self.data = 'data:application/pdf;base64,' + \
+            base64.b64encode(self.content).decode()
+
+    def test_decode(self):
+        file = Base64FileField().to_internal_value(self.data)
+        self.assertTrue(file.name.endswith('.pdf'))
+        self.assertEqual(file.size, len(self.content))
+        self.assertEqual(file.content_type, 'application/pdf')
+        self.assertEqual(file.read(), self.content)
+
+    def test_decode_ignores_line_breaks(self):
+        encoded = base64.encodebytes(self.content).decode()
+        self.assertIn('\n', encoded)
+
+        file = Base64FileField().to_internal_value(
+            'data:application/pdf;base64,' + encoded)
+        self.assertEqual(file.read(), self.content)
+
+    @override_settings(DOCUMENT_BASE64_MAX_MEMORY_SIZE=20000)
+    def test_decode_small_file_in_memory(self):
+        file = Base64FileField().to_internal_value(self.data)
+        self.assertFalse(file.file._rolled)
+
+    @override_settings(DOCUMENT_BASE64_MAX_MEMORY_SIZE=1000)
+    def test_decode_large_file_to_disk(self):
+        file = Base64FileField().to_internal_value(self.data)
+        self.assertTrue(file.file._rolled)
+        self.assertEqual(file.read(), self.content)
+
+    @override_settings(DOCUMENT_MAX_UPLOAD_SIZE=9999)
+    def test_fails_too_large_before_decoding(self):
+        with mock.patch('documents.serializers.decode_base64') as decode:
+            with self.assertRaises(ValidationError) as context:
+                Base64FileField().to_internal_value(self.data)
+
+        decode.assert_not_called()
+        self.assertEqual(context.exception.detail[0].code, 'max_size')
+
+    @override_settings(DOCUMENT_MAX_UPLOAD_SIZE=10000)
+    def test_max_size(self):
+        file = Base64FileField().to_internal_value(self.data)
+        self.assertEqual(file.size, 10000)
+
+    def test_fails_invalid_base64(self):
+        for data in ('data:application/pdf;base64,abc',
+                     'data:application/pdf;base64,ab\xfcd',
+                     'data:application/pdf,abcd'):
+            with self.assertRaises(ValidationError):
+                Base64FileField().to_internal_value(data)
+
+    def test_fails_invalid_file_type(self):
+        with self.assertRaises(ValidationError):
+            Base64FileField().to_internal_value(
+                'data:application/exe;base64,abcd')
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+import boto3
+from moto import mock_s3
+
+from ..models import Blob, Document, UploadSession
+from ..storage import CachedS3Storage, delete_files, iter_chunks, iter_files
+
+
+@mock_s3
+class S3StorageTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        self.bucket = conn.create_bucket(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        # The mocked bucket is kept between the tests of a class
+        self.bucket.objects.all().delete()
+
+    def save(self, name):
+        return default_storage.save(name, ContentFile(b'content'))
+
+    def test_delete_files_in_batches(self):
+        names = [self.save('uploads/{}.txt'.format(i)) for i in range(5)]
+        client = default_storage.connection.meta.client
+
+        with mock.patch('documents.storage.S3_DELETE_BATCH_SIZE', 2), \
+                mock.patch.object(client, 'delete_objects',
+                                  wraps=client.delete_objects) as delete:
+            delete_files(default_storage, names[:4] + [None])
+
+        self.assertEqual(delete.call_count, 2)
+        self.assertEqual([obj.key for obj in self.bucket.objects.all()],
+                         [names[4]])
+
+    def test_iter_chunks(self):
+        name = default_storage.save('uploads/a.txt',
+                                    ContentFile(b'abcde'))
+        self.assertEqual(list(iter_chunks(default_storage, name, 2)),
+                         [b'ab', b'cd', b'e'])
+        self.assertEqual(
+            b''.join(iter_chunks(default_storage, name, 2, 1, 3)), b'bcd')
+
+    def test_iter_files(self):
+        names = sorted(self.save(name) for name in (
+            'uploads/b.txt', 'uploads/a/c.txt', 'uploads/a.txt',
+            'other/d.txt'))
+
+        self.assertEqual(
+            [name for name, _ in iter_files(default_storage, 'uploads')],
+            ['uploads/a.txt', 'uploads/a/c.txt', 'uploads/b.txt'])
+        self.assertEqual(
+            [name for name, _ in iter_files(default_storage, 'uploads',
+                                            start_after='uploads/a.txt')],
+            ['uploads/a/c.txt', 'uploads/b.txt'])
+        self.assertEqual(len(names), 4)
+
+    def test_delete_orphaned_files(self):
+        document = Document.objects.create(
+            file_name='Test.txt', file=ContentFile(b'text', name='Test.txt'))
+        orphaned = self.save('uploads/2019-1/1/orphaned.txt')
+        session = UploadSession.objects.create(
+            file_name='Test.txt', file_path='uploads/2019-1/1/Test.txt',
+            size=10, chunk_size=10)
+        session_part = self.save('uploads/sessions/{}/00000.part'.format(
+            session.uuid))
+        orphaned_part = self.save('uploads/sessions/1/00000.part')
+
+        out = StringIO()
+        call_command('delete_orphaned_files', '--min-age=0', stdout=out)
+
+        self.assertTrue(default_storage.exists(document.file.name))
+        self.assertTrue(default_storage.exists(session_part))
+        self.assertFalse(default_storage.exists(orphaned))
+        self.assertFalse(default_storage.exists(orphaned_part))
+        self.assertIn('deleted 2 orphaned files', out.getvalue())
+
+    def test_delete_orphaned_files_merges_referenced_names(self):
+        # Upper case names sort before lower case ones in key order, but
+        # not in every database collation
+        names = [self.save('uploads/2019-1/1/{}.txt'.format(name))
+                 for name in ('B', 'a', 'C', 'b', 'd')]
+        for name in names[::2]:
+            Document.objects.create(file_name='Test.txt', file=name)
+        Document.objects.create(file_name='Test.txt', file=names[0])
+
+        out = StringIO()
+        call_command('delete_orphaned_files', '--min-age=0',
+                     '--batch-size=1', stdout=out)
+
+        self.assertEqual([default_storage.exists(name) for name in names],
+                         [True, False, True, False, True])
+        self.assertIn('deleted 2 orphaned files', out.getvalue())
+
+    def test_delete_orphaned_files_deletes_unreferenced_blobs(self):
+        document = Document.objects.create(
+            file_name='Test.txt', file=ContentFile(b'text', name='Test.txt'))
+        # The deletion after the commit never ran
+        with mock.patch('documents.models.transaction.on_commit'):
+            document.delete()
+
+        call_command('delete_orphaned_files', '--min-age=0',
+                     stdout=StringIO())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(document.file.name))
+
+    def test_delete_orphaned_files_keeps_new_files(self):
+        orphaned = self.save('uploads/2019-1/1/orphaned.txt')
+        call_command('delete_orphaned_files', stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphaned))
+
+    def test_delete_orphaned_files_dry_run(self):
+        orphaned = self.save('uploads/2019-1/1/orphaned.txt')
+        out = StringIO()
+        call_command('delete_orphaned_files', '--min-age=0', '--dry-run',
+                     stdout=out)
+        self.assertTrue(default_storage.exists(orphaned))
+        self.assertIn(orphaned, out.getvalue())
+
+
+@mock_s3
+class CachedS3StorageTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        self.bucket = conn.create_bucket(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.bucket.objects.all().delete()
+        self.cache_dir = tempfile.mkdtemp()
+        self.storage = CachedS3Storage(cache_dir=self.cache_dir,
+                                       cache_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def save(self, name, content=b'content', storage=None):
+        return (storage or self.storage).save(name, ContentFile(content))
+
+    def read(self, name, storage=None):
+        with (storage or self.storage).open(name) as file:
+            return file.read()
+
+    def is_cached(self, name, storage=None):
+        return os.path.exists(
+            (storage or self.storage).get_cache_path(name))
+
+    def test_reads_through_the_cache(self):
+        name = self.save('uploads/a.txt', b'abcde')
+        client = self.storage.connection.meta.client
+
+        with mock.patch.object(client, 'get_object',
+                               wraps=client.get_object) as get_object:
+            self.assertEqual(self.read(name), b'abcde')
+            self.assertEqual(self.read(name), b'abcde')
+            self.assertEqual(
+                b''.join(iter_chunks(self.storage, name, 2, 1, 3)), b'bcd')
+
+        self.assertEqual(get_object.call_count, 1)
+        self.assertTrue(self.is_cached(name))
+
+    def test_records_the_cache_size(self):
+        names = [self.save('uploads/{}.txt'.format(name), b'1234')
+                 for name in 'ab']
+        size_path = os.path.join(self.cache_dir, '.size')
+
+        with mock.patch.object(self.storage, 'evict',
+                               wraps=self.storage.evict) as evict:
+            self.read(names[0])
+            # Scanned once, the size is within the limit afterwards
+            self.read(names[1])
+            self.read(names[1])
+        self.assertEqual(evict.call_count, 1)
+        with open(size_path) as file:
+            self.assertEqual(file.read(), '8')
+
+        self.storage.discard(names[0])
+        with open(size_path) as file:
+            self.assertEqual(file.read(), '4')
+
+    def test_fills_of_other_files_run_at_once(self):
+        first = self.save('uploads/0.txt')
+        directory = os.path.dirname(self.storage.get_cache_path(first))
+        # A file cached in the same directory
+        second = next(
+            name for name in ('uploads/{}.txt'.format(i)
+                              for i in range(1, 10000))
+            if os.path.dirname(self.storage.get_cache_path(name)) ==
+            directory)
+        self.save(second)
+        copyfileobj = shutil.copyfileobj
+        copies = []
+        results = []
+
+        def copy_and_read_second(*args):
+            copies.append(args)
+            if len(copies) == 1:
+                # Read while the first file is being filled
+                thread = threading.Thread(
+                    target=lambda: results.append(self.read(second)))
+                thread.start()
+                thread.join(2)
+                results.append(thread.is_alive())
+            return copyfileobj(*args)
+
+        with mock.patch('documents.storage.shutil.copyfileobj',
+                        side_effect=copy_and_read_second):
+            self.assertEqual(self.read(first), b'content')
+        self.assertEqual(results, [b'content', False])
+
+    def test_concurrent_reads_download_once(self):
+        name = self.save('uploads/a.txt')
+        copyfileobj = shutil.copyfileobj
+        downloads = []
+        results = []
+
+        def slow_copy(*args):
+            downloads.append(args)
+            time.sleep(0.2)
+            return copyfileobj(*args)
+
+        def read():
+            results.append(self.read(name))
+
+        with mock.patch('documents.storage.shutil.copyfileobj',
+                        side_effect=slow_copy):
+            threads = [threading.Thread(target=read) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, [b'content'] * 4)
+        self.assertEqual(len(downloads), 1)
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(
+                self.storage.get_cache_path(name)))
+             if not name.startswith('.')],
+            [os.path.basename(self.storage.get_cache_path(name))])
+
+    def test_evicts_least_recently_read_files(self):
+        storage = CachedS3Storage(cache_dir=self.cache_dir, cache_size=10)
+        names = [self.save('uploads/{}.txt'.format(name), b'1234', storage)
+                 for name in 'abc']
+
+        self.read(names[0], storage)
+        self.read(names[1], storage)
+        self.read(names[0], storage)
+        self.read(names[2], storage)
+
+        self.assertEqual([self.is_cached(name, storage) for name in names],
+                         [True, False, True])
+
+    def test_large_files_are_not_cached(self):
+        storage = CachedS3Storage(cache_dir=self.cache_dir, cache_size=1000,
+                                  max_file_size=3)
+        name = self.save('uploads/a.txt', b'abcde', storage)
+        client = storage.connection.meta.client
+
+        self.assertEqual(self.read(name, storage), b'abcde')
+        # The size is checked without downloading the file twice
+        with mock.patch.object(client, 'get_object',
+                               wraps=client.get_object) as get_object:
+            self.assertEqual(b''.join(iter_chunks(storage, name, 2)),
+                             b'abcde')
+        self.assertEqual(get_object.call_count, 1)
+        self.assertFalse(self.is_cached(name, storage))
+
+    def test_changed_files_leave_the_cache(self):
+        name = self.save('uploads/a.txt', b'old')
+        self.read(name)
+
+        self.save(name, b'new')
+        self.assertEqual(self.read(name), b'new')
+
+        self.storage.delete(name)
+        self.assertFalse(self.is_cached(name))
+        with self.assertRaises(IOError):
+            self.read(name)
+
+        other = self.save('uploads/b.txt')
+        self.read(other)
+        delete_files(self.storage, [other])
+        self.assertFalse(self.is_cached(other))
+
+    def test_default_storage(self):
+        with override_settings(
+                DEFAULT_FILE_STORAGE='documents.storage.CachedS3Storage',
+                DOCUMENT_STORAGE_CACHE_DIR=self.cache_dir):
+            document = Document.objects.create(
+                file_name='Test.txt',
+                file=ContentFile(b'text', name='Test.txt'))
+            self.assertEqual(
+                b''.join(iter_chunks(document.file.storage,
+                                     document.file.name)), b'text')
+            self.assertTrue(self.is_cached(document.file.name,
+                                           default_storage))
+
+
+class LocalStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                 'FileSystemStorage',
+            MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = FileSystemStorage()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_iter_chunks(self):
+        name = self.storage.save('uploads/a.txt', ContentFile(b'abcde'))
+        self.assertEqual(list(iter_chunks(self.storage, name, 2)),
+                         [b'ab', b'cd', b'e'])
+        self.assertEqual(list(iter_chunks(self.storage, name, 2, 1, 3)),
+                         [b'bc', b'd'])
+
+    def test_iter_files_and_delete_files(self):
+        for name in ('uploads/b.txt', 'uploads/a/c.txt', 'uploads/a.txt'):
+            self.storage.save(name, ContentFile(b'content'))
+
+        names = [name for name, _ in iter_files(self.storage, 'uploads/',
+                                                start_after='uploads/a.txt')]
+        self.assertEqual(names, ['uploads/a/c.txt', 'uploads/b.txt'])
+
+        delete_files(self.storage, names)
+        self.assertEqual(
+            [name for name, _ in iter_files(self.storage, 'uploads/')],
+            ['uploads/a.txt'])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+from unittest import mock
+import uuid
+
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import TestCase
+import boto3
+from moto import mock_s3
+
+from ..models import (Blob, Document, THUMBNAIL_STATUS_FAILED,
+                      THUMBNAIL_STATUS_PENDING, THUMBNAIL_STATUS_READY)
+from ..tasks import generate_thumbnail
+
+
+def make_image_file(name='Testfile.jpg', size=(400, 500)):
+    image = Image.new('RGB', size, color='blue')
+    temp_file = BytesIO()
+    image.save(temp_file, 'JPEG')
+    temp_file.seek(0)
+    return ContentFile(temp_file.read(), name=name)
+
+
+@mock_s3
+class GenerateThumbnailTaskTest(TestCase):
+    def setUp(self):
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def test_generate_thumbnail(self):
+        document = Document.objects.create(
+            file_name='Test.jpg',
+            file=make_image_file(),
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+        Document.objects.filter(pk=document.pk).update(
+            thumbnail='', thumbnail_status=THUMBNAIL_STATUS_PENDING)
+
+        generate_thumbnail.delay(document.pk)
+
+        document_db = Document.objects.get(pk=document.pk)
+        self.assertEqual(document_db.thumbnail_status, THUMBNAIL_STATUS_READY)
+        thumbnail = Image.open(document_db.thumbnail)
+        self.assertEqual(thumbnail.size, (200, 200))
+
+    def test_generate_thumbnail_marks_failed_after_retries(self):
+        document = Document.objects.create(
+            file_name='Test.jpg',
+            file=make_image_file(),
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+        Document.objects.filter(pk=document.pk).update(
+            thumbnail='', thumbnail_status=THUMBNAIL_STATUS_PENDING)
+        Blob.objects.filter(pk=document.blob_id).update(thumbnail='')
+
+        with mock.patch.object(Document, 'make_thumbnail',
+                               side_effect=IOError) as make_thumbnail:
+            generate_thumbnail.delay(document.pk)
+
+        self.assertEqual(make_thumbnail.call_count,
+                         generate_thumbnail.max_retries + 1)
+        document_db = Document.objects.get(pk=document.pk)
+        self.assertEqual(document_db.thumbnail_status,
+                         THUMBNAIL_STATUS_FAILED)
+        self.assertFalse(document_db.thumbnail)
+
+    def test_generate_thumbnail_deleted_document(self):
+        result = generate_thumbnail.delay(0)
+        self.assertTrue(result.successful())
+
+    def test_save_without_new_file_does_not_regenerate(self):
+        document = Document.objects.create(
+            file_name='Test.jpg',
+            file=make_image_file(),
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+
+        with mock.patch('documents.tasks.generate_thumbnail.delay') as delay:
+            document.file_description = 'New description'
+            document.save()
+
+        delay.assert_not_called()
+
+    def test_save_queues_thumbnail_on_commit(self):
+        # The Celery settings are read from Django with the CELERY_ prefix
+        with mock.patch.dict(generate_thumbnail.app.conf.changes,
+                             CELERY_TASK_ALWAYS_EAGER=False), \
+                mock.patch('documents.tasks.transaction.on_commit') \
+                as on_commit, \
+                mock.patch('documents.tasks.generate_thumbnail.delay') \
+                as delay:
+            document = Document.objects.create(
+                file_name='Test.jpg',
+                file=make_image_file(),
+                workflowlevel1_uuids=[str(uuid.uuid4())],
+            )
+
+            self.assertEqual(document.thumbnail_status,
+                             THUMBNAIL_STATUS_PENDING)
+            delay.assert_not_called()
+            # The list cache is invalidated on commit as well
+            self.assertEqual(on_commit.call_count, 2)
+
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+            delay.assert_called_once_with(document.pk)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from io import StringIO
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+import uuid
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+import boto3
+from moto import mock_s3
+
+from . import model_factories as mfactories
+from ..models import Document, UploadSession
+from ..tasks import store_document_blob
+from ..uploads import SESSION_PARTS_PATH
+from ..views import UploadSessionViewSet
+
+
+class UploadSessionTestMixin(object):
+    def create_session(self, **data):
+        request = self.factory.post('', data, format='json')
+        request.user = self.user
+        view = UploadSessionViewSet.as_view({'post': 'create'})
+        return view(request)
+
+    def put_chunk(self, session_id, number, content):
+        request = self.factory.put('', content,
+                                   content_type='application/octet-stream')
+        request.user = self.user
+        view = UploadSessionViewSet.as_view({'put': 'chunks'})
+        return view(request, pk=session_id, number=str(number))
+
+    def finalize(self, session_id, **data):
+        request = self.factory.post('', data, format='json')
+        request.user = self.user
+        view = UploadSessionViewSet.as_view({'post': 'finalize'})
+        return view(request, pk=session_id)
+
+    def expire_session(self, session_id):
+        UploadSession.objects.filter(pk=session_id).update(
+            create_date=timezone.now() - timedelta(hours=49))
+        call_command('delete_orphaned_files', '--rate', '0',
+                     stdout=StringIO())
+
+
+class UploadSessionLocalStorageTest(UploadSessionTestMixin, TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                 'FileSystemStorage',
+            MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_create_session(self):
+        response = self.create_session(file_name='Large.pdf', size=10,
+                                       chunk_size=4)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['chunk_count'], 3)
+        self.assertEqual(response.data['received_ranges'], [])
+        self.assertEqual(response.data['missing_chunks'], [0, 1, 2])
+        self.assertIsNone(response.data['document'])
+
+    def test_create_session_fails_invalid_file_type(self):
+        response = self.create_session(file_name='Large.exe', size=10,
+                                       chunk_size=4)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_name', response.data)
+
+    def test_create_session_anonymoususer(self):
+        request = self.factory.post('', {})
+        view = UploadSessionViewSet.as_view({'post': 'create'})
+        response = view(request)
+        self.assertEqual(response.status_code, 403)
+
+    def test_upload_chunks_out_of_order(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+
+        response = self.put_chunk(session_id, 2, b'89')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received_ranges'], [[8, 9]])
+
+        response = self.put_chunk(session_id, 0, b'0123')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received_ranges'],
+                         [[0, 3], [8, 9]])
+        self.assertEqual(response.data['missing_chunks'], [1])
+
+        # Sending a chunk again replaces it
+        self.put_chunk(session_id, 0, b'0123')
+        response = self.put_chunk(session_id, 1, b'4567')
+        self.assertEqual(response.data['received_ranges'], [[0, 9]])
+        self.assertEqual(response.data['missing_chunks'], [])
+
+    def test_upload_chunk_fails_wrong_size(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+
+        response = self.put_chunk(session_id, 0, b'012')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.put_chunk(session_id, 2, b'89ab')
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_chunk_fails_invalid_number(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+
+        response = self.put_chunk(session_id, 3, b'89')
+        self.assertEqual(response.status_code, 400)
+
+    def test_finalize(self):
+        workflowlevel1_uuids = [str(uuid.uuid4())]
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        for number, content in ((1, b'4567'), (2, b'89'), (0, b'0123')):
+            self.put_chunk(session_id, number, content)
+
+        response = self.finalize(session_id,
+                                 workflowlevel1_uuids=workflowlevel1_uuids)
+        self.assertEqual(response.status_code, 201)
+
+        document = Document.objects.get(pk=response.data['id'])
+        self.assertEqual(document.file_name, 'Large.pdf')
+        self.assertEqual(document.workflowlevel1_uuids, workflowlevel1_uuids)
+        self.assertEqual(document.file.read(), b'0123456789')
+
+        session = UploadSession.objects.get(pk=session_id)
+        self.assertEqual(session.document, document)
+        self.assertFalse(session.chunks.exists())
+
+        response = self.put_chunk(session_id, 0, b'0123')
+        self.assertEqual(response.status_code, 400)
+        response = self.finalize(session_id)
+        self.assertEqual(response.status_code, 400)
+
+    def test_finalize_reuses_blob_with_same_content(self):
+        documents = []
+        for _ in range(2):
+            session_id = self.create_session(
+                file_name='Large.pdf', size=10, chunk_size=4).data['id']
+            for number, content in ((0, b'0123'), (1, b'4567'), (2, b'89')):
+                self.put_chunk(session_id, number, content)
+            response = self.finalize(session_id)
+            documents.append(Document.objects.get(pk=response.data['id']))
+
+        self.assertEqual(documents[0].blob_id, documents[1].blob_id)
+        self.assertEqual(documents[0].file.name, documents[1].file.name)
+        self.assertEqual(documents[1].blob.reference_count, 2)
+
+    def test_finalize_stores_blob_after_commit(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        for number, content in ((0, b'0123'), (1, b'4567'), (2, b'89')):
+            self.put_chunk(session_id, number, content)
+
+        with mock.patch.dict(store_document_blob.app.conf.changes,
+                             CELERY_TASK_ALWAYS_EAGER=False), \
+                mock.patch('documents.tasks.transaction.on_commit') \
+                as on_commit, \
+                mock.patch('documents.tasks.store_document_blob.delay') \
+                as delay:
+            response = self.finalize(session_id)
+            self.assertEqual(response.status_code, 201)
+            document = Document.objects.get(pk=response.data['id'])
+            # The file is not read in the request
+            self.assertIsNone(document.blob)
+            self.assertEqual(document.file_size, 10)
+            self.assertEqual(document.file_sha256, '')
+
+            delay.assert_not_called()
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+            delay.assert_called_once_with(document.pk)
+
+        store_document_blob(document.pk)
+        document.refresh_from_db()
+        self.assertEqual(document.file_sha256,
+                         hashlib.sha256(b'0123456789').hexdigest())
+        self.assertEqual(document.blob.file.name, document.file.name)
+        self.assertEqual(document.file.read(), b'0123456789')
+
+    def test_finalize_fails_missing_chunks(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        self.put_chunk(session_id, 0, b'0123')
+
+        response = self.finalize(session_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['missing_chunks'], ['1', '2'])
+        self.assertFalse(Document.objects.exists())
+
+    def test_abort_session(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        self.put_chunk(session_id, 0, b'0123')
+
+        request = self.factory.delete('')
+        request.user = self.user
+        view = UploadSessionViewSet.as_view({'delete': 'destroy'})
+        response = view(request, pk=session_id)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_expire_session(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        self.put_chunk(session_id, 0, b'0123')
+        open_session_id = self.create_session(
+            file_name='Large.pdf', size=10, chunk_size=4).data['id']
+        self.put_chunk(open_session_id, 0, b'0123')
+
+        self.expire_session(session_id)
+        self.assertEqual(list(UploadSession.objects.values_list(
+            'pk', flat=True)), [open_session_id])
+        parts = [os.path.relpath(os.path.join(path, name), self.media_root)
+                 for path, _, names in os.walk(self.media_root)
+                 for name in names]
+        open_session = UploadSession.objects.get(pk=open_session_id)
+        self.assertEqual(parts, [SESSION_PARTS_PATH.format(
+            open_session.uuid) + '00000.part'])
+
+
+@mock_s3
+class UploadSessionS3Test(UploadSessionTestMixin, TestCase):
+    chunk_size = 5 * 1024 * 1024
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def test_create_session_fails_small_chunk_size(self):
+        response = self.create_session(file_name='Large.pdf',
+                                       size=self.chunk_size,
+                                       chunk_size=1024)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('chunk_size', response.data)
+
+    def test_finalize(self):
+        first_chunk = b'a' * self.chunk_size
+        session_id = self.create_session(
+            file_name='Large.pdf', size=self.chunk_size + 3,
+            chunk_size=self.chunk_size).data['id']
+        self.assertIsNotNone(
+            UploadSession.objects.get(pk=session_id).upload_id)
+
+        self.put_chunk(session_id, 1, b'xyz')
+        response = self.put_chunk(session_id, 0, first_chunk)
+        self.assertEqual(response.data['missing_chunks'], [])
+
+        response = self.finalize(session_id)
+        self.assertEqual(response.status_code, 201)
+
+        document = Document.objects.get(pk=response.data['id'])
+        self.assertEqual(document.file.size, self.chunk_size + 3)
+        self.assertEqual(document.file.read(), first_chunk + b'xyz')
+
+    def test_expire_session(self):
+        session_id = self.create_session(
+            file_name='Large.pdf', size=self.chunk_size + 3,
+            chunk_size=self.chunk_size).data['id']
+        self.put_chunk(session_id, 1, b'xyz')
+        upload_id = UploadSession.objects.get(pk=session_id).upload_id
+
+        self.expire_session(session_id)
+        self.assertFalse(UploadSession.objects.exists())
+        client = boto3.client('s3', region_name='us-east-1')
+        uploads = client.list_multipart_uploads(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME).get('Uploads', [])
+        self.assertNotIn(upload_id, [upload['UploadId']
+                                     for upload in uploads])
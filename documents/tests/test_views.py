@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-import uuid
+from io import BytesIO
+import json
 import re
+import shutil
+import tempfile
+from unittest import mock
+import uuid
+import zipfile
 
-from django.test import TestCase
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
 from rest_framework.test import APIRequestFactory
 import boto3
 from moto import mock_s3
+from storages.backends.s3boto3 import S3Boto3Storage
 
 from . import model_factories as mfactories
-from ..models import Document
-from ..views import DocumentViewSet
+from .. import renditions
+from ..caching import get_cache
+from ..models import Document, Rendition
+from ..views import (DocumentViewSet, document_download_view,
+                     document_rendition_view, document_thumbnail_view)
 
 
 @mock_s3
@@ -23,6 +38,8 @@ class DocumentListViewsTest(TestCase):
         self.user = mfactories.User()
         conn = boto3.resource('s3', region_name='us-east-1')
         conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        # Cached pages outlive the rolled back documents of other tests
+        get_cache().clear()
 
     def test_list_empty(self):
         request = self.factory.get('')
@@ -36,7 +53,8 @@ class DocumentListViewsTest(TestCase):
     def test_list_documents(self):
         request = self.factory.get('')
         request.user = self.user
-        mfactories.Document()
+        # The factory cycles through the file names of earlier tests
+        mfactories.Document(file_name='test.jpg')
         view = DocumentViewSet.as_view({'get': 'list'})
         response = view(request)
 
@@ -228,6 +246,209 @@ class DocumentListViewsTest(TestCase):
         self.assertEquals(documents_data[0]['file'], url)
         self.assertIsNone(documents_data[1]['file'])
 
+    def test_list_documents_query_count_independent_of_page_size(self):
+        view = DocumentViewSet.as_view({'get': 'list'})
+
+        def count_list_queries():
+            request = self.factory.get('?page_size=100')
+            request.user = self.user
+            with CaptureQueriesContext(connection) as context:
+                response = view(request)
+            self.assertEqual(response.status_code, 200)
+            return len(response.data['results']), len(context)
+
+        # Mock with pdf since image files will trigger thumbnail generation
+        mfactories.Document(
+            file_name='Document0.pdf',
+            file=SimpleUploadedFile('test0.pdf', b'some content'))
+        results, queries_one = count_list_queries()
+        self.assertEqual(results, 1)
+
+        for i in range(1, 20):
+            mfactories.Document(
+                file_name='Document{}.pdf'.format(i),
+                file=SimpleUploadedFile('test{}.pdf'.format(i),
+                                        b'some content'))
+        results, queries_many = count_list_queries()
+        self.assertEqual(results, 20)
+
+        self.assertEqual(queries_one, queries_many)
+
+    def test_list_documents_with_fields(self):
+        mfactories.Document(file_name='Document1.png')
+        mfactories.Document(file_name='Document2.png')
+
+        request = self.factory.get('?fields=id,file_name,file&page_size=1'
+                                   '&ordering=-upload_date')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'file_name', 'file'})
+        self.assertIsNotNone(response.data['next'])
+        self.assertNotIn('file_description', queries[-1]['sql'])
+        self.assertNotIn('workflowlevel1_uuids', queries[-1]['sql'])
+
+    def test_list_documents_search(self):
+        described = mfactories.Document(file_name='holiday.jpg',
+                                        file_description='Invoice copy')
+        named = mfactories.Document(file_name='Invoice 2019.pdf')
+        mfactories.Document(file_name='Document.pdf')
+
+        request = self.factory.get('?search=invoice')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        # Matches of the file name rank above matches of the description
+        self.assertEqual([data['id'] for data in response.data['results']],
+                         [named.id, described.id])
+
+    def test_list_documents_search_part_of_file_name(self):
+        document = mfactories.Document(file_name='Invoice 2019.pdf',
+                                       file_description='voice')
+        mfactories.Document(file_name='Document.pdf',
+                            file_description='Invoice copy')
+
+        request = self.factory.get('?search=VOIC')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data['id'] for data in response.data['results']],
+                         [document.id])
+
+    def test_list_documents_search_after_update(self):
+        document = mfactories.Document(file_name='Document.pdf')
+        document.file_name = 'Contract.pdf'
+        document.save()
+        Document.objects.filter(pk=document.pk).update(
+            file_description='signed')
+
+        view = DocumentViewSet.as_view({'get': 'list'})
+        for text, count in (('document', 0), ('contract', 1),
+                            ('signed', 1)):
+            request = self.factory.get('?search={}'.format(text))
+            request.user = self.user
+            response = view(request)
+            self.assertEqual(len(response.data['results']), count)
+
+    def test_list_documents_search_pages(self):
+        ids = {mfactories.Document(file_name='Report {}.pdf'.format(i)).id
+               for i in range(5)}
+        mfactories.Document(file_name='Document.pdf')
+        view = DocumentViewSet.as_view({'get': 'list'})
+
+        found = []
+        url = '?search=report&page_size=2'
+        while url:
+            request = self.factory.get(url)
+            request.user = self.user
+            response = view(request)
+            self.assertEqual(response.status_code, 200)
+            found += [data['id'] for data in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(len(found), 5)
+        self.assertEqual(set(found), ids)
+
+    def test_list_documents_with_unknown_fields(self):
+        request = self.factory.get('?fields=id,blob')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+
+@override_settings(DOCUMENT_LIST_CACHE_TIMEOUT=60)
+class DocumentListCacheTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        get_cache().clear()
+        self.wfl2_uuid = str(uuid.uuid4())
+        self.document = mfactories.Document(
+            workflowlevel2_uuids=[self.wfl2_uuid])
+
+    def list(self, query=''):
+        request = self.factory.get('/documents/' + query)
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'list'})
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']], len(queries)
+
+    def test_list_is_cached(self):
+        query = '?workflowlevel2_uuid=' + self.wfl2_uuid
+        self.assertEqual(self.list(query)[0], [self.document.pk])
+        self.assertEqual(self.list(query), ([self.document.pk], 0))
+
+        # Other filters, orderings and page sizes are cached separately
+        ids, queries = self.list(query + '&page_size=1')
+        self.assertNotEqual(queries, 0)
+
+    def test_local_memory_cache_is_logged(self):
+        with self.assertLogs('documents.apps', 'WARNING') as logs:
+            apps.get_app_config('documents').ready()
+        self.assertIn('local memory', logs.output[0])
+
+    def test_save_invalidates_scope(self):
+        query = '?workflowlevel2_uuid=' + self.wfl2_uuid
+        self.list(query)
+        self.list('')
+
+        document = mfactories.Document(workflowlevel2_uuids=[self.wfl2_uuid])
+        self.assertEqual(self.list(query)[0],
+                         [self.document.pk, document.pk])
+        self.assertEqual(self.list('')[0], [self.document.pk, document.pk])
+
+        document.workflowlevel2_uuids = []
+        document.save()
+        self.assertEqual(self.list(query)[0], [self.document.pk])
+
+    def test_other_scopes_stay_cached(self):
+        query = '?workflowlevel2_uuid=' + self.wfl2_uuid
+        self.list(query)
+        mfactories.Document(workflowlevel2_uuids=[str(uuid.uuid4())])
+        self.assertEqual(self.list(query), ([self.document.pk], 0))
+
+    def test_bulk_changes_invalidate_scope(self):
+        other_uuid = str(uuid.uuid4())
+        query = '?workflowlevel2_uuid=' + other_uuid
+        self.assertEqual(self.list(query)[0], [])
+
+        Document.objects.all().add_to_array('workflowlevel2_uuids',
+                                            other_uuid)
+        self.assertEqual(self.list(query)[0], [self.document.pk])
+
+        Document.objects.filter(pk=self.document.pk).update(
+            file_description='Changed')
+        ids, queries = self.list(query)
+        self.assertNotEqual(queries, 0)
+
+        Document.objects.all().delete()
+        self.assertEqual(self.list(query)[0], [])
+
+    def test_update_invalidates_previous_scope(self):
+        query = '?workflowlevel2_uuid=' + self.wfl2_uuid
+        self.list(query)
+        Document.objects.filter(pk=self.document.pk).update(
+            workflowlevel2_uuids=[])
+        self.assertEqual(self.list(query)[0], [])
+
+    @override_settings(DOCUMENT_LIST_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        self.list()
+        ids, queries = self.list()
+        self.assertNotEqual(queries, 0)
+
 
 class DocumentRetrieveViewsTest(TestCase):
     def setUp(self):
@@ -242,6 +463,15 @@ class DocumentRetrieveViewsTest(TestCase):
         response = view(request, pk=document.pk)
         self.assertEqual(response.status_code, 200)
 
+    def test_retrieve_document_with_fields(self):
+        document = mfactories.Document()
+        request = self.factory.get('?fields=uuid')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'retrieve'})
+        response = view(request, pk=document.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'uuid': document.uuid})
+
     def test_retrieve_document_anonymoususer(self):
         request_get = self.factory.get('')
         view = DocumentViewSet.as_view({'get': 'retrieve'})
@@ -363,6 +593,384 @@ class DocumentCreateViewsTest(TestCase):
             pass
 
 
+@mock_s3
+class DocumentBulkCreateViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def post(self, data, format='json'):
+        request = self.factory.post('', data, format=format)
+        request.user = self.user
+        view = DocumentViewSet.as_view({'post': 'bulk_create'})
+        return view(request)
+
+    def make_item(self, file_name='Testfile.pdf', content='c29tZSBjb250ZW50'):
+        return {
+            'file_name': file_name,
+            'file': 'data:application/pdf;base64,' + content,
+            'workflowlevel1_uuids': [str(uuid.uuid4())],
+        }
+
+    def test_bulk_create_with_single_insert(self):
+        items = [self.make_item('Testfile{}.pdf'.format(i))
+                 for i in range(5)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.data],
+                         [201] * 5)
+        self.assertEqual(Document.objects.count(), 5)
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith(
+                       'INSERT INTO "documents_document"')]
+        self.assertEqual(len(inserts), 1)
+
+        document = Document.objects.get(
+            pk=response.data[2]['document']['id'])
+        self.assertEqual(document.file_name, 'Testfile2.pdf')
+        self.assertEqual(document.file_type, 'pdf')
+        self.assertEqual(document.file.read(), b'some content')
+
+    def test_bulk_create_partial(self):
+        response = self.post([self.make_item(),
+                              self.make_item('Testfile.exe'),
+                              {'file_name': 'Testfile.pdf',
+                               'workflowlevel1_uuids': 'no list'}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data],
+                         [201, 400, 400])
+        self.assertIn('errors', response.data[1])
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_bulk_create_all_invalid(self):
+        response = self.post([self.make_item('Testfile.exe')])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+
+    def test_bulk_create_multipart(self):
+        items = [{'file_name': 'First.pdf', 'file': 'first'},
+                 {'file_name': 'Second.pdf', 'file': 'second'}]
+        response = self.post({
+            'documents': json.dumps(items),
+            'first': SimpleUploadedFile('first.pdf', b'first content'),
+            'second': SimpleUploadedFile('second.pdf', b'second content'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        documents = Document.objects.order_by('id')
+        self.assertEqual([document.file.read() for document in documents],
+                         [b'first content', b'second content'])
+
+    def test_bulk_create_queues_thumbnails(self):
+        item = self.make_item(
+            'Testfile.png',
+            'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR'
+            '42mP8z/C/HgAGgwJ/lK3Q6wAAAABJRU5ErkJggg==')
+
+        with mock.patch('documents.tasks.transaction.on_commit') \
+                as on_commit, \
+                mock.patch('documents.tasks.generate_thumbnail.delay') \
+                as delay:
+            response = self.post([item, self.make_item()])
+            delay.assert_not_called()
+
+            for callback in on_commit.call_args_list:
+                callback[0][0]()
+
+        document_id = response.data[0]['document']['id']
+        delay.assert_called_once_with(document_id)
+        self.assertEqual(response.data[0]['document']['thumbnail_status'],
+                         'pending')
+
+    @override_settings(DOCUMENT_BULK_MAX_ITEMS=1)
+    def test_bulk_create_fails_too_many_items(self):
+        response = self.post([self.make_item(), self.make_item()])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+
+    def test_bulk_create_fails_no_list(self):
+        response = self.post(self.make_item())
+        self.assertEqual(response.status_code, 400)
+
+
+class DocumentWorkflowlevelUpdateViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        self.wfl1_uuid = str(uuid.uuid4())
+        self.new_uuid = str(uuid.uuid4())
+
+    def post(self, data, query=''):
+        request = self.factory.post('/documents/workflowlevels/' + query,
+                                    data, format='json')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'post': 'update_workflowlevels'})
+        return view(request)
+
+    def test_add_uuid_to_filtered_documents_in_one_update(self):
+        documents = [
+            mfactories.Document(workflowlevel1_uuids=[self.wfl1_uuid]),
+            mfactories.Document(workflowlevel1_uuids=[self.wfl1_uuid,
+                                                      self.new_uuid]),
+        ]
+        other_document = mfactories.Document(
+            workflowlevel1_uuids=[str(uuid.uuid4())])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(
+                {'operation': 'add', 'field': 'workflowlevel1_uuids',
+                 'uuid': self.new_uuid},
+                '?workflowlevel1_uuid=' + self.wfl1_uuid)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 1})
+        # The statistics are changed by the same statement
+        updates = [query for query in queries.captured_queries
+                   if 'UPDATE "documents_document"' in query['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('INSERT INTO "documents_documentstatistic"',
+                      updates[0]['sql'])
+
+        for document in documents:
+            document.refresh_from_db()
+            self.assertEqual(document.workflowlevel1_uuids,
+                             [self.wfl1_uuid, self.new_uuid])
+        other_document.refresh_from_db()
+        self.assertNotIn(self.new_uuid, other_document.workflowlevel1_uuids)
+
+    def test_add_uuid_by_ids(self):
+        document = mfactories.Document(workflowlevel2_uuids=None)
+        other_document = mfactories.Document()
+
+        response = self.post({'operation': 'add',
+                              'field': 'workflowlevel2_uuids',
+                              'uuid': self.new_uuid,
+                              'ids': [document.pk]})
+        self.assertEqual(response.data, {'updated': 1})
+
+        document.refresh_from_db()
+        self.assertEqual(document.workflowlevel2_uuids, [self.new_uuid])
+        other_document.refresh_from_db()
+        self.assertNotIn(self.new_uuid, other_document.workflowlevel2_uuids)
+
+    def test_remove_uuid(self):
+        document = mfactories.Document(
+            workflowlevel1_uuids=[self.wfl1_uuid, self.new_uuid])
+
+        response = self.post(
+            {'operation': 'remove', 'field': 'workflowlevel1_uuids',
+             'uuid': self.new_uuid},
+            '?workflowlevel1_uuid=' + self.wfl1_uuid)
+        self.assertEqual(response.data, {'updated': 1})
+
+        document.refresh_from_db()
+        self.assertEqual(document.workflowlevel1_uuids, [self.wfl1_uuid])
+
+    def test_update_fails_without_filter(self):
+        mfactories.Document()
+        response = self.post({'operation': 'add',
+                              'field': 'workflowlevel1_uuids',
+                              'uuid': self.new_uuid})
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_fails_invalid_field(self):
+        response = self.post({'operation': 'add', 'field': 'file_name',
+                              'uuid': self.new_uuid, 'ids': [1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('field', response.data)
+
+
+@mock_s3
+class DocumentBulkDeleteViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def post(self, data, query=''):
+        request = self.factory.post('/documents/delete/' + query, data,
+                                    format='json')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'post': 'bulk_destroy'})
+        return view(request)
+
+    def create_document(self, content, **kwargs):
+        return Document.objects.create(
+            file_name='Test.txt', file=ContentFile(content, name='Test.txt'),
+            **kwargs)
+
+    def test_bulk_delete_deletes_files_in_one_request(self):
+        wfl2_uuid = str(uuid.uuid4())
+        documents = [
+            self.create_document(b'first', workflowlevel2_uuids=[wfl2_uuid]),
+            self.create_document(b'second', workflowlevel2_uuids=[wfl2_uuid]),
+        ]
+        kept = self.create_document(b'first')
+        names = [document.file.name for document in documents]
+
+        storage = Document._meta.get_field('file').storage
+        client = storage.connection.meta.client
+        with mock.patch.object(client, 'delete_objects',
+                               wraps=client.delete_objects) as delete, \
+                mock.patch('documents.models.transaction.on_commit',
+                           side_effect=lambda func: func()):
+            response = self.post({}, '?workflowlevel2_uuid=' + wfl2_uuid)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(list(Document.objects.all()), [kept])
+        self.assertEqual(delete.call_count, 1)
+
+        # The first content is still referenced
+        self.assertTrue(storage.exists(names[0]))
+        self.assertFalse(storage.exists(names[1]))
+
+    def test_bulk_delete_by_ids(self):
+        document = self.create_document(b'first')
+        other_document = self.create_document(b'second')
+
+        response = self.post({'ids': [document.pk]})
+        self.assertEqual(response.data, {'deleted': 1})
+        self.assertEqual(list(Document.objects.all()), [other_document])
+
+    def test_bulk_delete_fails_without_filter(self):
+        self.create_document(b'first')
+        response = self.post({})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Document.objects.exists())
+
+    def test_destroy_deletes_file_stored_before_blobs(self):
+        storage = S3Boto3Storage()
+        name = storage.save('uploads/2019-1/1/legacy.txt',
+                            ContentFile(b'legacy'))
+        document = Document.objects.create(file_name='Test.txt', file=name)
+
+        request = self.factory.delete('')
+        request.user = self.user
+        view = DocumentViewSet.as_view({'delete': 'destroy'})
+        with mock.patch('documents.models.transaction.on_commit',
+                        side_effect=lambda func: func()):
+            response = view(request, pk=document.pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(storage.exists(name))
+
+
+@mock_s3
+class DocumentArchiveViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def get_archive(self, query=''):
+        request = self.factory.get('/documents/archive/' + query)
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'archive'})
+        response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def create_document(self, file_name, content, **kwargs):
+        return Document.objects.create(
+            file_name=file_name, file=ContentFile(content, name=file_name),
+            **kwargs)
+
+    def test_archive_filtered_documents(self):
+        wfl2_uuid = str(uuid.uuid4())
+        image = BytesIO()
+        Image.new('RGB', (10, 10)).save(image, 'PNG')
+        self.create_document('Test.txt', b'text' * 1000,
+                             workflowlevel2_uuids=[wfl2_uuid])
+        self.create_document('Test.png', image.getvalue(),
+                             workflowlevel2_uuids=[wfl2_uuid])
+        self.create_document('Other.txt', b'other')
+
+        archive = self.get_archive('?workflowlevel2_uuid=' + wfl2_uuid)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), ['Test.png', 'Test.txt'])
+        self.assertEqual(archive.read('Test.txt'), b'text' * 1000)
+        self.assertEqual(archive.read('Test.png'), image.getvalue())
+        self.assertEqual(archive.getinfo('Test.txt').compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('Test.png').compress_type,
+                         zipfile.ZIP_STORED)
+
+    def test_archive_renames_duplicate_names(self):
+        self.create_document('Test.txt', b'first')
+        self.create_document('Test.txt', b'second')
+        self.create_document('a/b.txt', b'third')
+
+        archive = self.get_archive()
+        self.assertEqual(sorted(archive.namelist()),
+                         ['Test (2).txt', 'Test.txt', 'a_b.txt'])
+        self.assertEqual(
+            sorted(archive.read(name) for name in archive.namelist()),
+            [b'first', b'second', b'third'])
+
+    def test_archive_skips_missing_files(self):
+        document = self.create_document('Test.txt', b'first')
+        self.create_document('Missing.txt', b'missing')
+        Document.objects.filter(file_name='Missing.txt').update(
+            file='uploads/missing.txt', blob=None)
+
+        archive = self.get_archive()
+        self.assertEqual(archive.namelist(), [document.file_name])
+
+
+@mock_s3
+class DocumentStatisticsViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def get(self, query=''):
+        request = self.factory.get('/documents/statistics/' + query)
+        request.user = self.user
+        view = DocumentViewSet.as_view({'get': 'statistics'})
+        return view(request)
+
+    def test_statistics(self):
+        organization_uuid = str(uuid.uuid4())
+        wfl2_uuid = str(uuid.uuid4())
+        for file_name, content, wfl2_uuids in (
+                ('Test.txt', b'12345', [wfl2_uuid]),
+                ('Test.pdf', b'123', [wfl2_uuid]),
+                ('Other.txt', b'1', [])):
+            Document.objects.create(
+                file_name=file_name, file=ContentFile(content, file_name),
+                organization_uuid=organization_uuid,
+                workflowlevel2_uuids=wfl2_uuids)
+
+        response = self.get('?organization_uuid=' + organization_uuid)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['document_count'], 3)
+        self.assertEqual(response.data['total_size'], 9)
+        self.assertEqual(response.data['file_types'], [
+            {'file_type': 'pdf', 'document_count': 1, 'total_size': 3},
+            {'file_type': 'txt', 'document_count': 2, 'total_size': 6},
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('?workflowlevel2_uuid=' + wfl2_uuid)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.data['document_count'], 2)
+        self.assertEqual(response.data['total_size'], 8)
+
+    def test_statistics_of_both_workflowlevels_fails(self):
+        response = self.get('?workflowlevel1_uuid=a&workflowlevel2_uuid=b')
+        self.assertEqual(response.status_code, 400)
+
+
 class DocumentUpdateViewsTest(TestCase):
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -421,6 +1029,270 @@ class DocumentUpdateViewsTest(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+@mock_s3
+class DocumentDownloadViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+        # Mock with pdf since image files will trigger thumbnail generation
+        self.document = mfactories.Document(
+            file_name='Document1.pdf',
+            file=SimpleUploadedFile('test1.pdf', b'some content'))
+
+    def get(self, view, document):
+        request = self.factory.get('')
+        request.user = self.user
+        return view(request, id=document.pk)
+
+    def test_download_proxy(self):
+        response = self.get(document_download_view, self.document)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('Content-Length'), '12')
+        self.assertEqual(response.get('Content-Disposition'),
+                         'attachment; filename=Document1.pdf')
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'some content')
+
+    def test_download_uses_stored_metadata(self):
+        with mock.patch.object(S3Boto3Storage, 'size') as size, \
+                mock.patch.object(S3Boto3Storage,
+                                  'get_modified_time') as modified_time, \
+                mock.patch.object(S3Boto3Storage, '_open') as storage_open:
+            response = self.get(document_download_view, self.document)
+            content = b''.join(response.streaming_content)
+
+        self.assertEqual(content, b'some content')
+        self.assertEqual(response['Content-Length'], '12')
+        # The content is sniffed, not taken from the file name
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIsNotNone(response.get('Last-Modified'))
+        size.assert_not_called()
+        modified_time.assert_not_called()
+        storage_open.assert_not_called()
+
+    def test_download_validators(self):
+        response = self.get(document_download_view, self.document)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIsNotNone(response.get('Last-Modified'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_download_if_none_match(self):
+        etag = self.get(document_download_view, self.document)['ETag']
+
+        request = self.factory.get('', HTTP_IF_NONE_MATCH=etag)
+        request.user = self.user
+        with mock.patch.object(S3Boto3Storage, '_open') as storage_open:
+            response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 304)
+        storage_open.assert_not_called()
+
+    def test_download_if_modified_since(self):
+        last_modified = self.get(document_download_view,
+                                 self.document)['Last-Modified']
+
+        request = self.factory.get('', HTTP_IF_MODIFIED_SINCE=last_modified)
+        request.user = self.user
+        with mock.patch.object(S3Boto3Storage, '_open') as storage_open:
+            response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 304)
+        storage_open.assert_not_called()
+
+    def test_download_range(self):
+        request = self.factory.get('', HTTP_RANGE='bytes=5-11')
+        request.user = self.user
+        response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 5-11/12')
+        self.assertEqual(response['Content-Length'], '7')
+        self.assertEqual(b''.join(response.streaming_content), b'content')
+
+    def test_download_multiple_ranges(self):
+        request = self.factory.get('', HTTP_RANGE='bytes=0-3,-7')
+        request.user = self.user
+        response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 206)
+        content_type, boundary = response['Content-Type'].split(
+            '; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-3/12\r\n\r\nsome\r\n', body)
+        self.assertIn(b'Content-Range: bytes 5-11/12\r\n\r\ncontent\r\n',
+                      body)
+        self.assertTrue(body.endswith(
+            '--{}--\r\n'.format(boundary).encode()))
+
+    def test_download_range_not_satisfiable(self):
+        request = self.factory.get('', HTTP_RANGE='bytes=12-')
+        request.user = self.user
+        response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */12')
+
+    def test_download_if_range_mismatch(self):
+        request = self.factory.get('', HTTP_RANGE='bytes=5-11',
+                                   HTTP_IF_RANGE='"outdated"')
+        request.user = self.user
+        response = document_download_view(request, id=self.document.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'some content')
+
+    @override_settings(DOCUMENT_DOWNLOAD_MODE='redirect')
+    def test_download_redirect(self):
+        response = self.get(document_download_view, self.document)
+        self.assertEqual(response.status_code, 302)
+
+        location = response['Location']
+        self.assertIn(self.document.file.name, location)
+        self.assertIn('Signature=', location)
+        self.assertIn('Expires=', location)
+        self.assertIn('response-content-disposition=attachment%3B%20'
+                      'filename%3DDocument1.pdf', location)
+
+    @override_settings(DOCUMENT_DOWNLOAD_MODE='redirect')
+    def test_thumbnail_redirect(self):
+        Document.objects.filter(pk=self.document.pk).update(
+            thumbnail=self.document.file.name)
+
+        response = self.get(document_thumbnail_view, self.document)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('filename%3Dthumbnail_Document1.pdf',
+                      response['Location'])
+
+    @override_settings(DOCUMENT_DOWNLOAD_MODE='redirect')
+    def test_download_redirect_not_found(self):
+        document = mfactories.Document(file_name='Document2.pdf')
+
+        response = self.get(document_download_view, document)
+        self.assertEqual(response.status_code, 404)
+
+    def test_download_anonymoususer(self):
+        request = self.factory.get('')
+        response = document_download_view(request, id=self.document.pk)
+        self.assertEqual(response.status_code, 403)
+
+
+class DocumentDownloadLocalStorageViewsTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                 'FileSystemStorage',
+            MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    @override_settings(DOCUMENT_DOWNLOAD_MODE='redirect')
+    def test_download_redirect_falls_back_to_proxy(self):
+        document = mfactories.Document(
+            file_name='Document1.pdf',
+            file=SimpleUploadedFile('test1.pdf', b'some content'))
+
+        request = self.factory.get('')
+        request.user = self.user
+        response = document_download_view(request, id=document.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'some content')
+
+
+@mock_s3
+class DocumentRenditionViewTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = mfactories.User()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def create_image_document(self):
+        image = Image.new('RGB', (400, 500), color='blue')
+        temp_file = BytesIO()
+        image.save(temp_file, 'JPEG')
+        return Document.objects.create(
+            file_name='Test.jpg',
+            file=ContentFile(temp_file.getvalue(), name='Testfile.jpg'),
+            workflowlevel1_uuids=[str(uuid.uuid4())],
+        )
+
+    def get(self, document, **params):
+        request = self.factory.get('', params)
+        request.user = self.user
+        return document_rendition_view(request, id=document.pk)
+
+    def test_rendition_crop(self):
+        document = self.create_image_document()
+        response = self.get(document, width=400, height=400)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('Content-Disposition'),
+                         'attachment; filename=400x400_Test.jpg')
+        image = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(image.size, (400, 400))
+
+    def test_rendition_contain(self):
+        document = self.create_image_document()
+        response = self.get(document, width=100, height=100, fit='contain')
+        self.assertEqual(response.status_code, 200)
+        image = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(image.size, (80, 100))
+
+    def test_rendition_is_generated_once(self):
+        document = self.create_image_document()
+        other_document = self.create_image_document()
+
+        with mock.patch('documents.renditions.make_resized_file',
+                        wraps=renditions.make_resized_file) as resize:
+            self.get(document, width=800, height=800)
+            self.get(document, width=800, height=800)
+            response = self.get(other_document, width=800, height=800)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(resize.call_count, 1)
+        rendition = Rendition.objects.get()
+        self.assertEqual(rendition.blob_id, document.blob_id)
+        self.assertEqual((rendition.width, rendition.height), (800, 800))
+
+    def test_rendition_fails_size_not_allowed(self):
+        document = self.create_image_document()
+        response = self.get(document, width=300, height=300)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Rendition.objects.exists())
+
+    def test_rendition_no_image(self):
+        document = mfactories.Document(
+            file_name='Document1.pdf',
+            file=SimpleUploadedFile('test1.pdf', b'some content'))
+        response = self.get(document, width=200, height=200)
+        self.assertEqual(response.status_code, 404)
+
+    def test_rendition_deleted_with_last_document(self):
+        document = self.create_image_document()
+        self.get(document, width=200, height=200)
+        rendition_name = Rendition.objects.get().file.name
+
+        with mock.patch('documents.models.transaction.on_commit',
+                        side_effect=lambda func: func()):
+            document.delete()
+        self.assertFalse(Rendition.objects.exists())
+        self.assertFalse(S3Boto3Storage().exists(rendition_name))
+
+
 """
 Comment our for now to test new library
 class DocumentProxyViewTest(TestCase):
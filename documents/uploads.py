@@ -0,0 +1,142 @@
+from botocore.exceptions import ClientError
+from django.core.files import File
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .models import Document
+from .storage import get_s3_key
+
+SESSION_PARTS_PATH = 'uploads/sessions/{}/'
+
+
+class ChunkedFile(object):
+    """
+    Read-only file object which reads the stored chunks one after the
+    other, so the parts never have to be held in memory together.
+    """
+    def __init__(self, storage, names):
+        self.storage = storage
+        self.names = list(names)
+        self.current = None
+
+    def read(self, size=-1):
+        data = b''
+        while size < 0 or len(data) < size:
+            if self.current is None:
+                if not self.names:
+                    break
+                self.current = self.storage.open(self.names.pop(0), 'rb')
+
+            block = self.current.read(-1 if size < 0 else size - len(data))
+            if not block:
+                self.current.close()
+                self.current = None
+                continue
+            data += block
+        return data
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
+class StorageChunkBackend(object):
+    """
+    Stores every chunk as its own object and concatenates them into the
+    final file on completion. Used for the local `FileSystemStorage`.
+    """
+    min_chunk_size = 1
+    max_chunk_count = 10000
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_part_name(self, session, number):
+        return SESSION_PARTS_PATH.format(session.uuid) + \
+            '{:05d}.part'.format(number)
+
+    def start(self, session):
+        pass
+
+    def save_chunk(self, session, number, content):
+        name = self.get_part_name(session, number)
+        # A chunk can be sent again, e.g. after a dropped connection
+        self.storage.delete(name)
+        self.storage.save(name, File(content, name=name))
+
+    def complete(self, session, chunks):
+        content = ChunkedFile(self.storage, [
+            self.get_part_name(session, chunk.number) for chunk in chunks])
+        try:
+            name = self.storage.save(session.file_path,
+                                     File(content, name=session.file_path))
+        finally:
+            content.close()
+
+        self.abort(session, chunks)
+        return name
+
+    def abort(self, session, chunks):
+        for chunk in chunks:
+            self.storage.delete(self.get_part_name(session, chunk.number))
+
+
+class S3MultipartBackend(object):
+    """
+    Sends every chunk as a part of an S3 multipart upload, S3 assembles
+    the final object on completion.
+    """
+    # S3 requires all parts except the last one to be at least 5 MiB
+    min_chunk_size = 5 * 1024 * 1024
+    max_chunk_count = 10000
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.client = storage.connection.meta.client
+
+    def _get_key(self, session):
+        return get_s3_key(self.storage, session.file_path)
+
+    def start(self, session):
+        key = self._get_key(session)
+        response = self.client.create_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=key,
+            **self.storage._get_write_parameters(key))
+        session.upload_id = response['UploadId']
+
+    def save_chunk(self, session, number, content):
+        response = self.client.upload_part(
+            Bucket=self.storage.bucket_name, Key=self._get_key(session),
+            UploadId=session.upload_id, PartNumber=number + 1, Body=content)
+        return response['ETag']
+
+    def complete(self, session, chunks):
+        self.client.complete_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=self._get_key(session),
+            UploadId=session.upload_id,
+            MultipartUpload={'Parts': [
+                {'ETag': chunk.etag, 'PartNumber': chunk.number + 1}
+                for chunk in chunks]})
+        return session.file_path
+
+    def abort(self, session, chunks):
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.storage.bucket_name, Key=self._get_key(session),
+                UploadId=session.upload_id)
+        except ClientError as err:
+            # Aborted before, e.g. by an expiry which did not finish
+            if err.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+
+
+def get_chunk_backend(storage=None):
+    """
+    Returns the chunk backend for the storage of `Document.file`.
+    """
+    if storage is None:
+        storage = Document._meta.get_field('file').storage
+
+    if isinstance(storage, S3Boto3Storage):
+        return S3MultipartBackend(storage)
+    return StorageChunkBackend(storage)
@@ -1,14 +1,38 @@
-from rest_framework import viewsets, filters
-from rest_framework.decorators import api_view
+import json
+import shutil
+from tempfile import SpooledTemporaryFile
+
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.decorators import method_decorator
-from rest_framework.parsers import MultiPartParser
+from rest_framework.parsers import JSONParser, MultiPartParser
 
+from .archives import stream_archive
 from .autoschema import DocumentSwaggerAutoSchema
-from .models import Document
-from .serializers import DocumentSerializer
+from .caching import get_cache, get_list_cache_key
+from .downloads import serve_file
+from .images import IMAGE_FORMATS, ImageTooLarge
+from .models import (Document, DocumentStatistic, WORKFLOWLEVEL1,
+                     WORKFLOWLEVEL2, UploadChunk, UploadSession)
+from .renditions import get_rendition
+from .search import (SEARCH_PARAM, DocumentOrderingFilter,
+                     DocumentSearchFilter)
+from .serializers import (DocumentSelectionSerializer, DocumentSerializer,
+                          DocumentStatisticsQuerySerializer,
+                          DocumentStatisticsSerializer, RenditionSerializer,
+                          UploadSessionSerializer,
+                          WorkflowlevelUpdateSerializer)
+from .tasks import schedule_blob_storage
+from .uploads import get_chunk_backend
 import django_filters
-from django.http import FileResponse
-from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotFound, StreamingHttpResponse
 
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
@@ -18,7 +42,24 @@ DOCUMENT_AUTO_SCHEMA = swagger_auto_schema(
         parser_classes=(MultiPartParser,),
 )
 
+FIELDS_PARAMETER = openapi.Parameter(
+    'fields', openapi.IN_QUERY,
+    description='Comma separated names of the fields to return.',
+    type=openapi.TYPE_STRING)
+
+# The search vector and the extracted text are only read by the database
+DATABASE_ONLY_FIELDS = ('search_vector', 'content_text')
+
+SEARCH_PARAMETER = openapi.Parameter(
+    SEARCH_PARAM, openapi.IN_QUERY,
+    description='Words of the file name or description, or a part of the '
+                'file name. The results are ordered by relevance unless an '
+                'ordering is given.',
+    type=openapi.TYPE_STRING)
 
+
+@method_decorator(name='retrieve', decorator=swagger_auto_schema(
+    manual_parameters=[FIELDS_PARAMETER]))
 @method_decorator(name='create', decorator=DOCUMENT_AUTO_SCHEMA)
 @method_decorator(name='update', decorator=DOCUMENT_AUTO_SCHEMA)
 @method_decorator(name='partial_update', decorator=DOCUMENT_AUTO_SCHEMA)
@@ -37,67 +78,433 @@ class DocumentViewSet(viewsets.ModelViewSet):
         'workflowlevel2_uuid', openapi.IN_QUERY,
         description='Filter by workflowlevel2_uuid.', type=openapi.TYPE_STRING)
 
-    @swagger_auto_schema(manual_parameters=[workflowlevel1_uuid,
-                                            workflowlevel2_uuid, ])
-    def list(self, request, *args, **kwargs):
+    def get_requested_fields(self):
+        """
+        Returns the field names of the `fields` query parameter of the list
+        and retrieve endpoints, or None if all fields are requested.
+        """
+        if self.request is None or self.action not in ('list', 'retrieve'):
+            return None
+        fields = {name.strip() for name in self.request.query_params.get(
+            'fields', '').split(',') if name.strip()}
+        if not fields:
+            return None
+
+        unknown = fields - set(DocumentSerializer().fields)
+        if unknown:
+            raise ValidationError({'fields': 'Unknown fields: {}.'.format(
+                ', '.join(sorted(unknown)))})
+        return fields
+
+    def get_queryset(self):
+        queryset = super(DocumentViewSet, self).get_queryset()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            # Only select the requested columns, the primary key and the
+            # ordering fields, which the cursor pagination reads
+            ordering = DocumentOrderingFilter().get_ordering(
+                self.request, queryset, self) or ()
+            ordering = {name.lstrip('-') for name in ordering}
+            queryset = queryset.only(
+                'id', *(fields | (ordering & set(self.ordering_fields))))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super(DocumentViewSet, self).get_serializer(*args, **kwargs)
+
+    def get_filtered_queryset(self):
+        """
+        Returns the documents matching the filters of the list.
+        """
         # Use this queryset or the django-filters lib will not work
         queryset = self.filter_queryset(self.get_queryset())
 
+        # Each workflowlevel filter joins its own DocumentWorkflowLevel row,
+        # whose unique index returns the documents of the workflowlevel in
+        # the order of their ids, wherever they are in the table
         workflowlevel1_uuid = self.request.query_params.get(
             'workflowlevel1_uuid', None)
         if workflowlevel1_uuid is not None:
             queryset = queryset.filter(
-                workflowlevel1_uuids__contains=[workflowlevel1_uuid])
+                workflowlevels__workflowlevel=WORKFLOWLEVEL1,
+                workflowlevels__workflowlevel_uuid=workflowlevel1_uuid)
 
         workflowlevel2_uuid = self.request.query_params.get(
             'workflowlevel2_uuid', None)
         if workflowlevel2_uuid is not None:
             queryset = queryset.filter(
-                workflowlevel2_uuids__contains=[workflowlevel2_uuid])
+                workflowlevels__workflowlevel=WORKFLOWLEVEL2,
+                workflowlevels__workflowlevel_uuid=workflowlevel2_uuid)
+
+        return queryset
+
+    @swagger_auto_schema(manual_parameters=[workflowlevel1_uuid,
+                                            workflowlevel2_uuid,
+                                            SEARCH_PARAMETER,
+                                            FIELDS_PARAMETER])
+    def list(self, request, *args, **kwargs):
+        timeout = settings.DOCUMENT_LIST_CACHE_TIMEOUT
+        if timeout:
+            cache_key = get_list_cache_key(request)
+            data = get_cache().get(cache_key)
+            if data is not None:
+                return Response(data)
+
+        queryset = self.get_filtered_queryset()
 
         page = self.paginate_queryset(queryset)
 
         serializer = self.get_serializer(page, many=True)
-        return self.get_paginated_response(serializer.data)
+        response = self.get_paginated_response(serializer.data)
+        if timeout:
+            get_cache().set(cache_key, response.data, timeout)
+        return response
+
+    @swagger_auto_schema(request_body=DocumentSerializer(many=True))
+    @action(detail=False, methods=['post'], url_path='bulk',
+            parser_classes=(JSONParser, MultiPartParser))
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        Creates several documents at once, from a JSON list of documents
+        with base64 files or from a multipart request with the list in the
+        `documents` field, where the `file` of a document names the file
+        part. Returns the result of every document in the order given.
+        """
+        items = self._get_bulk_items(request)
+
+        results = []
+        documents = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                results.append({'status': status.HTTP_400_BAD_REQUEST,
+                                'errors': serializer.errors})
+                continue
+
+            document = Document(**serializer.validated_data)
+            document.file_type = document.get_file_type()
+            try:
+                # The uuid is unique by default, this saves a query per item
+                document.full_clean(validate_unique=False)
+            except DjangoValidationError as exc:
+                results.append({
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': getattr(exc, 'message_dict', None) or
+                    {'non_field_errors': exc.messages}})
+                continue
+
+            results.append(None)
+            documents.append((index, document))
+
+        created = Document.objects.create_documents(
+            [document for index, document in documents])
+        for (index, _), document in zip(documents, created):
+            results[index] = {'status': status.HTTP_201_CREATED,
+                              'document': self.get_serializer(document).data}
+
+        if not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(created) < len(results):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response(results, status=response_status)
+
+    @swagger_auto_schema(request_body=WorkflowlevelUpdateSerializer,
+                         manual_parameters=[workflowlevel1_uuid,
+                                            workflowlevel2_uuid, ])
+    @action(detail=False, methods=['post'], url_path='workflowlevels')
+    def update_workflowlevels(self, request, *args, **kwargs):
+        """
+        Adds or removes a UUID in the workflowlevel1 or workflowlevel2 UUIDs
+        of all documents in `ids` or matching the filters of the list, with
+        a single UPDATE statement.
+        """
+        serializer = WorkflowlevelUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        queryset = self.get_selected_queryset(data.get('ids'))
+
+        if data['operation'] == WorkflowlevelUpdateSerializer.OPERATION_ADD:
+            updated = queryset.add_to_array(data['field'], data['uuid'])
+        else:
+            updated = queryset.remove_from_array(data['field'], data['uuid'])
+        return Response({'updated': updated})
+
+    @swagger_auto_schema(request_body=DocumentSelectionSerializer,
+                         manual_parameters=[workflowlevel1_uuid,
+                                            workflowlevel2_uuid, ])
+    @action(detail=False, methods=['post'], url_path='delete')
+    def bulk_destroy(self, request, *args, **kwargs):
+        """
+        Deletes all documents in `ids` or matching the filters of the list,
+        together with their stored files.
+        """
+        serializer = DocumentSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.get_selected_queryset(
+            serializer.validated_data.get('ids'))
+
+        _, deleted = queryset.delete()
+        return Response({'deleted': deleted.get(Document._meta.label, 0)})
+
+    @swagger_auto_schema(manual_parameters=[workflowlevel1_uuid,
+                                            workflowlevel2_uuid, ])
+    @action(detail=False, methods=['get'], url_path='archive')
+    def archive(self, request, *args, **kwargs):
+        """
+        Downloads the files of all documents matching the filters of the
+        list as a ZIP archive, which is streamed while it is built.
+        """
+        queryset = self.get_filtered_queryset()
+        response = StreamingHttpResponse(
+            stream_archive(queryset.iterator()),
+            content_type='application/zip')
+        response['Content-Disposition'] = \
+            'attachment; filename="documents.zip"'
+        return response
+
+    @swagger_auto_schema(query_serializer=DocumentStatisticsQuerySerializer,
+                         responses={200: DocumentStatisticsSerializer})
+    @action(detail=False, methods=['get'], url_path='statistics')
+    def statistics(self, request, *args, **kwargs):
+        """
+        Returns the number and total file size of the documents of an
+        organization and/or a workflowlevel, in total and per file type.
+        """
+        serializer = DocumentStatisticsQuerySerializer(
+            data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        file_types = DocumentStatistic.objects.get_file_types(
+            **serializer.validated_data)
+        return Response(DocumentStatisticsSerializer({
+            'document_count': sum(row['document_count']
+                                  for row in file_types),
+            'total_size': sum(row['total_size'] for row in file_types),
+            'file_types': file_types,
+        }).data)
+
+    def get_selected_queryset(self, ids=None):
+        """
+        Returns the documents in `ids` and matching the filters of the list.
+        Selecting all documents without any filter is not supported.
+        """
+        filter_fields = set(self.filter_fields) | {'workflowlevel1_uuid',
+                                                   'workflowlevel2_uuid',
+                                                   SEARCH_PARAM}
+        if ids is None and not filter_fields & set(self.request.query_params):
+            raise ValidationError(
+                'Filter the documents or provide their ids, changing all '
+                'documents at once is not supported.')
+
+        queryset = self.get_filtered_queryset()
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        return queryset
+
+    def _get_bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            try:
+                items = json.loads(request.data.get('documents') or '')
+            except ValueError:
+                raise ValidationError(
+                    {'documents': 'Expected a JSON list of documents.'})
+
+            if isinstance(items, list):
+                for item in items:
+                    file = isinstance(item, dict) and item.get('file')
+                    if isinstance(file, str) and file in request.FILES:
+                        item['file'] = request.FILES[file]
+
+        if not isinstance(items, list) or \
+                not all(isinstance(item, dict) for item in items):
+            raise ValidationError('Expected a list of documents.')
+        if not items or len(items) > settings.DOCUMENT_BULK_MAX_ITEMS:
+            raise ValidationError(
+                'Between 1 and {} documents can be created at once.'.format(
+                    settings.DOCUMENT_BULK_MAX_ITEMS))
+        return items
 
     ordering_fields = ('id', 'upload_date', 'create_date')
     ordering = ('id',)
     filter_fields = ('file_type', 'contact_uuid')
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,
-                       filters.OrderingFilter)
-    queryset = Document.objects.all()
+                       DocumentSearchFilter, DocumentOrderingFilter)
+    queryset = Document.objects.defer(*DATABASE_ONLY_FIELDS)
     serializer_class = DocumentSerializer
 
 
+class _LimitedReader(object):
+    """
+    Reads at most `limit` bytes from `stream`.
+    """
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable uploads. Create a session, PUT the raw bytes of every chunk
+    (zero-based, in any order) to `chunks/{number}/` and finalize it with
+    the document data to create the document.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def _check_open(self, session):
+        if session.document_id is not None:
+            raise ValidationError('Upload session is already finalized.')
+
+    @action(detail=True, methods=['put'],
+            url_path=r'chunks/(?P<number>[0-9]+)')
+    def chunks(self, request, number, *args, **kwargs):
+        session = self.get_object()
+        self._check_open(session)
+
+        number = int(number)
+        if number >= session.chunk_count:
+            raise ValidationError(
+                {'number': 'Chunk number must be lower than {}.'.format(
+                    session.chunk_count)})
+
+        expected_size = session.get_chunk_size(number)
+        content = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        stream = request.stream
+        if stream is not None:
+            # Read one byte more than expected to detect oversized chunks
+            shutil.copyfileobj(_LimitedReader(stream, expected_size + 1),
+                               content)
+        size = content.tell()
+        if size != expected_size:
+            content.close()
+            raise ValidationError(
+                'Chunk {} must be {} bytes, got {}.'.format(
+                    number, expected_size, size))
+
+        content.seek(0)
+        with content:
+            etag = get_chunk_backend().save_chunk(session, number, content)
+
+        UploadChunk.objects.update_or_create(
+            session=session, number=number,
+            defaults={'size': size, 'etag': etag})
+
+        serializer = self.get_serializer(session)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'], parser_classes=(JSONParser,))
+    def finalize(self, request, *args, **kwargs):
+        with transaction.atomic():
+            session = self.get_object()
+            session = UploadSession.objects.select_for_update().get(
+                pk=session.pk)
+            self._check_open(session)
+
+            chunks = list(session.chunks.order_by('number'))
+            if len(chunks) != session.chunk_count:
+                missing = set(range(session.chunk_count)) - \
+                    set(chunk.number for chunk in chunks)
+                raise ValidationError(
+                    {'missing_chunks': sorted(missing)})
+
+            data = dict(request.data)
+            data.setdefault('file_name', session.file_name)
+            data.pop('file', None)
+            serializer = DocumentSerializer(data=data)
+            # The file is assembled from the chunks
+            serializer.fields.pop('file')
+            serializer.is_valid(raise_exception=True)
+
+            file_path = get_chunk_backend().complete(session, chunks)
+            document = Document(file=file_path, file_size=session.size,
+                                file_modified_date=timezone.now(),
+                                **serializer.validated_data)
+            document.reset_file_statuses()
+            document.save()
+
+            session.document = document
+            session.save(update_fields=['document'])
+            session.chunks.all().delete()
+
+        # The assembled file is hashed and deduplicated after the commit,
+        # which also queues the thumbnail and the text extraction
+        schedule_blob_storage(document)
+
+        return Response(DocumentSerializer(document).data,
+                        status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        if instance.document_id is None:
+            get_chunk_backend().abort(instance, instance.chunks.all())
+        instance.delete()
+
+
 @api_view(['GET'])
 def document_thumbnail_view(request, id):
-    document = Document.objects.get(pk=id)
+    document = Document.objects.defer(*DATABASE_ONLY_FIELDS).get(pk=id)
     data = document.thumbnail
 
     if not data:
         return HttpResponseNotFound()
 
-    response = FileResponse(data)
-    response['Content-Disposition'] = \
-        'attachment; filename=thumbnail_%s' % document.file_name
+    return serve_file(request, data, 'thumbnail_%s' % document.file_name,
+                      size=document.thumbnail_size,
+                      modified_date=document.file_modified_date)
 
-    response['Content-Length'] = data.size
 
-    return response
+@swagger_auto_schema(method='get', query_serializer=RenditionSerializer)
+@api_view(['GET'])
+def document_rendition_view(request, id):
+    """
+    Resized image of the document file, generated on the first request.
+    """
+    document = get_object_or_404(Document.objects.select_related(
+        'blob').defer(*DATABASE_ONLY_FIELDS), pk=id)
+    serializer = RenditionSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+
+    if not document.file or document.file_type not in IMAGE_FORMATS:
+        return HttpResponseNotFound()
+
+    blob = document.blob or document.move_to_blob()
+    try:
+        rendition = get_rendition(blob, **serializer.validated_data)
+    except ImageTooLarge as exc:
+        raise ValidationError(str(exc))
+
+    file_name = '{}x{}_{}'.format(rendition.width, rendition.height,
+                                  document.file_name)
+    return serve_file(request, rendition.file, file_name)
 
 
 @api_view(['GET'])
 def document_download_view(request, id):
-    document = Document.objects.get(pk=id)
+    document = Document.objects.defer(*DATABASE_ONLY_FIELDS).get(pk=id)
     data = document.file
 
     if not data:
         return HttpResponseNotFound()
 
-    response = FileResponse(data)
-    response['Content-Disposition'] = \
-        'attachment; filename=%s' % document.file_name
-
-    response['Content-Length'] = data.size
-
-    return response
+    return serve_file(request, data, document.file_name,
+                      size=document.file_size,
+                      modified_date=document.file_modified_date,
+                      content_type=document.file_mime_type or None)
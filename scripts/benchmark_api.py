@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+"""
+Measures the throughput and latency of the documents API under a mixed
+workload, to compare runs across commits and gunicorn settings.
+
+DOCUMENTS documents with synthetic images and office files are seeded on
+local storage in a temporary MEDIA_ROOT, gunicorn is started with
+documents-service/gunicorn.conf.py (the database and the other settings
+are taken from the environment of this process) and every concurrency
+level runs for DURATION seconds. Each client repeats requests picked at
+random by the weights of --mix:
+
+    python scripts/benchmark_api.py --documents 2000 --concurrency 1 8 32 \\
+        --worker-class sync gevent --output results.json
+
+The seeded and created documents belong to a workflowlevel1 of their own
+and are deleted at the end. The same --seed gives the same documents and
+the same sequence of requests.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+from base64 import b64encode
+from io import BytesIO
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+OPERATIONS = ('list', 'page', 'retrieve', 'create_base64', 'create_multipart',
+              'download', 'thumbnail')
+DEFAULT_MIX = ('list=30,page=10,retrieve=20,create_base64=5,'
+               'create_multipart=5,download=15,thumbnail=15')
+IMAGE_TYPES = {'jpg': 'JPEG', 'png': 'PNG'}
+OFFICE_TYPES = ('pdf', 'docx', 'xlsx')
+WORDS = ('quarterly', 'report', 'invoice', 'contract', 'budget', 'meeting',
+         'project', 'delivery', 'summary', 'analysis')
+WORD_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+SHEET_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+def make_image(number, file_type, size):
+    from PIL import Image
+
+    # Every image differs, so every document is stored as a blob of its own
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.merge('RGB', [
+        gradient, Image.radial_gradient('L').resize(size),
+        gradient.rotate(90 + number % 180).resize(size)])
+    image.putpixel((0, 0), (number % 256, number // 256 % 256, 0))
+    content = BytesIO()
+    image.save(content, IMAGE_TYPES[file_type])
+    return content.getvalue()
+
+
+def make_zip(members):
+    content = BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return content.getvalue()
+
+
+def make_office_file(number, file_type, rng):
+    text = ' '.join(rng.choice(WORDS) for _ in range(200))
+    text = 'Document {} {}'.format(number, text)
+    if file_type == 'docx':
+        return make_zip({'word/document.xml': (
+            '<w:document xmlns:w="{}"><w:body><w:p><w:r><w:t>{}</w:t>'
+            '</w:r></w:p></w:body></w:document>'.format(WORD_NAMESPACE,
+                                                        text))})
+    if file_type == 'xlsx':
+        return make_zip({'xl/sharedStrings.xml': (
+            '<sst xmlns="{}">{}</sst>'.format(SHEET_NAMESPACE, ''.join(
+                '<si><t>{}</t></si>'.format(word)
+                for word in text.split())))})
+    stream = 'BT /F1 12 Tf ({}) Tj ET'.format(text).encode()
+    return (b'%PDF-1.4\n1 0 obj\n<< /Length ' + str(len(stream)).encode() +
+            b' >>\nstream\n' + stream + b'\nendstream\nendobj\n%%EOF\n')
+
+
+def make_file(number, rng, image_size):
+    """
+    Returns the name and the content of a synthetic file, half of them are
+    images.
+    """
+    if number % 2:
+        file_type = rng.choice(sorted(IMAGE_TYPES))
+        content = make_image(number, file_type, image_size)
+    else:
+        file_type = rng.choice(OFFICE_TYPES)
+        content = make_office_file(number, file_type, rng)
+    return '{} {}.{}'.format(rng.choice(WORDS).title(), number,
+                             file_type), content
+
+
+def seed(args, workflowlevel1_uuid):
+    """
+    Creates the benchmark user and the documents, returns the token, the
+    ids of the documents and of the documents with a thumbnail and the
+    values the list is filtered by.
+    """
+    from django.contrib.auth.models import User
+    from django.core.files.base import ContentFile
+    from rest_framework.authtoken.models import Token
+    from documents.models import Document
+
+    user, _ = User.objects.get_or_create(username='benchmark')
+    token, _ = Token.objects.get_or_create(user=user)
+
+    rng = random.Random(args.seed)
+    contacts = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(20)]
+    workflowlevel2s = [str(uuid.UUID(int=rng.getrandbits(128)))
+                       for _ in range(50)]
+    for start in range(0, args.documents, 100):
+        documents = []
+        for number in range(start, min(start + 100, args.documents)):
+            name, content = make_file(number, rng, args.image_size)
+            document = Document(
+                file_name=name, file=ContentFile(content, name=name),
+                file_description=' '.join(rng.sample(WORDS, 3)),
+                contact_uuid=rng.choice(contacts),
+                workflowlevel1_uuids=[workflowlevel1_uuid],
+                workflowlevel2_uuids=[rng.choice(workflowlevel2s)])
+            document.file_type = document.get_file_type()
+            documents.append(document)
+        # The thumbnails are generated once the batch is committed, inline
+        # without a celery broker
+        Document.objects.create_documents(documents)
+
+    documents = Document.objects.filter(
+        workflowlevel1_uuids__contains=[workflowlevel1_uuid])
+    return {
+        'token': token.key,
+        'ids': list(documents.values_list('id', flat=True)),
+        'thumbnail_ids': list(documents.exclude(thumbnail='').exclude(
+            thumbnail=None).values_list('id', flat=True)),
+        'contacts': contacts,
+        'workflowlevel2s': workflowlevel2s,
+        'workflowlevel1': workflowlevel1_uuid,
+    }
+
+
+def delete_documents(workflowlevel1_uuid):
+    from documents.models import Document
+
+    Document.objects.filter(
+        workflowlevel1_uuids__contains=[workflowlevel1_uuid]).delete()
+
+
+async def request(host, port, method, path, headers, body=b''):
+    """
+    Sends a request and reads the whole response, returns the status and
+    the body. The body is not decoded, which is enough for the JSON
+    responses (which have a Content-Length) and the discarded downloads.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = '{} {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n'.format(
+            method, path, host)
+        head += ''.join('{}: {}\r\n'.format(*header)
+                        for header in headers.items())
+        head += 'Content-Length: {}\r\n\r\n'.format(len(body))
+        writer.write(head.encode() + body)
+        response = await reader.read()
+    finally:
+        writer.close()
+    status_line, _, rest = response.partition(b'\r\n')
+    if not status_line:
+        raise OSError('The connection was closed without a response')
+    return int(status_line.split()[1]), rest.partition(b'\r\n\r\n')[2]
+
+
+class Client(object):
+    """
+    Runs the operations of the workload, every operation returns the
+    status and the seconds of each of its requests.
+    """
+    def __init__(self, args, data, rng):
+        self.args = args
+        self.data = data
+        self.rng = rng
+        self.headers = {'Authorization': 'Token ' + data['token']}
+
+    async def call(self, method, path, headers=None, body=b''):
+        start = time.perf_counter()
+        status, content = await asyncio.wait_for(request(
+            self.args.host, self.args.port, method, path,
+            dict(self.headers, **(headers or {})), body), self.args.timeout)
+        return status, time.perf_counter() - start, content
+
+    def get_filter(self):
+        data = self.data
+        return self.rng.choice((
+            'file_type=' + self.rng.choice(sorted(IMAGE_TYPES) +
+                                           list(OFFICE_TYPES)),
+            'contact_uuid=' + self.rng.choice(data['contacts']),
+            'workflowlevel2_uuid=' + self.rng.choice(data['workflowlevel2s']),
+            'workflowlevel1_uuid=' + data['workflowlevel1'],
+            'ordering=-upload_date',
+            'search=' + self.rng.choice(WORDS)))
+
+    async def list(self):
+        status, seconds, _ = await self.call('GET', '/documents/?{}'.format(
+            self.get_filter()))
+        return [(status, seconds)]
+
+    async def page(self):
+        # Follows the cursor of the workflowlevel1 list for a few pages
+        path = '/documents/?page_size={}&workflowlevel1_uuid={}'.format(
+            self.args.page_size, self.data['workflowlevel1'])
+        results = []
+        while path and len(results) < self.args.pages:
+            status, seconds, content = await self.call('GET', path)
+            results.append((status, seconds))
+            if status != 200:
+                break
+            path = json.loads(content.decode())['next']
+            if path:
+                path = path[path.index('/documents/'):]
+        return results
+
+    async def retrieve(self):
+        status, seconds, _ = await self.call('GET', '/documents/{}/'.format(
+            self.rng.choice(self.data['ids'])))
+        return [(status, seconds)]
+
+    def make_upload(self):
+        name, content = make_file(self.rng.getrandbits(31), self.rng,
+                                  self.args.image_size)
+        return name, content
+
+    async def create_base64(self):
+        name, content = self.make_upload()
+        file_type = name.split('.')[-1]
+        body = json.dumps({
+            'file_name': name,
+            'file': 'data:application/{};base64,{}'.format(
+                file_type, b64encode(content).decode()),
+            'workflowlevel1_uuids': [self.data['workflowlevel1']],
+        }).encode()
+        status, seconds, _ = await self.call(
+            'POST', '/documents/', {'Content-Type': 'application/json'},
+            body)
+        return [(status, seconds)]
+
+    async def create_multipart(self):
+        name, content = self.make_upload()
+        boundary = uuid.uuid4().hex
+        fields = [('file_name', name),
+                  ('workflowlevel1_uuids', self.data['workflowlevel1'])]
+        body = b''.join(
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+            '{}\r\n'.format(boundary, field, value).encode()
+            for field, value in fields)
+        body += ('--{}\r\nContent-Disposition: form-data; name="file"; '
+                 'filename="{}"\r\nContent-Type: application/octet-stream'
+                 '\r\n\r\n'.format(boundary, name)).encode()
+        body += content + '\r\n--{}--\r\n'.format(boundary).encode()
+        status, seconds, _ = await self.call(
+            'POST', '/documents/', {
+                'Content-Type': 'multipart/form-data; boundary=' + boundary},
+            body)
+        return [(status, seconds)]
+
+    async def download(self):
+        status, seconds, _ = await self.call('GET', '/file/{}/'.format(
+            self.rng.choice(self.data['ids'])))
+        return [(status, seconds)]
+
+    async def thumbnail(self):
+        status, seconds, _ = await self.call('GET', '/thumbnail/{}/'.format(
+            self.rng.choice(self.data['thumbnail_ids'])))
+        return [(status, seconds)]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                'Unknown operation {}'.format(operation))
+        mix[operation] = float(weight)
+    return mix
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    # Milliseconds, nearest rank
+    index = max(int(math.ceil(len(values) * percent / 100)) - 1, 0)
+    return round(values[index] * 1000, 2)
+
+
+def summarize(results, seconds):
+    latencies = [latency for _, latency in results if latency is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for status, _ in results
+                      if status is None or status >= 400),
+        'throughput': round(len(results) / seconds, 2),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': percentile(latencies, 100),
+        },
+    }
+
+
+async def run_level(args, data, concurrency, seconds, seed):
+    operations = sorted(args.mix)
+    weights = [args.mix[operation] for operation in operations]
+    results = {operation: [] for operation in operations}
+    deadline = time.perf_counter() + seconds
+
+    async def run_client(number):
+        rng = random.Random('{}-{}-{}'.format(seed, concurrency, number))
+        client = Client(args, data, rng)
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            try:
+                results[operation] += await getattr(client, operation)()
+            except (asyncio.TimeoutError, OSError):
+                results[operation].append((None, None))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(number)
+                           for number in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    result = dict(concurrency=concurrency, seconds=round(duration, 3),
+                  **summarize(sum(results.values(), []), duration))
+    result['operations'] = {operation: summarize(results[operation],
+                                                 duration)
+                            for operation in operations}
+    return result
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The server did not start on port {}'.format(port))
+
+
+def start_server(args, worker_class):
+    environment = dict(os.environ,
+                       GUNICORN_WORKER_CLASS=worker_class,
+                       GUNICORN_WORKERS=str(args.workers),
+                       GUNICORN_BIND='{}:{}'.format(args.host, args.port))
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'documents-service/gunicorn.conf.py',
+         'documents-service.wsgi'], cwd=BASE_DIR, env=environment)
+    wait_for_port(args.host, args.port)
+    return server
+
+
+def measure(args, data, worker_class):
+    server = start_server(args, worker_class)
+    loop = asyncio.get_event_loop()
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            if args.warmup:
+                loop.run_until_complete(run_level(
+                    args, data, concurrency, args.warmup, 'warmup'))
+            levels.append(loop.run_until_complete(run_level(
+                args, data, concurrency, args.duration, args.seed)))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return {'worker_class': worker_class, 'workers': args.workers,
+            'levels': levels}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+    # Read by the settings of this process and of the started gunicorn
+    os.environ.update(
+        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+        MEDIA_ROOT=media_root)
+
+    import django
+    django.setup()
+
+    workflowlevel1_uuid = str(uuid.uuid4())
+    try:
+        start = time.perf_counter()
+        data = seed(args, workflowlevel1_uuid)
+        seed_seconds = time.perf_counter() - start
+        runs = [measure(args, data, worker_class)
+                for worker_class in args.worker_class]
+    finally:
+        if not args.keep:
+            delete_documents(workflowlevel1_uuid)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    result = {
+        'commit': get_commit(),
+        'documents': args.documents,
+        'seed': args.seed,
+        'seed_seconds': round(seed_seconds, 3),
+        'duration': args.duration,
+        'mix': args.mix,
+        'runs': runs,
+    }
+    if args.keep:
+        result['media_root'] = media_root
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--documents', type=int, default=1000,
+                        help='Documents seeded before the measurement.')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 8, 32],
+                        help='Clients sending requests at once.')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds measured per concurrency level.')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='Seconds run before every level, not '
+                             'measured.')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Weights of the operations, default '
+                             '{}.'.format(DEFAULT_MIX))
+    parser.add_argument('--pages', type=int, default=5,
+                        help='Pages read by the page operation.')
+    parser.add_argument('--page-size', type=int, default=30)
+    parser.add_argument('--image-size', type=lambda value: tuple(
+        int(side) for side in value.split('x')), default=(1024, 768),
+        help='WIDTHxHEIGHT of the generated images.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--worker-class', nargs='+', default=['sync'],
+                        help='Start gunicorn with these worker classes.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Worker processes of the started gunicorn.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='Seconds after which a request fails.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the seeded documents and files.')
+    parser.add_argument('--output', help='File of the JSON report, '
+                                         'standard output by default.')
+    args = parser.parse_args()
+
+    result = main(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
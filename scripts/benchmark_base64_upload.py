@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Measures the peak memory used to decode base64 uploads with
+``Base64FileField`` compared to decoding the whole string at once.
+
+Every measurement runs in its own process, the reported value is the
+growth of the peak RSS caused by the decoding, on top of the base64 text
+which is already held by the parsed request body:
+
+    python scripts/benchmark_base64_upload.py --sizes 10 50 200
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+MB = 1024 * 1024
+
+
+def peak_rss():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def decode_legacy(data):
+    from django.core.files.base import ContentFile
+
+    format, filestr = data.split(';base64,')
+    return ContentFile(base64.b64decode(filestr), name='legacy.pdf')
+
+
+def decode_streaming(data):
+    from django.test import override_settings
+    from documents.serializers import Base64FileField
+
+    with override_settings(DOCUMENT_MAX_UPLOAD_SIZE=0):
+        return Base64FileField().to_internal_value(data)
+
+
+def measure(mode, size):
+    import django
+    django.setup()
+
+    data = 'data:application/pdf;base64,' + \
+        base64.b64encode(os.urandom(size)).decode()
+    before = peak_rss()
+
+    start = time.perf_counter()
+    decoded = {'legacy': decode_legacy,
+               'streaming': decode_streaming}[mode](data)
+    duration = time.perf_counter() - start
+
+    assert decoded.size == size
+    return {
+        'mode': mode,
+        'size_mb': size / MB,
+        'decode_seconds': round(duration, 3),
+        'peak_rss_growth_mb': round((peak_rss() - before) / MB, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 50, 100, 200],
+                        help='Decoded file sizes in MB.')
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'SIZE'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        mode, size = args.measure
+        print(json.dumps(measure(mode, int(size))))
+        sys.exit()
+
+    results = []
+    for size in args.sizes:
+        for mode in ('legacy', 'streaming'):
+            output = subprocess.check_output([
+                sys.executable, __file__, '--measure', mode,
+                str(size * MB)])
+            results.append(json.loads(output.decode()))
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Measures how many slow downloads the service serves at once and how
+responsive it stays meanwhile, for each gunicorn worker class.
+
+Every worker class is started with documents-service/gunicorn.conf.py
+(the environment of the service, e.g. the database, is taken from this
+process). CLIENTS connections download PATH at RATE bytes per second while
+a probe requests PROBE_PATH every half second:
+
+    python scripts/benchmark_concurrent_downloads.py --path /file/1/ \\
+        --header 'Authorization: Token ...' --clients 500 \\
+        --worker-class sync gevent
+
+Without --worker-class the service running at --host and --port is
+measured.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_SIZE = 16 * 1024
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * percent / 100),
+                            len(values) - 1)], 3)
+
+
+async def request(host, port, path, headers, rate=None):
+    """
+    Downloads `path`, at `rate` bytes per second if given. Returns the
+    seconds to the status line and to the end of the body and the status.
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(('GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n'
+                      '{}\r\n').format(path, host, ''.join(
+                          header + '\r\n' for header in headers)).encode())
+        status_line = await reader.readline()
+        first_byte = time.perf_counter() - start
+        status = int(status_line.split()[1]) if status_line else None
+
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            if rate:
+                await asyncio.sleep(len(data) / rate)
+        return first_byte, time.perf_counter() - start, status
+    finally:
+        writer.close()
+
+
+async def probe(host, port, path, headers, stop, timeout):
+    latencies = []
+    failures = 0
+    while not stop.is_set():
+        try:
+            _, latency, status = await asyncio.wait_for(
+                request(host, port, path, headers), timeout)
+            if status != 200:
+                failures += 1
+            latencies.append(latency)
+        except (asyncio.TimeoutError, OSError):
+            failures += 1
+        await asyncio.sleep(0.5)
+    return latencies, failures
+
+
+async def run_load(args):
+    stop = asyncio.Event()
+    probe_task = asyncio.ensure_future(probe(
+        args.host, args.port, args.probe_path, args.header, stop,
+        args.timeout))
+
+    async def download():
+        try:
+            return await asyncio.wait_for(request(
+                args.host, args.port, args.path, args.header, args.rate),
+                args.timeout)
+        except (asyncio.TimeoutError, OSError) as exc:
+            return exc
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(download()
+                                     for _ in range(args.clients)))
+    duration = time.perf_counter() - start
+    stop.set()
+    probe_latencies, probe_failures = await probe_task
+
+    completed = [result for result in results
+                 if isinstance(result, tuple) and result[2] == 200]
+    return {
+        'clients': args.clients,
+        'completed': len(completed),
+        'failed': args.clients - len(completed),
+        'seconds': round(duration, 3),
+        'first_byte_p50': percentile([r[0] for r in completed], 50),
+        'first_byte_p95': percentile([r[0] for r in completed], 95),
+        'download_p50': percentile([r[1] for r in completed], 50),
+        'download_p95': percentile([r[1] for r in completed], 95),
+        'probe_requests': len(probe_latencies) + probe_failures,
+        'probe_failed': probe_failures,
+        'probe_p50': percentile(probe_latencies, 50),
+        'probe_p95': percentile(probe_latencies, 95),
+    }
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The server did not start on port {}'.format(port))
+
+
+def start_server(args, worker_class):
+    environment = dict(os.environ,
+                       GUNICORN_WORKER_CLASS=worker_class,
+                       GUNICORN_WORKERS=str(args.workers),
+                       GUNICORN_BIND='{}:{}'.format(args.host, args.port))
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'documents-service/gunicorn.conf.py',
+         'documents-service.wsgi'], cwd=BASE_DIR, env=environment)
+    wait_for_port(args.host, args.port)
+    return server
+
+
+def measure(args, worker_class=None):
+    server = start_server(args, worker_class) if worker_class else None
+    try:
+        result = asyncio.get_event_loop().run_until_complete(run_load(args))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+    if worker_class:
+        result = dict(worker_class=worker_class, workers=args.workers,
+                      **result)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--path', required=True,
+                        help='Path of a download, e.g. /file/1/.')
+    parser.add_argument('--probe-path', default='/health_check/')
+    parser.add_argument('--header', action='append', default=[],
+                        help='Request header, e.g. "Authorization: ...".')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--rate', type=int, default=64 * 1024,
+                        help='Bytes per second read by every client.')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='Seconds after which a request fails.')
+    parser.add_argument('--worker-class', nargs='+',
+                        help='Start gunicorn with these worker classes.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Worker processes of the started gunicorn.')
+    args = parser.parse_args()
+
+    if args.worker_class:
+        results = [measure(args, worker_class)
+                   for worker_class in args.worker_class]
+    else:
+        results = [measure(args)]
+    json.dump(results, sys.stdout, indent=2)
+    print()
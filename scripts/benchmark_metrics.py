@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Measures the time MetricsMiddleware adds to a request, in the memory of
+one process and in the multiprocess mode used with several gunicorn
+workers, where every value is written to a memory mapped file:
+
+    python scripts/benchmark_metrics.py --requests 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+
+def measure(requests):
+    import django
+    django.setup()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from documents.metrics import MetricsMiddleware
+    from documents.views import document_download_view
+
+    request = RequestFactory().get('/file/1/')
+    response = HttpResponse(b'content')
+
+    def get_response(request):
+        return response
+
+    def get_response_with_view(request):
+        middleware.process_view(request, document_download_view, (), {})
+        return response
+
+    middleware = MetricsMiddleware(get_response_with_view)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        get_response(request)
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        middleware(request)
+    with_metrics = time.perf_counter() - start
+
+    return {
+        'requests': requests,
+        'multiprocess': bool(os.environ.get('prometheus_multiproc_dir')),
+        'overhead_us_per_request': round(
+            (with_metrics - baseline) / requests * 1000000, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--measure', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.requests)))
+        sys.exit()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # The mode is chosen when prometheus_client is imported, so every
+        # mode is measured in its own process
+        for environment in ({}, {'prometheus_multiproc_dir': directory}):
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--measure',
+                 '--requests', str(args.requests)],
+                env=dict(os.environ, **environment))
+            results.append(json.loads(output.decode()))
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Measures the time and peak memory to create a thumbnail with the reduced
+decoding of ``documents.images`` compared to decoding the full image.
+
+A corpus of JPEG, PNG and GIF images is generated at the given resolutions,
+every thumbnail is created in its own process and the reported memory is
+the growth of the peak RSS while creating it:
+
+    python scripts/benchmark_thumbnails.py --megapixels 1 12 40
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+MB = 1024 * 1024
+FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
+
+
+def peak_rss():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def generate_image(path, megapixels, image_format):
+    from PIL import Image
+
+    width = int(math.sqrt(megapixels * 1000 * 1000 * 4 / 3))
+    size = (width, width * 3 // 4)
+    gradient = Image.linear_gradient('L')
+    bands = [gradient.resize(size), Image.radial_gradient('L').resize(size),
+             gradient.rotate(90).resize(size)]
+    if image_format == 'GIF':
+        image = bands[1]
+    else:
+        image = Image.merge('RGB', bands)
+    image.save(path, image_format)
+    return size
+
+
+def create_thumbnail(mode, path, output):
+    from django.test import override_settings
+    from PIL import Image
+    from documents.images import make_resized_file, resize_image
+    from documents.models import THUMBNAIL_DIMENSIONS
+
+    file_type = path.split('.')[-1]
+    with open(path, 'rb') as file:
+        if mode == 'full':
+            image = resize_image(Image.open(file), THUMBNAIL_DIMENSIONS)
+            image.save(output, FORMATS[file_type])
+        else:
+            with override_settings(DOCUMENT_IMAGE_MAX_PIXELS=0):
+                thumbnail = make_resized_file(file, file_type,
+                                              THUMBNAIL_DIMENSIONS)
+            with open(output, 'wb') as output_file:
+                output_file.write(thumbnail.read())
+
+
+def measure(mode, path, output):
+    import django
+    django.setup()
+
+    before = peak_rss()
+    start = time.perf_counter()
+    create_thumbnail(mode, path, output)
+    duration = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'seconds': round(duration, 3),
+        'peak_rss_growth_mb': round((peak_rss() - before) / MB, 1),
+    }
+
+
+def mean_difference(path_a, path_b):
+    from PIL import Image, ImageChops, ImageStat
+
+    difference = ImageChops.difference(Image.open(path_a).convert('RGB'),
+                                       Image.open(path_b).convert('RGB'))
+    return round(max(ImageStat.Stat(difference).mean), 2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--megapixels', type=int, nargs='+',
+                        default=[1, 12, 40],
+                        help='Resolutions of the generated images.')
+    parser.add_argument('--formats', nargs='+', default=sorted(FORMATS),
+                        choices=sorted(FORMATS))
+    parser.add_argument('--measure', nargs=3,
+                        metavar=('MODE', 'PATH', 'OUTPUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        sys.exit()
+
+    results = []
+    with tempfile.TemporaryDirectory() as corpus:
+        for megapixels in args.megapixels:
+            for file_type in args.formats:
+                path = os.path.join(corpus, '{}mp.{}'.format(megapixels,
+                                                             file_type))
+                size = generate_image(path, megapixels, FORMATS[file_type])
+
+                result = {'format': file_type, 'size': '{}x{}'.format(*size)}
+                outputs = {}
+                for mode in ('full', 'reduced'):
+                    outputs[mode] = os.path.join(
+                        corpus, '{}_{}'.format(mode, os.path.basename(path)))
+                    output = subprocess.check_output([
+                        sys.executable, __file__, '--measure', mode, path,
+                        outputs[mode]])
+                    measurement = json.loads(output.decode())
+                    result[mode] = {key: measurement[key] for key in (
+                        'seconds', 'peak_rss_growth_mb')}
+
+                result['speedup'] = round(
+                    result['full']['seconds'] /
+                    max(result['reduced']['seconds'], 0.001), 1)
+                # Mean absolute difference per channel, 0-255
+                result['mean_difference'] = mean_difference(
+                    outputs['full'], outputs['reduced'])
+                results.append(result)
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Compares query plans and latency of the first list page filtered by
+workflowlevel without an index, with the GIN indexes on
+``workflowlevel1_uuids`` / ``workflowlevel2_uuids`` and with the
+``DocumentWorkflowLevel`` table used by ``DocumentViewSet.list``.
+
+The rows are seeded into scratch copies of the tables, so the real data is
+not touched. With ``--layout clustered`` the documents of a workflowlevel1
+have consecutive ids, the last workflowlevel1 is then found at the end of
+an index scan in id order. Run it against a development database:
+
+    python scripts/benchmark_workflowlevel_filters.py --rows 3000000 \\
+        --layout clustered
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'documents-service.settings.base')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from documents.models import (Document, DocumentWorkflowLevel,  # noqa: E402
+                              WORKFLOWLEVEL1, WORKFLOWLEVEL2)
+
+BENCH_TABLE = 'bench_documents_document'
+BENCH_WORKFLOWLEVEL_TABLE = 'bench_documents_documentworkflowlevel'
+GIN_INDEXES = {
+    'bench_wfl1_uuids_gin': 'workflowlevel1_uuids',
+    'bench_wfl2_uuids_gin': 'workflowlevel2_uuids',
+}
+WORKFLOWLEVEL_INDEX = 'bench_workflowlevel_uniq'
+VARIANTS = ('without_index', 'gin', 'workflowlevel_table')
+
+
+def seed(cursor, rows, wfl1_count, wfl2_count, layout):
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(BENCH_TABLE))
+    # INCLUDING DEFAULTS keeps the id sequence, the GIN indexes are
+    # created explicitly below so all variants can be measured.
+    cursor.execute(
+        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS '
+        'INCLUDING CONSTRAINTS)'.format(BENCH_TABLE, Document._meta.db_table))
+    cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id)'.format(BENCH_TABLE))
+    # Only the columns of the filters are seeded, the model defaults of
+    # the others are not database defaults.
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = %s AND is_nullable = 'NO' AND column_name <> 'id'",
+        [BENCH_TABLE])
+    for column, in cursor.fetchall():
+        cursor.execute('ALTER TABLE {} ALTER COLUMN {} DROP NOT NULL'.format(
+            BENCH_TABLE, column))
+
+    if layout == 'clustered':
+        workflowlevel1 = '(i - 1) * %(wfl1)s / %(rows)s'
+    else:
+        workflowlevel1 = 'i %% %(wfl1)s'
+    cursor.execute("""
+        INSERT INTO {table} (id, uuid, file_name, file_type, file,
+                             thumbnail, contact_uuid, workflowlevel1_uuids,
+                             workflowlevel2_uuids)
+        SELECT i,
+               md5(i::text)::uuid,
+               'file' || i || '.pdf',
+               'pdf',
+               '',
+               '',
+               md5((i %% 5000)::text)::uuid::text,
+               ARRAY[md5('wfl1-' || ({workflowlevel1}))::uuid::text],
+               ARRAY[md5('wfl2-' || (i %% %(wfl2)s))::uuid::text,
+                     md5('wfl2-' || ((i * 7) %% %(wfl2)s))::uuid::text]
+        FROM generate_series(1, %(rows)s) AS i
+    """.replace('{table}', BENCH_TABLE).replace('{workflowlevel1}',
+                                                workflowlevel1),
+        {'rows': rows, 'wfl1': wfl1_count, 'wfl2': wfl2_count})
+
+    # What the documents_document_workflowlevels trigger maintains
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(
+        BENCH_WORKFLOWLEVEL_TABLE))
+    cursor.execute(
+        'CREATE TABLE {} (document_id integer, workflowlevel varchar(20), '
+        'workflowlevel_uuid varchar(36))'.format(BENCH_WORKFLOWLEVEL_TABLE))
+    cursor.execute("""
+        INSERT INTO {workflowlevels}
+        SELECT DISTINCT id, %s, unnest(workflowlevel1_uuids) FROM {table}
+        UNION
+        SELECT DISTINCT id, %s, unnest(workflowlevel2_uuids) FROM {table}
+    """.format(table=BENCH_TABLE, workflowlevels=BENCH_WORKFLOWLEVEL_TABLE),
+        [WORKFLOWLEVEL1, WORKFLOWLEVEL2])
+
+
+def set_variant(cursor, variant):
+    for name in list(GIN_INDEXES) + [WORKFLOWLEVEL_INDEX]:
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(name))
+    if variant == 'gin':
+        for name, column in GIN_INDEXES.items():
+            cursor.execute('CREATE INDEX {} ON {} USING gin ({})'.format(
+                name, BENCH_TABLE, column))
+    elif variant == 'workflowlevel_table':
+        cursor.execute(
+            'CREATE UNIQUE INDEX {} ON {} (workflowlevel, '
+            'workflowlevel_uuid, document_id)'.format(
+                WORKFLOWLEVEL_INDEX, BENCH_WORKFLOWLEVEL_TABLE))
+    cursor.execute('ANALYZE {}'.format(BENCH_TABLE))
+    cursor.execute('ANALYZE {}'.format(BENCH_WORKFLOWLEVEL_TABLE))
+
+
+def get_querysets(cursor, variant, wfl1_count):
+    """
+    Returns the querysets of the first workflowlevel1, the last one, a
+    workflowlevel2 and both combined, filtered with array containment or
+    the way the list view filters them.
+    """
+    cursor.execute("SELECT md5('wfl1-0')::uuid::text, "
+                   "md5('wfl1-' || %s)::uuid::text, "
+                   "md5('wfl2-1')::uuid::text", [wfl1_count - 1])
+    first_wfl1_uuid, last_wfl1_uuid, wfl2_uuid = cursor.fetchone()
+
+    def workflowlevel1(queryset, value):
+        if variant == 'workflowlevel_table':
+            return queryset.filter(
+                workflowlevels__workflowlevel=WORKFLOWLEVEL1,
+                workflowlevels__workflowlevel_uuid=value)
+        return queryset.filter(workflowlevel1_uuids__contains=[value])
+
+    def workflowlevel2(queryset, value):
+        if variant == 'workflowlevel_table':
+            return queryset.filter(
+                workflowlevels__workflowlevel=WORKFLOWLEVEL2,
+                workflowlevels__workflowlevel_uuid=value)
+        return queryset.filter(workflowlevel2_uuids__contains=[value])
+
+    documents = Document.objects.all()
+    return {
+        'workflowlevel1_first': workflowlevel1(documents, first_wfl1_uuid),
+        'workflowlevel1_last': workflowlevel1(documents, last_wfl1_uuid),
+        'workflowlevel2': workflowlevel2(documents, wfl2_uuid),
+        'workflowlevel1_and_2': workflowlevel2(
+            workflowlevel1(documents, first_wfl1_uuid), wfl2_uuid),
+    }
+
+
+def get_sql(queryset, page_size):
+    """
+    Builds the SQL the way the list view does and points it to the scratch
+    tables.
+    """
+    # The cursor paginator fetches one row more than the page size
+    sql, params = queryset.order_by('id')[:page_size + 1]\
+        .query.sql_with_params()
+    for table, bench_table in (
+            (Document._meta.db_table, BENCH_TABLE),
+            (DocumentWorkflowLevel._meta.db_table,
+             BENCH_WORKFLOWLEVEL_TABLE)):
+        sql = sql.replace('"{}"'.format(table), '"{}"'.format(bench_table))
+    return sql, params
+
+
+def measure(cursor, sql, params, repeat):
+    cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0][0]
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'plan_nodes': sorted(set(_plan_nodes(plan['Plan']))),
+        'execution_ms': plan['Execution Time'],
+        'latency_ms_median': round(statistics.median(timings), 3),
+        'latency_ms_max': round(max(timings), 3),
+    }
+
+
+def _plan_nodes(node):
+    name = node['Node Type']
+    if 'Index Name' in node:
+        name = '{} ({})'.format(name, node['Index Name'])
+    yield name
+    for child in node.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=3000000)
+    parser.add_argument('--workflowlevel1-count', type=int, default=1000)
+    parser.add_argument('--workflowlevel2-count', type=int, default=20000)
+    parser.add_argument('--layout', choices=('interleaved', 'clustered'),
+                        default='interleaved',
+                        help='Spread the documents of a workflowlevel1 '
+                             'over the table or give them consecutive ids.')
+    parser.add_argument('--page-size', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keep-table', action='store_true',
+                        help='Do not drop the scratch tables at the end.')
+    args = parser.parse_args()
+
+    results = {'rows': args.rows, 'layout': args.layout}
+    with connection.cursor() as cursor:
+        seed(cursor, args.rows, args.workflowlevel1_count,
+             args.workflowlevel2_count, args.layout)
+        for variant in VARIANTS:
+            set_variant(cursor, variant)
+            results[variant] = {}
+            querysets = get_querysets(cursor, variant,
+                                      args.workflowlevel1_count)
+            for name, queryset in querysets.items():
+                sql, params = get_sql(queryset, args.page_size)
+                results[variant][name] = measure(cursor, sql, params,
+                                                 args.repeat)
+        if not args.keep_table:
+            cursor.execute('DROP TABLE {}, {}'.format(
+                BENCH_TABLE, BENCH_WORKFLOWLEVEL_TABLE))
+
+    print(json.dumps(results, indent=2))